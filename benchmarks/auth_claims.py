@@ -0,0 +1,110 @@
+"""
+Throughput of read endpoints authenticated with the full user against the claims of the token.
+
+get_current_active_user finds the user in the worker cache, in Redis or in the database,
+get_current_active_claims only verifies the token and its revocation status.
+Requests run in-process against a real Redis, with a fixed number of them in flight.
+With --no-filter the revocation Bloom filter is not loaded and every revocation check goes to Redis.
+
+    python -m benchmarks.auth_claims --requests 2000 --concurrency 20
+"""
+import argparse
+import asyncio
+import time
+
+from fastapi import Depends
+
+from benchmarks.common import BenchSession, api_client, execute, print_table, reset_schema, seed_images, seed_users
+from main import app
+from svitlogram.database.models import User
+from svitlogram.services.auth import (
+    AuthService, TokenClaims, get_current_active_claims, get_current_active_user,
+)
+from svitlogram.services.revocation import revocation_store
+from svitlogram.services.user_cache import user_cache
+
+ENDPOINTS = ["/api/tags/?limit=10", "/api/tags/1", "/api/images/1", "/api/images/comments/1"]
+
+
+async def full_user_claims(user=Depends(get_current_active_user)) -> TokenClaims:
+    return TokenClaims(id=user.id, role=user.role, is_active=user.is_active)
+
+
+async def throughput(client, url: str, headers: dict, requests: int, concurrency: int) -> float:
+    """
+    The throughput function sends the requests with at most concurrency of them in flight.
+
+    :param client: httpx.AsyncClient: The client bound to the application
+    :param url: str: The endpoint to call
+    :param headers: dict: The headers of every request
+    :param requests: int: The number of requests to send
+    :param concurrency: int: The number of requests in flight
+    :return: Requests per second
+    """
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            response = await client.get(url, headers=headers)
+            assert response.status_code == 200, (url, response.status_code, response.text)
+
+    await worker_batch(worker, concurrency)
+    start = time.perf_counter()
+    remaining = iter(range(requests))
+    await worker_batch(worker, concurrency)
+
+    return requests / (time.perf_counter() - start)
+
+
+async def worker_batch(worker, concurrency: int) -> None:
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def main(args: argparse.Namespace) -> None:
+    reset_schema()
+    seed_users(1)
+    seed_images(1)
+    execute(
+        "INSERT INTO tags (name, created_at) SELECT 'tag' || n, now() FROM generate_series(1, 100) AS n",
+        "INSERT INTO image_comments (data, user_id, image_id, created_at) VALUES ('nice picture', 1, 1, now())",
+    )
+
+    async with BenchSession() as db:
+        user = await db.get(User, 1)
+    headers = {"Authorization": f"Bearer {await AuthService.create_access_token(AuthService.user_claims(user))}"}
+    await AuthService.redis.delete(revocation_store.user_key(user.email))
+
+    if not args.no_filter:
+        await revocation_store.start()
+        while not revocation_store.stats()["ready"]:
+            await asyncio.sleep(0.01)
+
+    rows = []
+    async with api_client(check_tokens=True) as client:
+        for url in ENDPOINTS:
+            row = [url]
+
+            app.dependency_overrides[get_current_active_claims] = full_user_claims
+            user_cache.ttl = 0
+            row.append(await throughput(client, url, headers, args.requests, args.concurrency))
+            user_cache.ttl = 60
+            row.append(await throughput(client, url, headers, args.requests, args.concurrency))
+
+            del app.dependency_overrides[get_current_active_claims]
+            row.append(await throughput(client, url, headers, args.requests, args.concurrency))
+
+            rows.append(row + [f"{row[3] / row[1] - 1:+.0%}", f"{row[3] / row[2] - 1:+.0%}"])
+
+    await revocation_store.stop()
+
+    print_table(["endpoint", "user from Redis, rps", "user from worker cache, rps", "claims, rps",
+                 "gain vs Redis", "gain vs worker cache"], rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2_000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--no-filter", action="store_true", help="Check every token for revocation in Redis")
+
+    asyncio.run(main(parser.parse_args()))
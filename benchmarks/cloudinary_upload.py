@@ -0,0 +1,145 @@
+"""
+Uploads to Cloudinary through the SDK in the default executor against the async uploader,
+and how long a QR code takes to be generated in the default executor during the burst.
+
+Cloudinary is replaced by a local HTTP server that answers every upload after --latency milliseconds,
+started in a thread of its own. No database or Redis is needed.
+With the SDK every upload holds a thread of the default executor while it waits for the answer,
+so the QR codes queue behind the uploads. The uploader waits without a thread and reuses its connections.
+
+    python -m benchmarks.cloudinary_upload --uploads 200 --concurrency 20 --latency 100
+"""
+import argparse
+import asyncio
+import io
+import os
+import socket
+import statistics
+import threading
+import time
+
+import cloudinary
+import cloudinary.uploader
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from benchmarks.common import measure, print_table
+from config import settings
+from svitlogram.services import cloudinary as cloudinary_service
+from svitlogram.services.qr_code import create_qr_for_url
+from svitlogram.services.uploader import uploader
+
+QR_URL = "https://res.cloudinary.com/media/1"
+
+connections: set = set()
+
+
+def fake_cloudinary(latency: float) -> Starlette:
+    async def upload(request: Request) -> JSONResponse:
+        connections.add(request.scope["client"])
+        form = await request.form()
+        await form["file"].read()
+        await asyncio.sleep(latency)
+        public_id = f"{form['folder']}/{form['public_id']}"
+        return JSONResponse({"secure_url": f"https://res.cloudinary.com/{public_id}", "url": f"http://{public_id}",
+                             "public_id": public_id, "version": 1})
+
+    return Starlette(routes=[Route("/v1_1/{cloud}/image/upload", upload, methods=["POST"])])
+
+
+def serve(app: Starlette) -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+
+    return port
+
+
+async def sdk_upload(content: bytes) -> dict:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, lambda: cloudinary.uploader.upload(io.BytesIO(content), public_id=os.urandom(8).hex(),
+                                                 folder=settings.cloudinary_folder, overwrite=True)
+    )
+
+
+async def uploader_upload(content: bytes) -> dict:
+    return await cloudinary_service.upload_image(io.BytesIO(content))
+
+
+async def burst(upload, uploads: int, concurrency: int, size: int) -> list:
+    """
+    The burst function uploads files with at most concurrency of them in flight,
+    while QR codes are generated one after another in the default executor.
+
+    :param upload: The coroutine function that uploads a file
+    :param uploads: int: The number of files to upload
+    :param concurrency: int: The number of uploads in flight
+    :param size: int: The size of every file in bytes
+    :return: Uploads per second, the median latency of an upload and of a QR code in milliseconds,
+        and the connections opened to the server
+    """
+    connections.clear()
+    remaining = iter(range(uploads))
+    timings, qr_timings = [], []
+    content = os.urandom(size)
+    done = asyncio.Event()
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            assert (await upload(content))["public_id"]
+            timings.append((time.perf_counter() - start) * 1000)
+
+    async def qr_codes():
+        loop = asyncio.get_running_loop()
+        while not done.is_set():
+            start = time.perf_counter()
+            await loop.run_in_executor(None, create_qr_for_url, QR_URL, 1, 10, 4)
+            qr_timings.append((time.perf_counter() - start) * 1000)
+
+    qr = asyncio.create_task(qr_codes())
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await qr
+
+    return [uploads / elapsed, statistics.median(timings), statistics.median(qr_timings), len(connections)]
+
+
+async def main(args: argparse.Namespace) -> None:
+    port = serve(fake_cloudinary(args.latency / 1000))
+    cloudinary.config(cloud_name="benchmark", api_key="1234", api_secret="secret",
+                      upload_prefix=f"http://127.0.0.1:{port}")
+
+    loop = asyncio.get_running_loop()
+    idle = await measure(lambda: loop.run_in_executor(None, create_qr_for_url, QR_URL, 1, 10, 4))
+
+    rows = [
+        ["SDK in the default executor", *await burst(sdk_upload, args.uploads, args.concurrency, args.size * 1024)],
+        ["uploader", *await burst(uploader_upload, args.uploads, args.concurrency, args.size * 1024)],
+    ]
+    await uploader.stop()
+
+    print_table(["", "uploads, rps", "upload p50, ms", "QR code p50, ms", "connections"], rows)
+    print(f"QR code without uploads: {idle:.2f} ms, default executor threads: {min(32, (os.cpu_count() or 1) + 4)}")
+    print(f"uploader: {uploader.stats()}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=100, help="Milliseconds Cloudinary takes to answer")
+    parser.add_argument("--size", type=int, default=100, help="Size of every file in KB")
+
+    asyncio.run(main(parser.parse_args()))
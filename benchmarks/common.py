@@ -0,0 +1,179 @@
+"""
+Helpers shared by the benchmark scripts.
+
+Every benchmark recreates the schema of the database from DATABASE_URL_TEST,
+never point it at a database with data you want to keep.
+"""
+import statistics
+import time
+from typing import Awaitable, Callable, Optional
+
+import httpx
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from config import settings
+from svitlogram.database.models import Base
+
+DATABASE_URL = settings.DATABASE_URL_TEST
+
+sync_engine = create_engine(DATABASE_URL)
+async_engine = create_async_engine(make_url(DATABASE_URL).set(drivername="postgresql+asyncpg"))
+BenchSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+
+def reset_schema() -> None:
+    """
+    The reset_schema function drops and recreates all tables of the benchmark database.
+
+    :return: None
+    """
+    Base.metadata.drop_all(bind=sync_engine)
+    Base.metadata.create_all(bind=sync_engine)
+
+
+def execute(*statements: str, **params) -> None:
+    """
+    The execute function runs raw SQL statements in one transaction, used to seed large tables quickly.
+
+    :param statements: str: The SQL statements to run
+    :param params: Bind parameters shared by all statements
+    :return: None
+    """
+    with sync_engine.begin() as connection:
+        for statement in statements:
+            connection.execute(text(statement), params)
+
+
+def seed_users(
+        count: int,
+        first_name: str = "'First' || n",
+        last_name: str = "'Last' || n",
+        username: str = "'user' || n",
+) -> None:
+    """
+    The seed_users function inserts users with ids 1..count.
+
+    :param count: int: The number of users to create
+    :param first_name: str: SQL expression of the first name, n is the id of the user
+    :param last_name: str: SQL expression of the last name
+    :param username: str: SQL expression of the username, it must be unique
+    :return: None
+    """
+    execute(
+        "INSERT INTO users (id, username, email, password, first_name, last_name, avatar, role, email_verified, "
+        "is_active, created_at) "
+        f"SELECT n, {username}, 'user' || n || '@example.com', 'password', {first_name}, {last_name}, "
+        "'https://www.gravatar.com/avatar/' || md5(n::text), 'user', true, true, now() "
+        "FROM generate_series(1, :count) AS n",
+        "SELECT setval('users_id_seq', :count)",
+        count=count
+    )
+
+
+def seed_images(count: int, owner_id: int = 1, description: str = "'Synthetic image number ' || n") -> None:
+    """
+    The seed_images function inserts images with ids 1..count spread over the last year.
+
+    :param count: int: The number of images to create
+    :param owner_id: int: The id of the user that owns the images
+    :param description: str: SQL expression of the description, n is the id of the image
+    :return: None
+    """
+    execute(
+        "INSERT INTO images (id, public_id, description, created_at, user_id, avg_rating) "
+        f"SELECT n, 'media/' || md5(n::text), {description}, "
+        "now() - (n || ' seconds')::interval, :owner_id, 0 FROM generate_series(1, :count) AS n",
+        "SELECT setval('images_id_seq', :count)",
+        count=count, owner_id=owner_id
+    )
+
+
+def api_client(
+        user_id: int = 1, session_setup: Optional[str] = None, check_tokens: bool = False
+) -> httpx.AsyncClient:
+    """
+    The api_client function returns a client that calls the application in-process.
+    Requests are authenticated as the given user and are not rate limited,
+    so the timings cover routing, the repository and serialization but not the token check.
+    With check_tokens the authentication dependencies are left in place and every request needs a bearer token.
+
+    :param user_id: int: The id of the user the requests are made by
+    :param session_setup: Optional[str]: SQL to run at the start of every database session, e.g. planner settings
+    :param check_tokens: bool: Authenticate requests with their access token instead of as user_id
+    :return: An httpx client bound to the application
+    """
+    from fastapi.routing import APIRoute
+    from fastapi_limiter.depends import RateLimiter
+
+    from main import app
+    from svitlogram.database.connect import get_db
+    from svitlogram.database.models import User
+    from svitlogram.services.auth import get_current_active_user, get_current_active_claims, TokenClaims
+
+    async def override_get_db():
+        async with BenchSession() as db:
+            if session_setup:
+                await db.execute(text(session_setup))
+            yield db
+
+    async def override_get_current_active_user():
+        async with BenchSession() as db:
+            return await db.get(User, user_id)
+
+    async def override_get_current_active_claims():
+        user = await override_get_current_active_user()
+        return TokenClaims(id=user.id, role=user.role, is_active=user.is_active)
+
+    def dependencies(dependant):
+        for dependency in dependant.dependencies:
+            yield dependency.call
+            yield from dependencies(dependency)
+
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            for call in dependencies(route.dependant):
+                if isinstance(call, RateLimiter):
+                    app.dependency_overrides[call] = lambda: None
+
+    app.dependency_overrides[get_db] = override_get_db
+    if not check_tokens:
+        app.dependency_overrides[get_current_active_user] = override_get_current_active_user
+        app.dependency_overrides[get_current_active_claims] = override_get_current_active_claims
+
+    return httpx.AsyncClient(app=app, base_url="http://benchmark")
+
+
+async def measure(call: Callable[[], Awaitable], repeat: int = 20) -> float:
+    """
+    The measure function awaits the call several times and returns the median latency.
+
+    :param call: Callable[[], Awaitable]: The coroutine factory to measure
+    :param repeat: int: How many times to run it, one warm-up run is added
+    :return: The median latency in milliseconds
+    """
+    await call()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await call()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(timings)
+
+
+def print_table(headers: list[str], rows: list[list]) -> None:
+    """
+    The print_table function prints the benchmark results as an aligned table.
+
+    :param headers: list[str]: Column titles
+    :param rows: list[list]: Rows of values, floats are printed with two decimals
+    :return: None
+    """
+    cells = [headers] + [[f"{value:.2f}" if isinstance(value, float) else str(value) for value in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(headers))]
+
+    for row in cells:
+        print("  ".join(value.rjust(width) for value, width in zip(row, widths)))
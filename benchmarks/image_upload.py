@@ -0,0 +1,107 @@
+"""
+Throughput of POST /api/images/ with the files written to the local storage backend,
+and of serving them back through the storage route.
+
+Requests run in-process through the whole upload_image route: the multipart parsing, the checks of the form,
+the ingest of the file, the upload by the uploader, the insert of the image and its tags
+and the serialization of the response.
+Every file is a JPEG signature followed by random content. The same files are then uploaded again,
+these uploads find the stored file by the hash of the content and are not written again.
+The files are written to a temporary directory, removed at the end.
+
+    python -m benchmarks.image_upload --requests 500 --concurrency 20 --sizes 100 1000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.common import api_client, print_table, reset_schema, seed_users
+from svitlogram.services import storage
+
+JPEG_HEADER = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00"
+
+
+async def uploads(client, contents: list[bytes], concurrency: int) -> tuple[float, float, float, list[str]]:
+    """
+    The uploads function uploads images with at most concurrency of them in flight.
+
+    :param client: httpx.AsyncClient: The client bound to the application
+    :param contents: list[bytes]: The files to upload
+    :param concurrency: int: The number of requests in flight
+    :return: Requests per second, the median and the 95th percentile latency in milliseconds and the URLs of the images
+    """
+    remaining = iter(enumerate(contents))
+    timings, urls = [], []
+
+    async def worker():
+        for number, content in remaining:
+            start = time.perf_counter()
+            response = await client.post(
+                "/api/images/",
+                files={"file": (f"{number}.jpg", content, "image/jpeg")},
+                data={"description": f"Uploaded image number {number}", "tags": [f"tag{number % 50}"]},
+            )
+            timings.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 201, response.text
+            urls.append(response.json()["image"]["url"])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return len(contents) / elapsed, statistics.median(timings), statistics.quantiles(timings, n=20)[-1], urls
+
+
+async def downloads(client, urls: list[str], concurrency: int) -> float:
+    """
+    The downloads function requests the files through the storage route.
+
+    :param client: httpx.AsyncClient: The client bound to the application
+    :param urls: list[str]: The URLs of the files
+    :param concurrency: int: The number of requests in flight
+    :return: Requests per second
+    """
+    remaining = iter(urls)
+
+    async def worker():
+        for url in remaining:
+            response = await client.get(url)
+            assert response.status_code == 200, response.status_code
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return len(urls) / (time.perf_counter() - start)
+
+
+async def main(args: argparse.Namespace) -> None:
+    reset_schema()
+    seed_users(1)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as root:
+        storage.backend = storage.LocalStorage(root, "/api/storage")
+
+        async with api_client() as client:
+            for size_kb in args.sizes:
+                size = size_kb * 1024
+                contents = [JPEG_HEADER + os.urandom(size - len(JPEG_HEADER)) for _ in range(args.requests)]
+                for label in (f"{size_kb} KB", f"{size_kb} KB again"):
+                    rps, median, p95, urls = await uploads(client, contents, args.concurrency)
+                    served = await downloads(client, urls, args.concurrency)
+                    rows.append([label, rps, rps * size / 2 ** 20, median, p95, served])
+
+    print_table(["file", "uploads, rps", "uploads, MB/s", "p50, ms", "p95, ms", "downloads, rps"], rows)
+    print(f"storage: {storage.upload_stats.stats()}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000], help="Sizes of the files in KB")
+
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,120 @@
+"""
+Latency of the image search: the old ILIKE scan against the ranked full-text search.
+
+Descriptions are 6-10 words drawn from a synthetic vocabulary with a skewed distribution,
+so the queries cover terms matching a large share of the images down to terms matching a handful.
+
+    python -m benchmarks.images_search --images 1000000
+"""
+import argparse
+import asyncio
+import random
+
+from sqlalchemy import select, func
+
+from benchmarks.common import BenchSession, execute, measure, print_table, reset_schema, seed_images, seed_users
+from svitlogram.database.models import Image, Tag
+from svitlogram.database.models.images import SEARCH_CONFIG
+from svitlogram.repository.images import search_images
+
+SYLLABLES = [consonant + vowel for consonant in "bdfgklmnprstvz" for vowel in "aeiou"]
+
+
+def vocabulary(size: int) -> list[str]:
+    rng = random.Random(42)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(3)))
+
+    words = sorted(words)
+    rng.shuffle(words)
+
+    return words
+
+
+def seed(images: int, tags: int, words: list[str]) -> None:
+    """
+    The seed function fills the database. The search vectors are built in one pass at the end,
+    the per-row triggers that keep them up to date are disabled while seeding.
+
+    :param images: int: The number of images
+    :param tags: int: The number of tags, every image gets two of them
+    :param words: list[str]: The vocabulary, the first words are the most frequent ones
+    :return: None
+    """
+    array = "ARRAY[" + ",".join(f"'{word}'" for word in words) + "]"
+    description = (
+        f"(SELECT string_agg(({array})[1 + floor(power(random(), 3) * {len(words)})::int], ' ') "
+        "FROM generate_series(1, 6 + n % 5))"
+    )
+
+    reset_schema()
+    execute(
+        "ALTER TABLE images DISABLE TRIGGER USER",
+        "ALTER TABLE image_m2m_tag DISABLE TRIGGER USER",
+        "DROP INDEX ix_images_search_vector",
+        "SELECT setseed(0.42)",
+    )
+    seed_users(1)
+    seed_images(images, description=description)
+    execute(
+        "INSERT INTO tags (id, name, created_at) SELECT n, (:words)[n], now() FROM generate_series(1, :tags) AS n",
+        "INSERT INTO image_m2m_tag (image_id, tag_id) "
+        "SELECT n, 1 + n % :tags FROM generate_series(1, :images) AS n UNION ALL "
+        "SELECT n, 1 + (n + 1 + n / :tags % (:tags - 1)) % :tags FROM generate_series(1, :images) AS n",
+        f"UPDATE images SET search_vector = "
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', images.description), 'A') || "
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', image_tags.names), 'B') "
+        "FROM (SELECT image_id, string_agg(tags.name, ' ') AS names "
+        "FROM image_m2m_tag JOIN tags ON tags.id = image_m2m_tag.tag_id GROUP BY image_id) AS image_tags "
+        "WHERE image_tags.image_id = images.id",
+        "CREATE INDEX ix_images_search_vector ON images USING gin (search_vector)",
+        "ALTER TABLE images ENABLE TRIGGER USER",
+        "ALTER TABLE image_m2m_tag ENABLE TRIGGER USER",
+        "ANALYZE images",
+        words=words[:tags], tags=tags, images=images
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    words = vocabulary(args.words)
+    if not args.no_seed:
+        seed(args.images, args.tags, words)
+
+    queries = [words[0], words[20], words[len(words) // 2], f"{words[3]} {words[7]}", f"{words[1]} -{words[2]}"]
+
+    rows = []
+    async with BenchSession() as db:
+        for query in queries:
+            matches = await db.scalar(
+                select(func.count(Image.id))
+                .filter(Image.search_vector.bool_op('@@')(func.websearch_to_tsquery(SEARCH_CONFIG, query)))
+            )
+
+            ilike = None
+            if "-" not in query and " " not in query:
+                ilike = await measure(lambda: db.scalars(
+                    select(Image)
+                    .filter(Image.description.ilike(f"%{query}%") | Image.tags.any(Tag.name.ilike(f"%{query}%")))
+                    .limit(args.limit)
+                ), args.repeat)
+
+            _, cursor = await search_images(query, args.limit, db)
+            first_page = await measure(lambda: search_images(query, args.limit, db), args.repeat)
+            second_page = await measure(lambda: search_images(query, args.limit, db, cursor), args.repeat)
+
+            rows.append([query, matches, "-" if ilike is None else ilike, first_page, second_page])
+
+    print_table(["query", "matches", f"ilike {args.limit} rows, ms", "fts first page, ms", "fts second page, ms"], rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=1_000_000)
+    parser.add_argument("--tags", type=int, default=1_000)
+    parser.add_argument("--words", type=int, default=5_000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--no-seed", action="store_true", help="Reuse the data of the previous run")
+
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,82 @@
+"""
+Latency of the rating-sorted image listing as the number of ratings grows.
+
+The listing sorts on the stored images.avg_rating column through the (avg_rating, id) index,
+so the first page and a page in the middle of the feed should cost the same with 0 or 1M ratings.
+
+    python -m benchmarks.images_sort --images 20000 --ratings 0 100000 1000000
+"""
+import argparse
+import asyncio
+import math
+
+from sqlalchemy import select
+
+from benchmarks.common import BenchSession, execute, measure, print_table, reset_schema, seed_images, seed_users
+from svitlogram.database.models import Image
+from svitlogram.repository.images import SortMode, get_images
+from svitlogram.utils.cursor import encode_cursor
+
+
+def add_ratings(start: int, stop: int, images: int) -> None:
+    """
+    The add_ratings function inserts ratings start..stop-1, every image gets one rating per rater in turn.
+
+    :param start: int: The number of ratings already inserted
+    :param stop: int: The number of ratings there should be afterwards
+    :param images: int: The number of seeded images
+    :return: None
+    """
+    execute(
+        "INSERT INTO image_ratings (rating, user_id, image_id, created_at) "
+        "SELECT 1 + (n + n / :images) % 5, 2 + n / :images, 1 + n % :images, now() "
+        "FROM generate_series(:start, :stop - 1) AS n",
+        "UPDATE images SET ratings_count = totals.ratings_count, ratings_sum = totals.ratings_sum, "
+        "avg_rating = round(totals.ratings_sum::numeric / totals.ratings_count, 1) "
+        "FROM (SELECT image_id, count(*) AS ratings_count, sum(rating) AS ratings_sum "
+        "FROM image_ratings GROUP BY image_id) AS totals WHERE totals.image_id = images.id",
+        "ANALYZE images",
+        start=start, stop=stop, images=images
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    reset_schema()
+    seed_users(1 + math.ceil(max(args.ratings) / args.images))
+    seed_images(args.images)
+
+    rows, inserted = [], 0
+    for total in sorted(args.ratings):
+        add_ratings(inserted, total, args.images)
+        inserted = total
+
+        async with BenchSession() as db:
+            middle = (await db.execute(
+                select(Image.avg_rating, Image.id)
+                .order_by(Image.avg_rating.desc(), Image.id.desc())
+                .offset(args.images // 2)
+                .limit(1)
+            )).one()
+            cursor = encode_cursor(SortMode.RAITING_DESC.value, middle.avg_rating, middle.id)
+
+            first_page = await measure(
+                lambda: get_images(0, args.limit, None, None, None, None, SortMode.RAITING_DESC, db), args.repeat
+            )
+            middle_page = await measure(
+                lambda: get_images(0, args.limit, None, None, None, None, SortMode.RAITING_DESC, db, cursor),
+                args.repeat
+            )
+
+        rows.append([total, first_page, middle_page])
+
+    print_table(["ratings", "first page, ms", "middle page, ms"], rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=20_000)
+    parser.add_argument("--ratings", type=int, nargs="+", default=[0, 100_000, 1_000_000])
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,99 @@
+"""
+Latency of the tag filter of the image listing: the fuzzy ILIKE filter against the exact tag-id filter.
+
+Every image gets three tags, drawn with a skewed distribution from a synthetic vocabulary,
+so the queries cover tags on a large share of the images down to tags on a handful.
+The fuzzy filter adds one EXISTS subquery per tag, the exact one joins image_m2m_tag once per tag
+through its (tag_id, image_id) index, so its cost should barely grow with the number of tags.
+
+    python -m benchmarks.images_tags --images 1000000 --sort date_added_desc
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import select
+
+from benchmarks.common import BenchSession, execute, measure, print_table, reset_schema, seed_images, seed_users
+from benchmarks.images_search import vocabulary
+from svitlogram.database.models import Tag
+from svitlogram.repository.images import SortMode, TagMatch, get_images
+from svitlogram.services.tag_cache import tag_cache
+
+
+def seed(images: int, tags: int, words: list[str]) -> None:
+    """
+    The seed function fills the database, the search vector triggers are disabled while seeding.
+
+    :param images: int: The number of images
+    :param tags: int: The number of tags, every image gets three of them
+    :param words: list[str]: The tag names, the first ones are the most frequent ones
+    :return: None
+    """
+    reset_schema()
+    execute(
+        "ALTER TABLE images DISABLE TRIGGER USER",
+        "ALTER TABLE image_m2m_tag DISABLE TRIGGER USER",
+        "SELECT setseed(0.42)",
+    )
+    seed_users(1)
+    seed_images(images)
+    execute(
+        "INSERT INTO tags (id, name, created_at) SELECT n, (:words)[n], now() FROM generate_series(1, :tags) AS n",
+        "INSERT INTO image_m2m_tag (image_id, tag_id) "
+        "SELECT DISTINCT n, 1 + floor(power(random(), 3) * :tags)::int "
+        "FROM generate_series(1, :images) AS n, generate_series(1, 3)",
+        "ALTER TABLE images ENABLE TRIGGER USER",
+        "ALTER TABLE image_m2m_tag ENABLE TRIGGER USER",
+        "ANALYZE images",
+        "ANALYZE image_m2m_tag",
+        "ANALYZE tags",
+        words=words[:tags], tags=tags, images=images
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    words = vocabulary(args.tags)
+    if not args.no_seed:
+        seed(args.images, args.tags, words)
+
+    async with BenchSession() as db:
+        names = set((await db.scalars(select(Tag.name))).all())
+    queries = [
+        [words[0]],
+        [words[0], words[1]],
+        [words[0], words[1], words[2]],
+        [words[len(words) // 2]],
+        [words[0], words[len(words) // 2]],
+        [words[3], words[7], words[len(words) // 2]],
+    ]
+    queries = [query for query in queries if names.issuperset(query)]
+
+    rows = []
+    async with BenchSession() as db:
+        for query in queries:
+            tag_cache.clear()
+            exact = await measure(lambda: get_images(
+                0, args.limit, None, query, None, None, args.sort, db, tag_match=TagMatch.EXACT
+            ), args.repeat)
+            fuzzy = await measure(lambda: get_images(
+                0, args.limit, None, query, None, None, args.sort, db, tag_match=TagMatch.FUZZY
+            ), max(1, args.repeat // 5))
+            found, _ = await get_images(
+                0, args.limit, None, query, None, None, args.sort, db, tag_match=TagMatch.EXACT
+            )
+
+            rows.append([" ".join(query), len(query), len(found), fuzzy, exact])
+
+    print_table(["tags", "count", f"rows (limit {args.limit})", "fuzzy, ms", "exact, ms"], rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=1_000_000)
+    parser.add_argument("--tags", type=int, default=1_000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--sort", type=SortMode, default=SortMode.NOT_SORT, choices=list(SortMode))
+    parser.add_argument("--no-seed", action="store_true", help="Reuse the data of the previous run")
+
+    asyncio.run(main(parser.parse_args()))
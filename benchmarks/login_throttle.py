@@ -0,0 +1,72 @@
+"""
+Cost of a login attempt with a wrong password against the cost of rejecting it while the email backs off.
+
+The failed attempts go through bcrypt in the password hashing pool. Throttled attempts are answered
+before the user is loaded: the first one asks Redis, the following ones find the lockout in the worker.
+
+    python -m benchmarks.login_throttle --repeat 20
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import api_client, execute, measure, print_table, reset_schema, seed_users
+from svitlogram.services.login_throttle import login_throttle
+from svitlogram.services.passwords import password_hasher, pwd_context
+
+WRONG = {"username": "user1@example.com", "password": "wrong"}
+
+
+async def main(args: argparse.Namespace) -> None:
+    reset_schema()
+    seed_users(1)
+    execute("UPDATE users SET password = :password", password=pwd_context.hash("secret"))
+    await password_hasher.start()
+
+    async with api_client() as client:
+        await login_throttle.clear()
+        login_throttle.free_attempts = {"email": 10 ** 6, "ip": 10 ** 6}
+        failed = await measure(lambda: client.post("/api/auth/login", data=WRONG), args.repeat)
+
+        login_throttle.free_attempts = {"email": 0, "ip": 10 ** 6}
+        response = await client.post("/api/auth/login", data=WRONG)
+        assert response.status_code == 429, response.text
+        rejected = await measure(lambda: client.post("/api/auth/login", data=WRONG), args.repeat * 10)
+
+        async def check_in_redis():
+            login_throttle._locked.clear()
+            try:
+                await login_throttle.check(WRONG["username"], "127.0.0.1")
+            except Exception:
+                pass
+
+        async def check_in_worker():
+            try:
+                await login_throttle.check(WRONG["username"], "127.0.0.1")
+            except Exception:
+                pass
+
+        in_redis = await measure(check_in_redis, args.repeat * 10)
+        await check_in_worker()
+        start = time.perf_counter()
+        for _ in range(args.repeat * 1000):
+            await check_in_worker()
+        in_worker = (time.perf_counter() - start) / (args.repeat * 1000) * 1_000_000
+
+        await login_throttle.clear()
+
+    await password_hasher.stop()
+
+    print_table(["attempt", "µs"], [
+        ["wrong password, /api/auth/login", failed * 1000],
+        ["throttled, /api/auth/login", rejected * 1000],
+        ["throttle check, lockout from Redis", in_redis * 1000],
+        ["throttle check, lockout in the worker", in_worker],
+    ])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+
+    asyncio.run(main(parser.parse_args()))
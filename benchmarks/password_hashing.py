@@ -0,0 +1,91 @@
+"""
+Latency of the image feed while a login storm runs, with bcrypt on the event loop against the process pool.
+
+Inline mode runs bcrypt in the request handler as before the password hashing pool existed,
+every login freezes the worker for the whole hash. With the pool the event loop keeps serving the feed,
+logins above password_hash_max_pending are rejected with 503.
+
+    python -m benchmarks.password_hashing --logins 50 --duration 10
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks.common import api_client, execute, print_table, reset_schema, seed_images, seed_users
+from svitlogram.services.passwords import password_hasher, pwd_context
+
+FEED = "/api/images/?limit=10"
+
+
+async def inline(function, *args):
+    return function(*args)
+
+
+async def storm(client, logins: int, duration: float) -> list:
+    """
+    The storm function keeps logins requests to /api/auth/login in flight and meanwhile
+    requests the feed one at a time.
+
+    :param client: httpx.AsyncClient: The client bound to the application
+    :param logins: int: The number of concurrent logins, 0 to measure the feed alone
+    :param duration: float: Seconds to run for
+    :return: A table row with the feed latencies and the login outcomes
+    """
+    deadline = time.perf_counter() + duration
+    outcomes = {200: 0, 503: 0}
+
+    async def login():
+        while time.perf_counter() < deadline:
+            response = await client.post("/api/auth/login", data={"username": "user1@example.com", "password": "secret"})
+            outcomes[response.status_code] = outcomes.get(response.status_code, 0) + 1
+            if response.status_code == 503:
+                await asyncio.sleep(0.1)
+
+    async def feed():
+        timings = []
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await client.get(FEED)
+            assert response.status_code == 200, response.text
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    *_, timings = await asyncio.gather(*(login() for _ in range(logins)), feed())
+    timings.sort()
+
+    return [
+        logins, len(timings), statistics.median(timings), timings[int(len(timings) * 0.95)], timings[-1],
+        outcomes[200] / duration, outcomes[503],
+    ]
+
+
+async def main(args: argparse.Namespace) -> None:
+    reset_schema()
+    seed_users(1)
+    seed_images(100)
+    execute("UPDATE users SET password = :password", password=pwd_context.hash("secret"))
+
+    rows = []
+    async with api_client() as client:
+        run_in_pool = password_hasher._run
+        password_hasher._run = inline
+        for logins in (0, args.logins):
+            rows.append(["inline"] + await storm(client, logins, args.duration))
+
+        password_hasher._run = run_in_pool
+        await password_hasher.start()
+        for logins in (0, args.logins):
+            rows.append([f"pool of {password_hasher.workers}"] + await storm(client, logins, args.duration))
+        await password_hasher.stop()
+
+    print_table(["bcrypt", "logins in flight", "feed requests", "feed p50, ms", "feed p95, ms", "feed max, ms",
+                 "logins/s", "logins 503"], rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10)
+
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,133 @@
+"""
+Throughput of read endpoints with and without the read-through repository cache,
+the queries a burst of concurrent requests for one uncached image costs,
+and the throughput of requests for images that do not exist, as crawlers send them.
+
+Requests run in-process against a real Redis, with a fixed number of them in flight.
+Without the cache every request reads its row from Postgres. With it the first request of a key loads it,
+concurrent requests for the same key wait for that load, the others are answered from the worker or Redis.
+
+Not found results are cached for read_cache_negative_ttl seconds, or until an image is inserted.
+
+    python -m benchmarks.read_cache --requests 2000 --concurrency 20 --burst 500 --missing 100
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import event
+
+from benchmarks.auth_claims import throughput
+from benchmarks.common import api_client, async_engine, execute, print_table, reset_schema, seed_images, seed_users
+from svitlogram.services.read_cache import read_cache
+
+ENDPOINTS = ["/api/images/1", "/api/tags/1", "/api/images/comments/1", "/api/users/user1"]
+
+image_queries = 0
+
+
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def count_image_queries(conn, cursor, statement: str, *args) -> None:
+    global image_queries
+    image_queries += "FROM images" in statement
+
+
+async def burst(client, url: str, requests: int) -> tuple[float, int]:
+    """
+    The burst function sends all the requests at once.
+
+    :param client: httpx.AsyncClient: The client bound to the application
+    :param url: str: The endpoint to call
+    :param requests: int: The number of requests
+    :return: The time until the last response in milliseconds and the number of queries of images
+    """
+    global image_queries
+    image_queries = 0
+
+    start = time.perf_counter()
+    responses = await asyncio.gather(*(client.get(url) for _ in range(requests)))
+    elapsed = (time.perf_counter() - start) * 1000
+
+    assert all(response.status_code == 200 for response in responses)
+
+    return elapsed, image_queries
+
+
+async def not_found(client, ids: int, requests: int, concurrency: int) -> tuple[float, float]:
+    """
+    The not_found function requests images that do not exist, cycling over a number of ids.
+
+    :param client: httpx.AsyncClient: The client bound to the application
+    :param ids: int: How many distinct missing ids are requested
+    :param requests: int: The number of requests to send
+    :param concurrency: int: The number of requests in flight
+    :return: Requests per second and queries of images per request
+    """
+    global image_queries
+    remaining = iter(range(requests))
+
+    async def worker():
+        for number in remaining:
+            response = await client.get(f"/api/images/{1_000_000 + number % ids}")
+            assert response.status_code == 404, response.status_code
+
+    image_queries = 0
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return requests / (time.perf_counter() - start), image_queries / requests
+
+
+async def main(args: argparse.Namespace) -> None:
+    reset_schema()
+    seed_users(1)
+    seed_images(1)
+    execute(
+        "INSERT INTO tags (name, created_at) SELECT 'tag' || n, now() FROM generate_series(1, 5) AS n",
+        "INSERT INTO image_m2m_tag (image_id, tag_id) SELECT 1, n FROM generate_series(1, 5) AS n",
+        "INSERT INTO image_comments (data, user_id, image_id, created_at) VALUES ('nice picture', 1, 1, now())",
+    )
+
+    rows = []
+    async with api_client() as client:
+        uncached = [await throughput(client, url, {}, args.requests, args.concurrency) for url in ENDPOINTS]
+        uncached_burst = await burst(client, ENDPOINTS[0], args.burst)
+        missing = [["without cache", *await not_found(client, args.missing, args.requests, args.concurrency)]]
+
+        await read_cache.start()
+        while not read_cache.stats()["ready"]:
+            await asyncio.sleep(0.01)
+
+        await read_cache.clear()
+        cached_burst = await burst(client, ENDPOINTS[0], args.burst)
+        cached = [await throughput(client, url, {}, args.requests, args.concurrency) for url in ENDPOINTS]
+
+        negative_ttl, read_cache.negative_ttl = read_cache.negative_ttl, 0
+        missing.append(["not found not cached", *await not_found(client, args.missing, args.requests, args.concurrency)])
+        read_cache.negative_ttl = negative_ttl
+        missing.append(["not found cached", *await not_found(client, args.missing, args.requests, args.concurrency)])
+
+        await read_cache.stop()
+
+    for url, without, with_cache in zip(ENDPOINTS, uncached, cached):
+        rows.append([url, without, with_cache, f"{with_cache / without - 1:+.0%}"])
+    print_table(["endpoint", "without cache, rps", "with cache, rps", "gain"], rows)
+
+    print()
+    print_table(
+        [f"{args.burst} concurrent requests for {ENDPOINTS[0]}", "ms", "queries of images"],
+        [["without cache", *uncached_burst], ["with cold cache", *cached_burst]],
+    )
+    print()
+    print_table([f"requests for {args.missing} missing images", "rps", "queries of images per request"], missing)
+    print(f"read cache: {read_cache.stats()}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2_000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--burst", type=int, default=500)
+    parser.add_argument("--missing", type=int, default=100, help="Distinct ids of images that do not exist")
+
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,70 @@
+"""
+Cost of get_current_user and get_current_claims per call, with and without the decoded token cache.
+
+The user is in the worker cache and the revocation filter is loaded, so no call leaves the process
+and what is measured is mostly the token check: the signature and the JSON parsing,
+or the SHA-256 of the token when its payload is cached. No database is needed, only Redis.
+
+    python -m benchmarks.token_cache --calls 100000
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from benchmarks.common import print_table
+from svitlogram.database.models import UserRole
+from svitlogram.services.auth import AuthService
+from svitlogram.services.revocation import revocation_store
+from svitlogram.services.token_cache import token_cache
+from svitlogram.services.user_cache import CachedUser, user_cache
+
+USER = CachedUser(
+    id=1, username="user1", email="user1@example.com", password="hash", first_name="First", last_name="Last",
+    avatar=None, role=UserRole.user, email_verified=True, is_active=True, created_at=datetime.now(), updated_at=None,
+)
+
+
+async def per_call(call, calls: int) -> float:
+    await call()
+    start = time.perf_counter()
+    for _ in range(calls):
+        await call()
+
+    return (time.perf_counter() - start) / calls * 1_000_000
+
+
+async def main(args: argparse.Namespace) -> None:
+    await revocation_store.start()
+    while not revocation_store.stats()["ready"]:
+        await asyncio.sleep(0.01)
+
+    user_cache.ttl = 3600
+    user_cache.put(USER)
+    token = await AuthService.create_access_token({**AuthService.user_claims(USER), "fam": "benchmark"})
+
+    rows = []
+    for name, call in (
+            ("get_current_user", lambda: AuthService.get_current_user(token, None)),
+            ("get_current_claims", lambda: AuthService.get_current_claims(token)),
+    ):
+        token_cache.maxsize = 0
+        token_cache.clear()
+        uncached = await per_call(call, args.calls)
+
+        token_cache.maxsize = 4096
+        cached = await per_call(call, args.calls)
+
+        rows.append([name, uncached, cached, f"{uncached / cached:.1f}x"])
+
+    await revocation_store.stop()
+
+    print_table(["dependency", "without cache, µs", "with cache, µs", "speedup"], rows)
+    print(f"token cache: {token_cache.stats()}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=100_000)
+
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,62 @@
+"""
+Cost of the ingest stage of uploads, which checks the signature, the size and hashes the file in one pass,
+and how soon it rejects files that are not images or are too large.
+
+The files are spooled like Starlette spools them, in memory up to 1 MB and in a temporary file above that.
+Nothing is uploaded, no database or Redis is needed.
+
+    python -m benchmarks.upload_ingest --sizes 0.1 1 10 --repeat 20
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+
+from fastapi import HTTPException, UploadFile
+
+from benchmarks.common import measure, print_table
+from config import settings
+from svitlogram.services.ingest import ingest
+
+JPEG_HEADER = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00"
+
+
+def spooled(content: bytes) -> UploadFile:
+    file = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    file.write(content)
+    file.seek(0)
+    return UploadFile(file)
+
+
+async def rejected(upload: UploadFile) -> None:
+    try:
+        await ingest(upload)
+    except HTTPException:
+        return
+    raise AssertionError("the file was accepted")
+
+
+async def main(args: argparse.Namespace) -> None:
+    rows = []
+    for size_mb in args.sizes:
+        upload = spooled(JPEG_HEADER + os.urandom(int(size_mb * 2 ** 20) - len(JPEG_HEADER)))
+        ms = await measure(lambda: ingest(upload), args.repeat)
+        rows.append([f"{size_mb:g} MB image", ms, size_mb / ms * 1000])
+
+    size_mb = max(args.sizes)
+    upload = spooled(b"MZ" + os.urandom(int(size_mb * 2 ** 20)))
+    rows.append([f"{size_mb:g} MB, not an image", await measure(lambda: rejected(upload), args.repeat), "-"])
+
+    upload = spooled(JPEG_HEADER + os.urandom(settings.upload_max_size * 5))
+    size_mb = settings.upload_max_size * 5 / 2 ** 20
+    rows.append([f"{size_mb:g} MB, too large", await measure(lambda: rejected(upload), args.repeat), "-"])
+
+    print_table(["file", "ingest, ms", "MB/s"], rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=float, nargs="+", default=[0.1, 1, 10], help="Sizes of the images in MB")
+    parser.add_argument("--repeat", type=int, default=20)
+
+    asyncio.run(main(parser.parse_args()))
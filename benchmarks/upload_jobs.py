@@ -0,0 +1,141 @@
+"""
+Latency of uploads answered when the image is stored, by POST /api/images/,
+and answered once the file is spooled, by POST /api/images/jobs, with the image stored by the upload jobs.
+
+Requests run in-process against a real Redis. The files are written to the local storage backend
+in a temporary directory, every upload waits --storage-latency milliseconds more, as a call to Cloudinary does.
+For the jobs the latency of the 202 response and the time until the job is done, as its status reports it,
+are measured. Every file is a JPEG signature followed by random content, so none of them is deduplicated.
+
+    python -m benchmarks.upload_jobs --requests 500 --concurrency 20 --size 500 --storage-latency 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.common import BenchSession, api_client, print_table, reset_schema, seed_users
+from benchmarks.image_upload import JPEG_HEADER
+from svitlogram.services import storage
+from svitlogram.services.uploads import upload_jobs
+
+
+class SlowStorage(storage.LocalStorage):
+    """The local storage with the latency of a remote one"""
+
+    def __init__(self, root: str, latency: float) -> None:
+        super().__init__(root, "/api/storage")
+        self.latency = latency
+
+    async def upload(self, *args, **kwargs):
+        await asyncio.sleep(self.latency)
+        return await super().upload(*args, **kwargs)
+
+
+def percentiles(timings: list[float]) -> list[float]:
+    quantiles = statistics.quantiles(timings, n=100)
+    return [statistics.median(timings), quantiles[94], quantiles[98]]
+
+
+async def run(client, url: str, contents: list[bytes], concurrency: int) -> tuple[float, list[float], list]:
+    """
+    The run function posts the files with at most concurrency of them in flight.
+
+    :param client: httpx.AsyncClient: The client bound to the application
+    :param url: str: The endpoint to post to
+    :param contents: list[bytes]: The files to upload
+    :param concurrency: int: The number of requests in flight
+    :return: Requests per second, the latencies in milliseconds and the responses with the time they were sent
+    """
+    remaining = iter(enumerate(contents))
+    timings, responses = [], []
+
+    async def worker():
+        for number, content in remaining:
+            start = time.perf_counter()
+            response = await client.post(
+                url,
+                files={"file": (f"{number}.jpg", content, "image/jpeg")},
+                data={"description": f"Uploaded image number {number}", "tags": [f"tag{number % 50}"]},
+            )
+            timings.append((time.perf_counter() - start) * 1000)
+            assert response.status_code in (201, 202), response.text
+            responses.append((start, response))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return len(contents) / (time.perf_counter() - start), timings, responses
+
+
+async def completion(client, responses: list) -> list[float]:
+    """
+    The completion function waits for every job and returns the time from its submission until it was done.
+
+    :param client: httpx.AsyncClient: The client bound to the application
+    :param responses: list: The 202 responses with the time their request was sent
+    :return: The latencies in milliseconds
+    """
+    async def done(start: float, response) -> float:
+        while True:
+            job = (await client.get(response.headers["location"], params={"wait": 30})).json()
+            if job["status"] == "done":
+                return (time.perf_counter() - start) * 1000
+            assert job["status"] != "failed", job
+
+    return await asyncio.gather(*(done(start, response) for start, response in responses))
+
+
+async def main(args: argparse.Namespace) -> None:
+    from main import app
+    from svitlogram.database.connect import get_session_factory
+
+    reset_schema()
+    seed_users(1)
+    size = args.size * 1024
+
+    with tempfile.TemporaryDirectory() as root:
+        storage.backend = SlowStorage(root, args.storage_latency / 1000)
+        upload_jobs.spool_dir = Path(root) / "spool"
+        upload_jobs.workers = args.workers
+        # Every upload is submitted before the workers catch up, none is rejected for a full queue
+        upload_jobs.max_pending = args.requests
+        await upload_jobs.start()
+
+        async with api_client() as client:
+            app.dependency_overrides[get_session_factory] = lambda: BenchSession
+
+            contents = [JPEG_HEADER + os.urandom(size - len(JPEG_HEADER)) for _ in range(args.requests)]
+            sync_rps, sync_timings, _ = await run(client, "/api/images/", contents, args.concurrency)
+
+            contents = [JPEG_HEADER + os.urandom(size - len(JPEG_HEADER)) for _ in range(args.requests)]
+            start = time.perf_counter()
+            jobs_rps, jobs_timings, responses = await run(client, "/api/images/jobs", contents, args.concurrency)
+            done = await completion(client, responses)
+            stored_rps = args.requests / (time.perf_counter() - start)
+
+        await upload_jobs.stop()
+
+    print_table(
+        [f"{args.size} KB, {args.storage_latency} ms storage", "rps", "p50, ms", "p95, ms", "p99, ms"],
+        [
+            ["POST /api/images/, stored", sync_rps, *percentiles(sync_timings)],
+            ["POST /api/images/jobs, accepted", jobs_rps, *percentiles(jobs_timings)],
+            ["POST /api/images/jobs, stored", stored_rps, *percentiles(done)],
+        ],
+    )
+    print(f"upload jobs: {upload_jobs.stats()}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--size", type=int, default=500, help="Size of the files in KB")
+    parser.add_argument("--storage-latency", type=float, default=200, help="Added to every upload, in milliseconds")
+    parser.add_argument("--workers", type=int, default=upload_jobs.workers, help="Tasks that store the images")
+
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,99 @@
+"""
+Latency of /api/users/search/ and /api/users/search_all/ with and without the trigram indexes.
+
+Names are built from a few thousand synthetic first and last names, usernames are unique.
+The run without indexes disables bitmap scans, which is how the ILIKE filters were executed
+before the trigram indexes existed: the btree indexes on the name columns cannot serve '%term%'.
+
+    python -m benchmarks.users_search --users 1000000
+"""
+import argparse
+import asyncio
+import random
+
+from benchmarks.common import api_client, execute, measure, print_table, reset_schema, seed_users
+
+SYLLABLES = [consonant + vowel for consonant in "bdfgklmnprstvz" for vowel in "aeiou"]
+
+
+def names(count: int, syllables: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(syllables)).capitalize())
+
+    words = sorted(words)
+    rng.shuffle(words)
+
+    return words
+
+
+def pick(words: list[str]) -> str:
+    array = "ARRAY[" + ",".join(f"'{word}'" for word in words) + "]"
+    return f"({array})[1 + floor(power(random(), 2) * {len(words)})::int]"
+
+
+async def run(client, queries: list[str], limit: int, repeat: int) -> list[list]:
+    rows = []
+    for query in queries:
+        response = await client.get("/api/users/search/", params={"data": query, "limit": limit})
+        cursor = response.json().get("next_cursor") if response.status_code == 200 else None
+
+        first_page = await measure(
+            lambda: client.get("/api/users/search/", params={"data": query, "limit": limit}), repeat
+        )
+        second_page = "-"
+        if cursor:
+            second_page = await measure(
+                lambda: client.get("/api/users/search/", params={"data": query, "limit": limit, "cursor": cursor}),
+                repeat
+            )
+        search_all = await measure(lambda: client.get("/api/users/search_all/", params={"data": query}), repeat)
+
+        rows.append([query, first_page, second_page, search_all])
+
+    return rows
+
+
+async def main(args: argparse.Namespace) -> None:
+    first_names = names(2_000, 2, seed=1)
+    last_names = names(20_000, 3, seed=2)
+
+    if not args.no_seed:
+        reset_schema()
+        execute("SELECT setseed(0.42)")
+        seed_users(
+            args.users,
+            first_name=pick(first_names),
+            last_name=pick(last_names),
+            username=f"lower({pick(last_names)}) || n",
+        )
+        execute("ANALYZE users")
+
+    queries = [
+        first_names[0].lower(),
+        last_names[0][:4].lower(),
+        last_names[len(last_names) // 2].lower(),
+        f"{last_names[-1].lower()}{args.users // 2}",
+    ]
+
+    async with api_client() as client:
+        indexed = await run(client, queries, args.limit, args.repeat)
+    async with api_client(session_setup="SET enable_bitmapscan = off") as client:
+        scanned = await run(client, queries, args.limit, max(1, args.repeat // 5))
+
+    print_table(
+        ["query", "search, ms", "search page 2, ms", "search_all, ms",
+         "no trgm: search, ms", "page 2, ms", "search_all, ms"],
+        [row + other[1:] for row, other in zip(indexed, scanned)]
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--no-seed", action="store_true", help="Reuse the data of the previous run")
+
+    asyncio.run(main(parser.parse_args()))
@@ -1,3 +1,4 @@
+import tempfile
 from dataclasses import dataclass
 from pathlib import Path
 from ipaddress import ip_address
@@ -46,11 +47,50 @@ class Settings(BaseSettings):
     redis_port: int = 6379
     redis_password: str = "qwerty"
 
+    tag_cache_size: int = 1024
+    tag_cache_ttl: float = 300.0
+    user_cache_size: int = 1024
+    user_cache_ttl: float = 10.0
+    token_cache_size: int = 4096
+    read_cache_size: int = 10_000
+    read_cache_ttl: int = 120
+    read_cache_local_ttl: float = 30.0
+    read_cache_negative_ttl: int = 30
+    read_cache_lock_timeout: float = 2.0
+    search_timeout: float = 2.0
+    revocation_filter_capacity: int = 100_000
+    revocation_filter_error_rate: float = 0.001
+    revocation_rebuild_interval: float = 900.0
+    password_hash_workers: int = 2
+    password_hash_max_pending: int = 32
+    login_throttle_window: int = 900
+    login_throttle_email_attempts: int = 5
+    login_throttle_ip_attempts: int = 20
+    login_throttle_base_delay: float = 1.0
+    login_throttle_max_delay: float = 900.0
+    # Addresses or networks of the reverse proxies whose X-Forwarded-For is trusted, e.g. ["10.0.0.0/8"]
+    trusted_proxies: list[str] = []
+
     cloudinary_name: str = "cloudinary name"
     cloudinary_api_key: int = "0000000000000000"
     cloudinary_api_secret: str = "secret"
     cloudinary_folder: str = "media"
 
+    storage_backend: str = "cloudinary"
+    storage_local_root: str = str(BASE_DIR / "media")
+    storage_local_url: str = API_PREFIX + "/storage"
+    upload_max_size: int = 10 * 1024 * 1024
+    upload_concurrency: int = 8
+    upload_max_pending: int = 64
+    upload_timeout: float = 30.0
+    upload_retries: int = 3
+    upload_backoff: float = 0.5
+    # Files of accepted uploads until a job stores them, they are not kept across restarts
+    upload_spool_dir: str = str(Path(tempfile.gettempdir()) / "svitlogram-spool")
+    upload_job_workers: int = 4
+    upload_job_max_pending: int = 256
+    upload_job_ttl: int = 24 * 60 * 60
+
     OPENAI_API_KEY: str = 'OPENAI_API_KEY'
 
     class Config:
@@ -4,7 +4,6 @@ import openai
 
 from pathlib import Path
 import uvicorn
-import redis.asyncio as redis
 from fastapi import FastAPI, Depends, HTTPException, status, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
@@ -14,11 +13,18 @@ from fastapi.responses import JSONResponse
 from fastapi_limiter import FastAPILimiter
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy import text
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
-from svitlogram.database.connect import get_db
+from svitlogram.database.connect import get_db, redis_client, redis_pool
 from svitlogram.routes import router
+from svitlogram.services.tag_cache import tag_cache
+from svitlogram.services.user_cache import user_cache
+from svitlogram.services.read_cache import read_cache
+from svitlogram.services.revocation import revocation_store
+from svitlogram.services.passwords import password_hasher
+from svitlogram.services.uploader import uploader
+from svitlogram.services.uploads import upload_jobs
 from config import (
     settings,
     PROJECT_NAME,
@@ -81,11 +87,31 @@ async def startup():
     #     await redis.Redis(host=settings.redis_host, port=settings.redis_port, password=settings.redis_password,
     #                       db=0, encoding="utf-8", decode_responses=True)
     # )
-    r = await redis.Redis(host=settings.redis_host, port=settings.redis_port,
+    await FastAPILimiter.init(redis_client)
+    await tag_cache.start()
+    await user_cache.start()
+    await read_cache.start()
+    await revocation_store.start()
+    await password_hasher.start()
+    await upload_jobs.start()
 
-                           db=0, encoding="utf-8", decode_responses=True, password=settings.redis_password) 
 
-    await FastAPILimiter.init(r)
+@app.on_event("shutdown")
+async def shutdown():
+    """
+    The shutdown function is called when the application stops.
+    It stops the background tasks started in startup and closes the Redis connections.
+
+    :return: None
+    """
+    await tag_cache.stop()
+    await user_cache.stop()
+    await read_cache.stop()
+    await revocation_store.stop()
+    await password_hasher.stop()
+    await upload_jobs.stop()
+    await uploader.stop()
+    await redis_pool.disconnect()
 
 
 templates = Jinja2Templates(directory="templates")
@@ -99,18 +125,18 @@ async def root(request: Request):
 
 
 @app.get("/api/healthchecker")
-def healthchecker(db: Session = Depends(get_db)):
+async def healthchecker(db: AsyncSession = Depends(get_db)):
     """
     The healthchecker function is a simple function that checks if the database is configured correctly.
     It does this by executing a query and checking if it returns any results. If it doesn't, then there's something wrong with the database configuration.
     
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A dictionary with a message
     :doc-author: Trelent
     """
     try:
         result = (
-            db.execute(text("SELECT 1"))  # noqa
+            await db.execute(text("SELECT 1"))  # noqa
         ).fetchone()
 
         if result is None:
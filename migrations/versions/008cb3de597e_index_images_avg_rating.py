@@ -0,0 +1,31 @@
+"""Index images avg rating
+
+Revision ID: 008cb3de597e
+Revises: 5a27b931f096
+Create Date: 2026-10-17 09:12:31.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '008cb3de597e'
+down_revision = '5a27b931f096'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "UPDATE images SET avg_rating = coalesce("
+        "(SELECT round(avg(rating), 1) FROM image_ratings WHERE image_ratings.image_id = images.id), 0) "
+        "WHERE avg_rating IS NULL"
+    )
+    op.alter_column('images', 'avg_rating', existing_type=sa.Float(), nullable=False, server_default='0')
+    op.create_index('ix_images_avg_rating_id', 'images', ['avg_rating', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_images_avg_rating_id', table_name='images')
+    op.alter_column('images', 'avg_rating', existing_type=sa.Float(), nullable=True, server_default=None)
@@ -0,0 +1,24 @@
+"""Index image m2m tag tag id
+
+Revision ID: 1d6a4c8e2f70
+Revises: e4b8f2a61c3d
+Create Date: 2026-10-17 18:03:12.558120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1d6a4c8e2f70'
+down_revision = 'e4b8f2a61c3d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_image_m2m_tag_tag_id_image_id', 'image_m2m_tag', ['tag_id', 'image_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_image_m2m_tag_tag_id_image_id', table_name='image_m2m_tag')
@@ -0,0 +1,33 @@
+"""Add images ratings aggregates
+
+Revision ID: 3f1c2b7d9a40
+Revises: 008cb3de597e
+Create Date: 2026-10-17 11:40:07.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2b7d9a40'
+down_revision = '008cb3de597e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('images', sa.Column('ratings_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('images', sa.Column('ratings_sum', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        "UPDATE images SET ratings_count = totals.ratings_count, ratings_sum = totals.ratings_sum, "
+        "avg_rating = round(totals.ratings_sum::numeric / totals.ratings_count, 1) "
+        "FROM (SELECT image_id, count(*) AS ratings_count, sum(rating) AS ratings_sum "
+        "FROM image_ratings GROUP BY image_id) AS totals "
+        "WHERE totals.image_id = images.id"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('images', 'ratings_sum')
+    op.drop_column('images', 'ratings_count')
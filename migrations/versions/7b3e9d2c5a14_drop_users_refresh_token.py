@@ -0,0 +1,24 @@
+"""Drop users refresh token
+
+Revision ID: 7b3e9d2c5a14
+Revises: 1d6a4c8e2f70
+Create Date: 2026-10-17 21:40:27.318054
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3e9d2c5a14'
+down_revision = '1d6a4c8e2f70'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.drop_column('users', 'refresh_token')
+
+
+def downgrade() -> None:
+    op.add_column('users', sa.Column('refresh_token', sa.String(length=255), autoincrement=False, nullable=True))
@@ -0,0 +1,36 @@
+"""Add image files shared by images with the same content
+
+Revision ID: b2d7e5c91f38
+Revises: 7b3e9d2c5a14
+Create Date: 2026-10-17 22:18:05.731642
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2d7e5c91f38'
+down_revision = '7b3e9d2c5a14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'image_files',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('content_hash', sa.String(length=64), nullable=False),
+        sa.Column('storage', sa.String(length=20), nullable=False),
+        sa.Column('public_id', sa.String(length=255), nullable=False),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('content_hash', 'storage', name='unique_content_hash_storage'),
+    )
+    op.add_column('images', sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('images', 'content_hash')
+    op.drop_table('image_files')
@@ -0,0 +1,92 @@
+"""Add images search vector
+
+Revision ID: c7e1a9d04b52
+Revises: 3f1c2b7d9a40
+Create Date: 2026-10-17 14:05:52.830461
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e1a9d04b52'
+down_revision = '3f1c2b7d9a40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('images', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+    op.create_index('ix_image_m2m_tag_image_id', 'image_m2m_tag', ['image_id'], unique=False)
+
+    op.execute("""
+    CREATE OR REPLACE FUNCTION images_search_vector(image_id integer, description text) RETURNS tsvector AS $$
+        SELECT setweight(to_tsvector('english', coalesce(description, '')), 'A') ||
+               setweight(to_tsvector('english', coalesce(string_agg(tags.name, ' '), '')), 'B')
+        FROM image_m2m_tag JOIN tags ON tags.id = image_m2m_tag.tag_id
+        WHERE image_m2m_tag.image_id = $1
+    $$ LANGUAGE sql STABLE
+    """)
+    op.execute("""
+    CREATE OR REPLACE FUNCTION images_search_vector_trigger() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := images_search_vector(NEW.id, NEW.description);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+    CREATE OR REPLACE FUNCTION image_tags_search_vector_trigger() RETURNS trigger AS $$
+    BEGIN
+        UPDATE images SET search_vector = images_search_vector(id, description)
+        WHERE id IN (SELECT image_id FROM changed_rows);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+    CREATE OR REPLACE FUNCTION tags_search_vector_trigger() RETURNS trigger AS $$
+    BEGIN
+        UPDATE images SET search_vector = images_search_vector(id, description)
+        WHERE id IN (SELECT image_id FROM image_m2m_tag WHERE tag_id = NEW.id);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+    CREATE TRIGGER images_search_vector BEFORE INSERT OR UPDATE OF description ON images
+    FOR EACH ROW EXECUTE FUNCTION images_search_vector_trigger()
+    """)
+    op.execute("""
+    CREATE TRIGGER image_m2m_tag_insert_search_vector AFTER INSERT ON image_m2m_tag
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION image_tags_search_vector_trigger()
+    """)
+    op.execute("""
+    CREATE TRIGGER image_m2m_tag_delete_search_vector AFTER DELETE ON image_m2m_tag
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION image_tags_search_vector_trigger()
+    """)
+    op.execute("""
+    CREATE TRIGGER tags_search_vector AFTER UPDATE OF name ON tags
+    FOR EACH ROW EXECUTE FUNCTION tags_search_vector_trigger()
+    """)
+
+    op.execute("UPDATE images SET search_vector = images_search_vector(id, description)")
+    op.create_index('ix_images_search_vector', 'images', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_images_search_vector', table_name='images', postgresql_using='gin')
+    op.execute("DROP TRIGGER tags_search_vector ON tags")
+    op.execute("DROP TRIGGER image_m2m_tag_delete_search_vector ON image_m2m_tag")
+    op.execute("DROP TRIGGER image_m2m_tag_insert_search_vector ON image_m2m_tag")
+    op.execute("DROP TRIGGER images_search_vector ON images")
+    op.execute("DROP FUNCTION tags_search_vector_trigger()")
+    op.execute("DROP FUNCTION image_tags_search_vector_trigger()")
+    op.execute("DROP FUNCTION images_search_vector_trigger()")
+    op.execute("DROP FUNCTION images_search_vector(integer, text)")
+    op.drop_column('images', 'search_vector')
+    op.drop_index('ix_image_m2m_tag_image_id', table_name='image_m2m_tag')
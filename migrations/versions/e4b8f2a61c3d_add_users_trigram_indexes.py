@@ -0,0 +1,28 @@
+"""Add users trigram indexes
+
+Revision ID: e4b8f2a61c3d
+Revises: c7e1a9d04b52
+Create Date: 2026-10-17 16:21:44.106972
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b8f2a61c3d'
+down_revision = 'c7e1a9d04b52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for column in ('first_name', 'last_name', 'username'):
+        op.create_index(f'ix_users_{column}_trgm', 'users', [column], unique=False,
+                        postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    for column in ('username', 'last_name', 'first_name'):
+        op.drop_index(f'ix_users_{column}_trgm', table_name='users', postgresql_using='gin')
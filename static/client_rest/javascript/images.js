@@ -121,7 +121,7 @@ const getImeges = async () => {
     result = await respons.json()
     images.innerHTML = ""
 
-    for (const image of result) {
+    for (const image of result.images) {
       const img = document.createElement('img');
       img.src = image.url;
       const user = image.user_id ? await getUserById(image.user_id) : null;
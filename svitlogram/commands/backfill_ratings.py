@@ -0,0 +1,26 @@
+"""
+Rebuild the ratings_count, ratings_sum and avg_rating columns of images from the image_ratings table.
+
+    python -m svitlogram.commands.backfill_ratings [--image-id ID]
+"""
+import argparse
+import asyncio
+from typing import Optional
+
+from svitlogram.database.connect import AsyncDBSession, engine
+from svitlogram.repository.image_ratings import recalculate_image_ratings
+
+
+async def main(image_id: Optional[int] = None) -> None:
+    async with AsyncDBSession() as db:
+        updated = await recalculate_image_ratings(db, image_id=image_id)
+    await engine.dispose()
+
+    print(f"Recalculated ratings of {updated} image(s)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image-id", type=int, default=None, help="Recalculate a single image")
+
+    asyncio.run(main(parser.parse_args().image_id))
@@ -1,23 +1,33 @@
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+import redis.asyncio as redis
+from sqlalchemy.engine import make_url
 from sqlalchemy.exc import DatabaseError
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
 from config import settings
 
-DATABASE_URL = settings.DATABASE_URL
+DATABASE_URL = make_url(settings.DATABASE_URL).set(drivername="postgresql+asyncpg")
 
-engine = create_engine(DATABASE_URL, echo=True, max_overflow=5)
+engine = create_async_engine(DATABASE_URL, echo=True, max_overflow=5)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncDBSession = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+# One connection pool per process, shared by the rate limiter, the auth service and the tag cache.
+# It is disconnected on shutdown, connections cannot outlive the event loop that opened them.
+redis_pool = redis.ConnectionPool(
+    host=settings.redis_host, port=settings.redis_port, db=0, password=settings.redis_password
+)
+redis_client = redis.Redis(connection_pool=redis_pool)
 
 
 # Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    except DatabaseError as e:
-        db.rollback()
-    finally:
-        db.close()
+async def get_db():
+    async with AsyncDBSession() as db:
+        try:
+            yield db
+        except DatabaseError:
+            await db.rollback()
+
+
+# Dependency for handlers that need several sessions at once, e.g. to run queries concurrently
+def get_session_factory() -> async_sessionmaker:
+    return AsyncDBSession
@@ -1,6 +1,7 @@
 from .base import Base
 from .users import User, UserRole
 from .images import Image
+from .image_files import ImageFile
 from .image_comments import ImageComment
 from .image_formats import ImageFormat
 from .tags import Tag
@@ -12,6 +13,7 @@ __all__ = (
     'User',
     'UserRole',
     'Image',
+    'ImageFile',
     'ImageComment',
     'ImageFormat',
     'Tag',
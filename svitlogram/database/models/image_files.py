@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from sqlalchemy import String, UniqueConstraint, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+
+
+class ImageFile(Base):
+    """A file in the storage, shared by the images uploaded with the same content"""
+    __tablename__ = "image_files"
+    __table_args__ = (
+        UniqueConstraint('content_hash', 'storage', name='unique_content_hash_storage'),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    content_hash: Mapped[str] = mapped_column(String(64))
+    storage: Mapped[str] = mapped_column(String(20))
+    public_id: Mapped[str] = mapped_column(String(255))
+    ref_count: Mapped[int] = mapped_column(default=1)
+    created_at: Mapped[datetime] = mapped_column(default=func.now())
@@ -9,7 +9,11 @@ from sqlalchemy import (
     Table,
     Column,
     Float,
+    Index,
+    DDL,
+    event,
 )
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .tags import Tag
@@ -26,23 +30,99 @@ image_m2m_tag = Table(
     Column("id", Integer, primary_key=True),
     Column("image_id", Integer, ForeignKey("images.id", ondelete="CASCADE")),
     Column("tag_id", Integer, ForeignKey("tags.id", ondelete="CASCADE")),
+    Index("ix_image_m2m_tag_image_id", "image_id"),
+    Index("ix_image_m2m_tag_tag_id_image_id", "tag_id", "image_id"),
 )
 
 
 class Image(Base):
     __tablename__ = 'images'
+    __table_args__ = (
+        Index('ix_images_avg_rating_id', 'avg_rating', 'id'),
+        Index('ix_images_search_vector', 'search_vector', postgresql_using='gin'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     public_id: Mapped[str] = mapped_column(String(255))
+    content_hash: Mapped[Optional[str]] = mapped_column(String(64))
     description: Mapped[str] = mapped_column(String(1200))
     created_at: Mapped[datetime] = mapped_column(default=func.now())
     updated_at: Mapped[Optional[datetime]] = mapped_column(onupdate=func.now())
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
-    avg_rating: Mapped[float] = mapped_column(Float, default=0, nullable=True)
+    avg_rating: Mapped[float] = mapped_column(Float, default=0, server_default='0')
+    ratings_count: Mapped[int] = mapped_column(Integer, default=0, server_default='0')
+    ratings_sum: Mapped[int] = mapped_column(Integer, default=0, server_default='0')
+    search_vector: Mapped[Optional[str]] = mapped_column(TSVECTOR, deferred=True)
 
     user: Mapped[User] = relationship(backref="images")
-    tags: Mapped[Tag] = relationship("Tag", secondary=image_m2m_tag, backref="images", lazy='joined')
-    comments: Mapped[ImageComment] = relationship(backref="image", cascade="all, delete-orphan")
-    formats: Mapped[ImageFormat] = relationship(backref="image", cascade="all, delete-orphan")
-    ratings: Mapped[ImageRating] = relationship(backref="image", cascade="all, delete-orphan")
-    
\ No newline at end of file
+    tags: Mapped[list[Tag]] = relationship("Tag", secondary=image_m2m_tag, backref="images", lazy='joined')
+    comments: Mapped[list[ImageComment]] = relationship(backref="image", cascade="all, delete-orphan")
+    formats: Mapped[list[ImageFormat]] = relationship(backref="image", cascade="all, delete-orphan")
+    ratings: Mapped[list[ImageRating]] = relationship(backref="image", cascade="all, delete-orphan")
+    
+
+
+SEARCH_CONFIG = 'english'
+
+# search_vector is filled by triggers: Postgres generated columns cannot read the tag names of other tables
+SEARCH_VECTOR_DDL = (
+    f"""
+    CREATE OR REPLACE FUNCTION images_search_vector(image_id integer, description text) RETURNS tsvector AS $$
+        SELECT setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(description, '')), 'A') ||
+               setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(string_agg(tags.name, ' '), '')), 'B')
+        FROM image_m2m_tag JOIN tags ON tags.id = image_m2m_tag.tag_id
+        WHERE image_m2m_tag.image_id = $1
+    $$ LANGUAGE sql STABLE
+    """,
+    """
+    CREATE OR REPLACE FUNCTION images_search_vector_trigger() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := images_search_vector(NEW.id, NEW.description);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION image_tags_search_vector_trigger() RETURNS trigger AS $$
+    BEGIN
+        UPDATE images SET search_vector = images_search_vector(id, description)
+        WHERE id IN (SELECT image_id FROM changed_rows);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION tags_search_vector_trigger() RETURNS trigger AS $$
+    BEGIN
+        UPDATE images SET search_vector = images_search_vector(id, description)
+        WHERE id IN (SELECT image_id FROM image_m2m_tag WHERE tag_id = NEW.id);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS images_search_vector ON images",
+    """
+    CREATE TRIGGER images_search_vector BEFORE INSERT OR UPDATE OF description ON images
+    FOR EACH ROW EXECUTE FUNCTION images_search_vector_trigger()
+    """,
+    "DROP TRIGGER IF EXISTS image_m2m_tag_insert_search_vector ON image_m2m_tag",
+    """
+    CREATE TRIGGER image_m2m_tag_insert_search_vector AFTER INSERT ON image_m2m_tag
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION image_tags_search_vector_trigger()
+    """,
+    "DROP TRIGGER IF EXISTS image_m2m_tag_delete_search_vector ON image_m2m_tag",
+    """
+    CREATE TRIGGER image_m2m_tag_delete_search_vector AFTER DELETE ON image_m2m_tag
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION image_tags_search_vector_trigger()
+    """,
+    "DROP TRIGGER IF EXISTS tags_search_vector ON tags",
+    """
+    CREATE TRIGGER tags_search_vector AFTER UPDATE OF name ON tags
+    FOR EACH ROW EXECUTE FUNCTION tags_search_vector_trigger()
+    """,
+)
+
+for statement in SEARCH_VECTOR_DDL:
+    event.listen(Base.metadata, 'after_create', DDL(statement))
@@ -5,7 +5,7 @@ from strenum import StrEnum
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import String, func, event, Column, Enum
+from sqlalchemy import String, func, event, Column, Enum, Index, DDL
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.dialects.postgresql import ENUM
 
@@ -20,6 +20,10 @@ class UserRole(StrEnum):
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = tuple(
+        Index(f'ix_users_{column}_trgm', column, postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+        for column in ('first_name', 'last_name', 'username')
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     username: Mapped[str] = mapped_column(String(50), unique=True, index=True)
@@ -29,7 +33,6 @@ class User(Base):
     last_name: Mapped[str] = mapped_column(String(255), index=True)
     avatar: Mapped[Optional[str]] = mapped_column(String(255))
     role: Mapped[UserRole] = mapped_column(ENUM(UserRole, name='user_role'))
-    refresh_token: Mapped[Optional[str]] = mapped_column(String(255))
     email_verified: Mapped[bool] = mapped_column(default=False)
     is_active: Mapped[bool] = mapped_column(default=True)
     created_at: Mapped[datetime] = mapped_column(default=func.now())
@@ -66,3 +69,6 @@ class User(Base):
         :param cls: Pass the class object to the function
         """
         event.listen(cls, 'before_insert', cls.__set_user_role)
+
+
+event.listen(Base.metadata, 'before_create', DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
@@ -4,12 +4,12 @@ from typing import Optional
 
 from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from svitlogram.database.models import ImageFormat, Image
 
 
-async def create_image_format(user_id: int, image_id: int, format_: dict, db: Session) -> Optional[ImageFormat]:
+async def create_image_format(user_id: int, image_id: int, format_: dict, db: AsyncSession) -> Optional[ImageFormat]:
     """
     The create_image_format function creates a new image format in the database.
 
@@ -27,16 +27,16 @@ async def create_image_format(user_id: int, image_id: int, format_: dict, db: Se
         )
         db.add(format_to_base)
 
-        db.commit()
+        await db.commit()
 
-        db.refresh(format_to_base)
+        await db.refresh(format_to_base)
 
         return format_to_base
     except IntegrityError:
         return
 
 
-async def get_image_formats_by_image_id(user_id: int, image_id: int, db: Session) -> list[Image]:
+async def get_image_formats_by_image_id(user_id: int, image_id: int, db: AsyncSession) -> list[Image]:
     """
     The get_image_formats_by_image_id function returns a list of ImageFormat objects that are associated with the
     image_id parameter. The user_id parameter is used to ensure that only images belonging to the user are returned.
@@ -46,7 +46,7 @@ async def get_image_formats_by_image_id(user_id: int, image_id: int, db: Session
     :param db: AsyncSession: Pass the database session to the function
     :return: A list of image format objects
     """
-    images = db.scalars(
+    images = await db.scalars(
         select(ImageFormat)
         .filter(ImageFormat.image_id == image_id, ImageFormat.user_id == user_id)
     )
@@ -54,7 +54,7 @@ async def get_image_formats_by_image_id(user_id: int, image_id: int, db: Session
     return images.all()  # noqa
 
 
-async def get_image_format_by_id(image_format_id: int, db: Session) -> Image:
+async def get_image_format_by_id(image_format_id: int, db: AsyncSession) -> Image:
     """
     The get_image_format_by_id function returns an ImageFormat object from the database.
 
@@ -62,13 +62,13 @@ async def get_image_format_by_id(image_format_id: int, db: Session) -> Image:
     :param db: AsyncSession: Pass in the database session
     :return: An image object
     """
-    return db.scalar(
+    return await db.scalar(
         select(ImageFormat)
         .filter(ImageFormat.id == image_format_id)
     )
 
 
-async def remove_image_format(image_format: ImageFormat, db: Session) -> None:
+async def remove_image_format(image_format: ImageFormat, db: AsyncSession) -> None:
     """
     The remove_image_format function removes an image format from the database.
 
@@ -76,5 +76,5 @@ async def remove_image_format(image_format: ImageFormat, db: Session) -> None:
     :param db: AsyncSession: Pass the database connection to the function
     :return: None
     """
-    db.delete(image_format)
-    db.commit()
+    await db.delete(image_format)
+    await db.commit()
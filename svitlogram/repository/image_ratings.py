@@ -1,46 +1,66 @@
 from typing import Optional
 
-from sqlalchemy import select, and_, func
-from sqlalchemy.orm import Session
+from sqlalchemy import select, and_, func, update, cast, Numeric, Update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from svitlogram.database.models.image_raiting import ImageRating
 from svitlogram.database.models.images import Image
-from svitlogram.repository.images import get_image_by_id
 
 
-async def create_rating(user_id: int, rating: int, image_id: int, db: Session) -> ImageRating:
+def _average(ratings_sum, ratings_count):
+    return func.coalesce(func.round(cast(ratings_sum, Numeric) / func.nullif(ratings_count, 0), 1), 0)
+
+
+def _update_image_aggregates(image_id: int, count_delta: int, sum_delta: int) -> Update:
+    """
+    The _update_image_aggregates function builds a single UPDATE that shifts the rating counters of an image
+    and derives avg_rating from them, so no rating write has to scan the image's ratings.
+
+    :param image_id: int: The image whose counters change
+    :param count_delta: int: How the number of ratings changes
+    :param sum_delta: int: How the sum of ratings changes
+    :return: The update statement
+    """
+    ratings_count = Image.ratings_count + count_delta
+    ratings_sum = Image.ratings_sum + sum_delta
+
+    return (
+        update(Image)
+        .where(Image.id == image_id)
+        .values(ratings_count=ratings_count, ratings_sum=ratings_sum, avg_rating=_average(ratings_sum, ratings_count))
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def create_rating(user_id: int, rating: int, image_id: int, db: AsyncSession) -> ImageRating:
     """
     The create function creates a new ImageRating object and adds it to the database.
 
     :param user_id: int: Specify the user_id of the rating
     :param rating: int: Create a new rating object
     :param image_id: int: Specify the image_id of the rating
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The new rating object
     """
     rating = ImageRating(rating=rating, image_id=image_id, user_id=user_id)
 
+    await db.execute(_update_image_aggregates(image_id, 1, rating.rating))
     db.add(rating)
-    db.commit()
-    db.refresh(rating)
-
-    image = await get_image_by_id(image_id=image_id, db=db)
-    image.avg_rating = round(await get_image_rating(image, db=db), 1)
-    db.commit()
-    db.refresh(image)
-    
+    await db.commit()
+    await db.refresh(rating)
+
     return rating
 
 
-async def get_all_image_ratings(image_id: int, db: Session) -> list[ImageRating]:
+async def get_all_image_ratings(image_id: int, db: AsyncSession) -> list[ImageRating]:
     """
     The get_all_ratings function returns all ratings for a given image.
 
     :param image_id: int: Specify the image_id of the image we want to get all ratings for
-    :param db: Session: Pass in the database session
+    :param db: AsyncSession: Pass in the database session
     :return: A list of dictionaries
     """
-    ratings = db.scalars(
+    ratings = await db.scalars(
         select(ImageRating)
         .filter(ImageRating.image_id == image_id)
     )
@@ -48,81 +68,119 @@ async def get_all_image_ratings(image_id: int, db: Session) -> list[ImageRating]
     return ratings.all()  # noqa
 
 
-async def get_rating_by_id(rating_id: int, db: Session) -> Optional[ImageRating]:
+async def get_rating_by_id(rating_id: int, db: AsyncSession) -> Optional[ImageRating]:
     """
     The get_rating_by_id function takes in a rating_id and an AsyncSession object.
     It then queries the database for the ImageRating with that id, and returns it.
 
     :param rating_id: int: Specify the id of the rating that is being queried
-    :param db: Session: Pass the database connection to the function
+    :param db: AsyncSession: Pass the database connection to the function
     :return: A rating object from the database
     """
-    return db.scalar(
+    return await db.scalar(
         select(ImageRating)
         .filter(ImageRating.id == rating_id)
     )
 
 
-async def get_rating_by_image_id_and_user(user_id: int, image_id: int, db: Session) -> Optional[ImageRating]:
+async def get_rating_by_image_id_and_user(user_id: int, image_id: int, db: AsyncSession) -> Optional[ImageRating]:
     """
     The get_rating_by_user_id_and_image_id function returns the rating of an image by a user.
 
     :param user_id: int: Specify the user_id of the image rating
     :param image_id: int: Filter the query by image_id
-    :param db: Session: Pass in the database session
+    :param db: AsyncSession: Pass in the database session
     :return: The rating of the user for the image with id = image_id
     """
-    return db.scalar(
+    return await db.scalar(
         select(ImageRating)
         .filter(and_(ImageRating.image_id == image_id, ImageRating.user_id == user_id))
     )
 
 
-async def remove_rating(rating: ImageRating, db: Session) -> None:
+async def _lock_rating_value(rating: ImageRating, db: AsyncSession) -> Optional[int]:
+    """
+    The _lock_rating_value function reads the stored value of a rating and locks its row until the transaction ends,
+    so that concurrent writes of the same rating shift the counters of the image one after another.
+    The value loaded with the object may already have been changed by another request.
+
+    :param rating: ImageRating: The rating to lock
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The stored value, None if the rating was removed meanwhile
+    """
+    return await db.scalar(
+        select(ImageRating.rating)
+        .filter(ImageRating.id == rating.id)
+        .with_for_update()
+    )
+
+
+async def remove_rating(rating: ImageRating, db: AsyncSession) -> None:
     """
     The remove_rating function removes a rating from the database.
 
     :param rating: ImageRating: Pass in the rating object that we want to remove
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: None
     """
-    
-    image = await get_image_by_id(image_id=rating.image_id, db=db)
-    
-    db.delete(rating)
-    db.commit()
+    old_rating = await _lock_rating_value(rating, db)
+    if old_rating is None:
+        await db.rollback()
+        return
 
-    image.avg_rating = round(await get_image_rating(image, db=db), 1)
-    db.commit()
-    db.refresh(image)
+    await db.execute(_update_image_aggregates(rating.image_id, -1, -old_rating))
+    await db.delete(rating)
+    await db.commit()
 
 
-async def update_rating(rating: ImageRating, new_rating: int, db: Session) -> ImageRating:
+async def update_rating(rating: ImageRating, new_rating: int, db: AsyncSession) -> Optional[ImageRating]:
     """
     The update_rating function updates the rating of an image.
 
     :param rating: ImageRating: Pass in the rating object that we want to update
     :param new_rating: int: Pass in the new rating value
-    :param db: Session: Pass the database session to the function
-    :return: The new rating
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The new rating, None if it was removed meanwhile
     """
-    rating.rating = new_rating
-    db.commit()
+    old_rating = await _lock_rating_value(rating, db)
+    if old_rating is None:
+        await db.rollback()
+        return None
 
-    db.refresh(rating)
+    await db.execute(_update_image_aggregates(rating.image_id, 0, new_rating - old_rating))
+    rating.rating = new_rating
+    await db.commit()
 
-    image = await get_image_by_id(image_id=rating.image_id, db=db)
-    image.avg_rating = round(await get_image_rating(image, db=db), 1)
-    db.commit()
-    db.refresh(image)
+    await db.refresh(rating)
 
     return rating
 
-async def get_image_rating(image: Image, db: Session) -> float:
-    average_rating = (
-        db.query(func.coalesce(func.avg(ImageRating.rating), 0))
-        .filter(ImageRating.image_id == image.id)
-        .scalar()
+
+async def recalculate_image_ratings(db: AsyncSession, image_id: Optional[int] = None) -> int:
+    """
+    The recalculate_image_ratings function rebuilds ratings_count, ratings_sum and avg_rating from the
+    image_ratings table. It is meant for backfills and repairs, rating writes keep the counters up to date.
+
+    :param db: AsyncSession: Pass the database session to the function
+    :param image_id: Optional[int]: Recalculate a single image, all images if omitted
+    :return: The number of updated images
+    """
+    ratings_count = select(func.count(ImageRating.id)).filter(ImageRating.image_id == Image.id).scalar_subquery()
+    ratings_sum = (
+        select(func.coalesce(func.sum(ImageRating.rating), 0))
+        .filter(ImageRating.image_id == Image.id)
+        .scalar_subquery()
     )
 
-    return average_rating    
\ No newline at end of file
+    query = (
+        update(Image)
+        .values(ratings_count=ratings_count, ratings_sum=ratings_sum, avg_rating=_average(ratings_sum, ratings_count))
+        .execution_options(synchronize_session=False)
+    )
+    if image_id is not None:
+        query = query.where(Image.id == image_id)
+
+    result = await db.execute(query)
+    await db.commit()
+
+    return result.rowcount
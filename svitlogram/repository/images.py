@@ -1,13 +1,18 @@
 
 import enum
-from sqlalchemy import select, func
+from datetime import datetime
+from sqlalchemy import select, tuple_, func, false, true, and_, bindparam, update, delete
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import Session, aliased
-from svitlogram.database.models import Image, Tag, ImageRating
+from sqlalchemy.orm import aliased
+from svitlogram.database.models import Image, ImageFile, Tag
+from svitlogram.database.models.images import SEARCH_CONFIG, image_m2m_tag
+from svitlogram.services.read_cache import read_cache, OrmSnapshot
+from svitlogram.utils.cursor import encode_cursor, decode_cursor
 
-from typing import Optional, Type
+from typing import Optional, Type, Any
 
-from .tags import get_or_create_tags
+from .tags import get_or_create_tags, get_tag_ids
 
 
 class SortMode(enum.Enum):
@@ -19,35 +24,129 @@ class SortMode(enum.Enum):
     DATE_DESC = 'date_added_desc'
 
 
-async def get_image_by_id(image_id: int, db: Session) -> Image:
+class TagMatch(enum.Enum):
+
+    EXACT = 'exact'
+    FUZZY = 'fuzzy'
+
+
+@read_cache.cached("image", OrmSnapshot(Image, "tags"))
+async def get_image_by_id(image_id: int, db: AsyncSession) -> Image:
     """
-    The get_image_by_id function returns an image from the database.
+    The get_image_by_id function returns an image from the database, through the read cache.
 
     :param image_id: int: Filter the images by id
-    :param db: Session: Pass in the database session to use
+    :param db: AsyncSession: Pass in the database session to use
     :return: A single image object
     """
-    return db.scalar(
+    return await db.scalar(
         select(Image)
         .filter(Image.id == image_id)
     )
     
 
-async def create_image(user_id: int, description: str, tags: list[str], public_id: str, db: Session) -> Image:
+async def acquire_file(content_hash: str, storage: str, db: AsyncSession) -> Optional[str]:
+    """
+    The acquire_file function adds a reference to the stored file with the content, if an image already has it,
+    so that the file is reused instead of uploaded again.
+    The reference is locked until the transaction ends, a delete of the last other image waits for it.
+    When no image has the content, the transaction is ended, no connection is held while the file is uploaded.
+
+    :param content_hash: str: The SHA-256 of the content
+    :param storage: str: The name of the storage backend
+    :param db: AsyncSession: Pass in the database session
+    :return: The public id of the file, None if it has to be uploaded
+    """
+    public_id = await db.scalar(
+        update(ImageFile)
+        .filter(ImageFile.content_hash == content_hash, ImageFile.storage == storage)
+        .values(ref_count=ImageFile.ref_count + 1)
+        .returning(ImageFile.public_id)
+    )
+    if public_id is None:
+        await db.commit()
+
+    return public_id
+
+
+async def lock_file(content_hash: str, db: AsyncSession) -> None:
+    """
+    The lock_file function locks the content until the transaction ends, so that a file is not removed
+    while another upload adds a reference to it.
+
+    :param content_hash: str: The SHA-256 of the content
+    :param db: AsyncSession: Pass in the database session
+    :return: None
+    """
+    await db.execute(select(func.pg_advisory_xact_lock(func.hashtext(content_hash))))
+
+
+async def add_file(content_hash: str, storage: str, public_id: str, db: AsyncSession) -> str:
+    """
+    The add_file function records an uploaded file with one reference.
+    If the same content was stored meanwhile by another upload, a reference to that file is added instead.
+    The content is locked until the transaction ends, see lock_file.
+
+    :param content_hash: str: The SHA-256 of the content
+    :param storage: str: The name of the storage backend
+    :param public_id: str: The public id of the uploaded file
+    :param db: AsyncSession: Pass in the database session
+    :return: The public id of the file the image has to use
+    """
+    await lock_file(content_hash, db)
+
+    return await db.scalar(
+        insert(ImageFile)
+        .values(content_hash=content_hash, storage=storage, public_id=public_id, ref_count=1)
+        .on_conflict_do_update(
+            constraint='unique_content_hash_storage',
+            set_={'ref_count': ImageFile.ref_count + 1},
+        )
+        .returning(ImageFile.public_id)
+    )
+
+
+async def is_file_unused(content_hash: Optional[str], public_id: str, db: AsyncSession) -> bool:
+    """
+    The is_file_unused function checks that no image references the stored file any more.
+    The content is locked until the transaction ends, an upload of it waits and does not add a reference
+    to a file that is being removed.
+
+    :param content_hash: Optional[str]: The SHA-256 of the content, None for images stored before it was recorded
+    :param public_id: str: The public id of the file
+    :param db: AsyncSession: Pass in the database session
+    :return: True if the file can be removed from the storage
+    """
+    if content_hash is None:
+        return True
+
+    await lock_file(content_hash, db)
+    file_id = await db.scalar(
+        select(ImageFile.id)
+        .filter(ImageFile.content_hash == content_hash, ImageFile.public_id == public_id)
+    )
+
+    return file_id is None
+
+
+async def create_image(user_id: int, description: str, tags: list[str], public_id: str, db: AsyncSession,
+                       content_hash: Optional[str] = None) -> Image:
     """
     The create_image function creates a new image in the database.
 
     :param user_id: int: Specify the user who uploaded the image
     :param description: str: Describe the image
     :param tags: list[str]: Specify that the tags parameter is a list of strings
-    :param public_id: str: Store the public id of the image in cloudinary
-    :param db: Session: Pass in the database session
+    :param public_id: str: Store the public id of the image in the storage
+    :param db: AsyncSession: Pass in the database session
+    :param content_hash: Optional[str]: The SHA-256 of the content, its file was acquired or added before
     :return: An image object
     """
     image = Image(
         user_id=user_id,
         description=description,
-        public_id=public_id
+        public_id=public_id,
+        content_hash=content_hash,
     )
 
     if tags:
@@ -55,21 +154,21 @@ async def create_image(user_id: int, description: str, tags: list[str], public_i
 
     db.add(image)
 
-    db.commit()
+    await db.commit()
 
-    db.refresh(image)
+    await db.refresh(image)
 
     return image
 
 
-async def update_description(image_id: int, description: str, tags: list[str], db: Session) -> Optional[Image]:
+async def update_description(image_id: int, description: str, tags: list[str], db: AsyncSession) -> Optional[Image]:
     """
     The update_description function updates the description and tags of an image.
 
     :param image_id: int: Specify the image to update
     :param description: str: Update the description of an image
     :param tags: list[str]: Pass in a list of tags
-    :param db: Session: Pass in the database session
+    :param db: AsyncSession: Pass in the database session
     :return: An image object
     """
     tags = await get_or_create_tags(tags, db)
@@ -78,22 +177,39 @@ async def update_description(image_id: int, description: str, tags: list[str], d
     if image:
         image.description = description
         image.tags = tags
-        db.commit()
-        db.refresh(image)
+        await db.commit()
+        await db.refresh(image)
 
     return image
 
 
-async def delete_image(image: Image, db: Session) -> None:
+async def delete_image(image: Image, db: AsyncSession) -> bool:
     """
-    The delete_image function deletes an image from the database.
+    The delete_image function deletes an image from the database and its reference to the stored file.
 
     :param image: Image: Pass the image object to be deleted
-    :param db: Session: Pass in the database session
-    :return: None, which is the default return value for a function that doesn't explicitly return anything
+    :param db: AsyncSession: Pass in the database session
+    :return: True if no image uses the file any more, so it can be removed from the storage
     """
-    db.delete(image)
-    db.commit()
+    unused = True
+    if image.content_hash is not None:
+        ref_count = await db.scalar(
+            update(ImageFile)
+            .filter(ImageFile.content_hash == image.content_hash, ImageFile.public_id == image.public_id)
+            .values(ref_count=ImageFile.ref_count - 1)
+            .returning(ImageFile.ref_count)
+        )
+        if ref_count == 0:
+            await db.execute(
+                delete(ImageFile)
+                .filter(ImageFile.content_hash == image.content_hash, ImageFile.public_id == image.public_id)
+            )
+        unused = not ref_count
+
+    await db.delete(image)
+    await db.commit()
+
+    return unused
 
 
 async def get_images(
@@ -104,74 +220,176 @@ async def get_images(
         image_id: int,
         user_id: int,
         sort_by: SortMode,
-        db: Session
-) -> list[Image]:
+        db: AsyncSession,
+        cursor: Optional[str] = None,
+        tag_match: TagMatch = TagMatch.EXACT,
+) -> tuple[list[Image], Optional[str]]:
     """
     The get_images function is used to retrieve images from the database.
     It takes in a skip, limit, description, tags and image_id as parameters.
-    The skip parameter is used to determine how many images should be skipped before returning results.
-    The limit parameter determines how many results should be returned after skipping the specified number of images.
-    If no value for either of these parameters are provided then they default to 0 and 10 respectively (i.e., return all).
-    The description parameter allows you to search for an image by its description field using SQL LIKE syntax (e.g., %description% will match any image with
-
-    :param skip: int: Skip the first n images
+    Pages are read with keyset pagination: the cursor holds the sort key of the last image of the previous page,
+    so the cost of a page does not depend on how deep the client has scrolled.
+    The skip parameter is only used as a fallback when no cursor is provided.
+    The limit parameter determines how many results should be returned.
+    The description parameter is matched with full-text search against the description and tag names of the image.
+    An image must have all the tags. By default the tag names are matched exactly: they are resolved to ids once
+    and the images are found through the (tag_id, image_id) index of image_m2m_tag.
+    TagMatch.FUZZY matches every tag as a case-insensitive substring of the tag names instead.
+
+    :param skip: int: Skip the first n images when no cursor is given
     :param limit: int: Limit the number of images returned
     :param description: str: Filter the images by description
     :param tags: list[str]: Filter the images by tags
     :param image_id: int: Filter the images by their id
     :param user_id: int: Filter images by user_id
-    :param db: Session: Pass the database connection
-    :return: A list of image objects
+    :param sort_by: SortMode: Choose the order of the images
+    :param db: AsyncSession: Pass the database connection
+    :param cursor: Optional[str]: The next_cursor returned with the previous page
+    :param tag_match: TagMatch: Match the tag names exactly or as substrings
+    :return: A list of image objects and the cursor of the next page or None if this page is the last one
+    :raises ValueError: If the cursor is malformed or was issued for another sort mode
     """
     query = select(Image)
 
     if description:
-        query = query.filter(Image.description.like(f'%{description}%'))
-    if tags:
+        query = query.filter(_matches(description))
+    if tags and tag_match is TagMatch.FUZZY:
         for tag in tags:
             query = query.filter(Image.tags.any(Tag.name.ilike(f'%{tag}%')))
+    elif tags:
+        query = query.filter(await _has_all_tags(tags, db))
     if user_id:
         query = query.filter(Image.user_id == user_id)
     if image_id:
         query = query.filter(Image.id == image_id)
-        
-    if sort_by == SortMode.RAITING:
-        subquery = (
-            db.query(Image.id, func.coalesce(func.avg(ImageRating.rating), 0).label("average_rating"))
-            .outerjoin(ImageRating, ImageRating.image_id == Image.id)
-            .group_by(Image.id)
-            .subquery()
-        )
-        query = query.join(subquery, Image.id == subquery.c.id).order_by(subquery.c.average_rating.asc())
-    elif sort_by == SortMode.RAITING_DESC:  #
-        subquery = (
-            db.query(Image.id, func.coalesce(func.avg(ImageRating.rating), 0).label("average_rating"))
-            .outerjoin(ImageRating, ImageRating.image_id == Image.id)
-            .group_by(Image.id)
-            .subquery()
-        )
-        query = query.join(subquery, Image.id == subquery.c.id).order_by(subquery.c.average_rating.desc())
-    elif sort_by == SortMode.DATE:
-        query = query.order_by(Image.created_at.asc())
-    elif sort_by == SortMode.DATE_DESC:
-        query = query.order_by(Image.created_at.desc())
 
-    image = db.scalars(query)
+    sort_key = Image.id
+    descending = sort_by in (SortMode.RAITING_DESC, SortMode.DATE_DESC)
+
+    if sort_by in (SortMode.RAITING, SortMode.RAITING_DESC):
+        sort_key = Image.avg_rating
+    elif sort_by in (SortMode.DATE, SortMode.DATE_DESC):
+        sort_key = Image.created_at
+
+    if cursor:
+        mode, last_value, last_id = _decode_images_cursor(cursor)
+        if mode != sort_by.value:
+            raise ValueError("Cursor was issued for another sort mode")
+        try:
+            if sort_key is Image.created_at:
+                last_value = datetime.fromisoformat(last_value)
+            elif sort_key is Image.avg_rating:
+                last_value = float(last_value)
+        except TypeError as e:
+            raise ValueError("Invalid cursor") from e
+
+        if sort_key is Image.id:
+            position, last_position = Image.id, last_id
+        else:
+            position, last_position = tuple_(sort_key, Image.id), tuple_(last_value, last_id)
+        query = query.filter(position < last_position if descending else position > last_position)
+    else:
+        query = query.offset(skip)
+
+    order_by = [sort_key] if sort_key is Image.id else [sort_key, Image.id]
+    query = query.order_by(*(column.desc() if descending else column.asc() for column in order_by))
+
+    rows = await db.execute(query.add_columns(sort_key).limit(limit + 1))
+    rows = rows.unique().all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_image, last_value = rows[-1]
+        next_cursor = encode_cursor(sort_by.value, last_value, last_image.id)
+
+    return [image for image, _ in rows], next_cursor
+
+
+async def _has_all_tags(tags: list[str], db: AsyncSession):
+    """
+    The _has_all_tags function builds the filter of the images that have every one of the tags.
+    The names are resolved to ids once, then image_m2m_tag is joined with itself once per tag.
+    Every join reads the (tag_id, image_id) index in image_id order, so the intersection is a merge join
+    that stops at the limit of the page and several tags cost about as much as one.
+
+    :param tags: list[str]: The tag names
+    :param db: AsyncSession: Pass the database session to resolve the names
+    :return: A filter expression for select(Image)
+    """
+    names = {tag.strip() for tag in tags if tag.strip()}
+    if not names:
+        return true()
+
+    tag_ids = await get_tag_ids(list(names), db)
+    if len(tag_ids) < len(names):
+        # an unknown tag: no image can have all of them
+        return false()
+
+    # the ids are rendered into the statement: a generic plan of the prepared statement would not know
+    # how frequent each tag is and could no longer pick the index merge joins
+    tag_ids = [bindparam(f"tag_id_{number}", tag_id, literal_execute=True) for number, tag_id in enumerate(tag_ids)]
+    first, *others = [image_m2m_tag.alias(f"image_tag_{number}") for number in range(len(tag_ids))]
+    tagged = select(first.c.image_id).filter(first.c.tag_id == tag_ids[0])
+    for other, tag_id in zip(others, tag_ids[1:]):
+        tagged = tagged.join(other, and_(other.c.image_id == first.c.image_id, other.c.tag_id == tag_id))
 
-    return image.unique().all()  # noqa
+    return Image.id.in_(tagged)
 
 
-async def search_images(data: str, db: Session) -> list[Type[Image]]:
+def _decode_images_cursor(cursor: str) -> tuple[str, Any, int]:
     """
-    The search_images function searches the database for images that match a given search query.
-    The function takes in a string of data and returns a list of Image objects.
+    The _decode_images_cursor function unpacks a cursor created by get_images.
+
+    :param cursor: str: The cursor received from the client
+    :return: The sort mode, the sort key and the id of the last image of the previous page
+    :raises ValueError: If the cursor is malformed
+    """
+    values = decode_cursor(cursor)
+    if len(values) != 3 or not isinstance(values[2], int):
+        raise ValueError("Invalid cursor")
+
+    return values[0], values[1], values[2]
+
+
+def _matches(data: str):
+    return Image.search_vector.bool_op('@@')(func.websearch_to_tsquery(SEARCH_CONFIG, data))
+
+
+async def search_images(
+        data: str,
+        limit: int,
+        db: AsyncSession,
+        cursor: Optional[str] = None,
+) -> tuple[list[Image], Optional[str]]:
+    """
+    The search_images function runs a full-text search over the descriptions and tag names of the images.
+    The query accepts the web search syntax ("quoted phrases", or, -excluded words) and is answered from the
+    GIN index on images.search_vector. Images matching in the description rank above images matching only by tag.
 
     :param data: str: Pass in the search query
-    :param db: Session: Pass the database session to the function
-    :return: A list of image objects that match the search criteria
+    :param limit: int: Limit the number of images returned
+    :param db: AsyncSession: Pass the database session to the function
+    :param cursor: Optional[str]: The next_cursor returned with the previous page
+    :return: The most relevant images and the cursor of the next page or None if this page is the last one
+    :raises ValueError: If the cursor is malformed
     """
-    images = db.query(Image).filter(Image.description.ilike(f"%{data}%") |
-                                    Image.tags.any(Tag.name.ilike(f"%{data}%"))).all()
+    rank = func.ts_rank(Image.search_vector, func.websearch_to_tsquery(SEARCH_CONFIG, data))
+    query = select(Image).filter(_matches(data))
+
+    if cursor:
+        mode, last_rank, last_id = _decode_images_cursor(cursor)
+        if mode != 'search' or not isinstance(last_rank, (int, float)):
+            raise ValueError("Invalid cursor")
+        query = query.filter(tuple_(rank, Image.id) < tuple_(last_rank, last_id))
+
+    rows = await db.execute(query.add_columns(rank).order_by(rank.desc(), Image.id.desc()).limit(limit + 1))
+    rows = rows.unique().all()
 
-    return images
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_image, last_rank = rows[-1]
+        next_cursor = encode_cursor('search', last_rank, last_image.id)
 
+    return [image for image, _ in rows], next_cursor
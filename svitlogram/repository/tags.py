@@ -1,23 +1,45 @@
 from typing import Optional
 
 
-from sqlalchemy.orm import Session
 from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 
 from svitlogram.database.models import Tag
 from svitlogram.schemas.tag import TagBase
+from svitlogram.services.tag_cache import tag_cache, CachedTag
+from svitlogram.services.read_cache import read_cache, OrmSnapshot
 
 
-async def get_tags(skip: int, limit: int, db: Session) -> list[Tag]:
+def _to_cached(tag: Tag) -> CachedTag:
+    return CachedTag(id=tag.id, name=tag.name, created_at=tag.created_at, updated_at=tag.updated_at)
+
+
+async def _from_cached(cached: CachedTag, db: AsyncSession) -> Tag:
+    """
+    The _from_cached function attaches a cached tag to the session as a persistent object without querying it.
+
+    :param cached: CachedTag: The cached tag
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A tag object
+    """
+    tag = Tag(**cached._asdict())
+    make_transient_to_detached(tag)
+
+    return await db.merge(tag, load=False)
+
+
+async def get_tags(skip: int, limit: int, db: AsyncSession) -> list[Tag]:
     """
     The get_tags function returns a list of tags.
 
     :param skip: int: Skip a number of records
     :param limit: int: Limit the number of tags returned
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A list of tag objects
     """
-    tags = db.scalars(
+    tags = await db.scalars(
         select(Tag)
         .offset(skip)
         .limit(limit)
@@ -26,100 +48,137 @@ async def get_tags(skip: int, limit: int, db: Session) -> list[Tag]:
     return tags.all()  # noqa
 
 
-async def get_tags_by_list_values(values: list[str], db: Session) -> list[Tag]:
+async def get_tags_by_list_values(values: list[str], db: AsyncSession) -> list[Tag]:
     """
-    The get_tags_by_list_values function takes a list of strings and a Session object as arguments.
+    The get_tags_by_list_values function takes a list of strings and an AsyncSession object as arguments.
     It returns a list of Tag objects that match the names in the values argument.
 
     :param values: list[str]: Pass in a list of strings to the function
-    :param db: Session: Pass in the database session
+    :param db: AsyncSession: Pass in the database session
     :return: A list of tag objects
     """
-    tags = db.scalars(
+    tags = await db.scalars(
         select(Tag)
         .filter(Tag.name.in_(values))
     )
     return tags.all()  # noqa
 
 
-async def get_tag_by_id(tag_id: int, db: Session) -> Optional[Tag]:
+async def get_tag_ids(values: list[str], db: AsyncSession) -> list[int]:
+    """
+    The get_tag_ids function resolves tag names to ids, reading the process-local tag cache first.
+    Names without a tag are left out, so the result is shorter than the list of distinct names then.
+
+    :param values: list[str]: Pass in a list of tag names
+    :param db: AsyncSession: Pass in the database session
+    :return: A list of tag ids
+    """
+    names = sorted({value.strip() for value in values if value.strip()})
+    if not names:
+        return []
+
+    generation = tag_cache.generation
+    cached, names = tag_cache.get_many(names)
+    loaded = await get_tags_by_list_values(names, db) if names else []
+    tag_cache.put_many((_to_cached(tag) for tag in loaded), generation)
+
+    return [tag.id for tag in cached] + [tag.id for tag in loaded]
+
+
+@read_cache.cached("tag", OrmSnapshot(Tag))
+async def get_tag_by_id(tag_id: int, db: AsyncSession) -> Optional[Tag]:
     """
-    The get_tag_by_id function returns a Tag object from the database.
+    The get_tag_by_id function returns a Tag object from the database, through the read cache.
 
     :param tag_id: int: Specify the id of the tag to be retrieved
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A tag object or none
     """
-    return db.scalar(
+    return await db.scalar(
         select(Tag)
         .filter(Tag.id == tag_id)
     )
 
 
-async def get_or_create_tags(values: list[str], db: Session) -> list[Tag]:
+async def get_or_create_tags(values: list[str], db: AsyncSession) -> list[Tag]:
     """
     The get_or_create_tags function takes a list of strings and  database session.
     It returns a list of Tag objects.
-    If the tag already exists in the database, it is returned as-is. If not, it is created and then returned.
+    Tags found in the process-local tag cache are attached to the session without a query.
+    Missing tags are created with a single INSERT ... ON CONFLICT DO NOTHING, the tags it skipped
+    already exist (or were just created by a concurrent request) and are loaded with one more query.
+    The new tags are not committed, they are saved with the transaction of the caller, e.g. with the image
+    that has them, and are only cached once a later lookup loads them.
 
     :param values: list[str]: Pass in a list of strings
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A list of tag objects
     """
-    tags = await get_tags_by_list_values(values, db)
-    new_tags = []
-
-    for value in values:
-        for tag in tags:
-            if value == tag.name:
-                break
-        else:
-            new_tags.append(Tag(name=value.strip()))  
-             
-    if new_tags:
-        db.add_all(new_tags)
+    names = sorted({value.strip() for value in values if value.strip()})
+    if not names:
+        return []
+
+    generation = tag_cache.generation
+    cached, names = tag_cache.get_many(names)
+    tags = [await _from_cached(tag, db) for tag in cached]
+    if not names:
+        return tags
+
+    created = await db.scalars(
+        insert(Tag)
+        .values([{"name": name} for name in names])
+        .on_conflict_do_nothing(index_elements=[Tag.name])
+        .returning(Tag)
+    )
+    new_tags = created.all()
 
-        db.commit()
-        for new_tag in new_tags:
-            db.refresh(new_tag)
+    loaded = list(new_tags)
+    existing = set(names).difference(tag.name for tag in new_tags)
+    if existing:
+        loaded.extend(await get_tags_by_list_values(list(existing), db))
 
-    tags.extend(new_tags)
+    tag_cache.put_many((_to_cached(tag) for tag in loaded if tag.name in existing), generation)
 
-    return tags
+    return tags + loaded
 
 
-async def update_tag(tag_id: int, body: TagBase, db: Session) -> Optional[Tag]:
+async def update_tag(tag_id: int, body: TagBase, db: AsyncSession) -> Optional[Tag]:
     """
     The update_tag function updates a tag in the database.
 
     :param tag_id: int: Specify the id of the tag to be deleted
     :param body: TagBase: Pass in the new name of the tag
-    :param db: Session: Pass a database session to the function
+    :param db: AsyncSession: Pass a database session to the function
     :return: The updated tag if found, otherwise none
     """
     tag = await get_tag_by_id(tag_id, db)
 
     if tag:
+        old_name = tag.name
         tag.name = body.name
-        db.commit()
-        db.refresh(tag)
+        await db.commit()
+        await db.refresh(tag)
+
+        await tag_cache.invalidate([old_name, tag.name])
 
     return tag
 
 
-async def remove_tag(tag_id: int, db: Session) -> Optional[Tag]:
+async def remove_tag(tag_id: int, db: AsyncSession) -> Optional[Tag]:
     """
     The remove_tag function removes a tag from the database.
 
     :param tag_id: int: Specify the id of the tag to remove
-    :param db: Session: Pass in the database session
+    :param db: AsyncSession: Pass in the database session
     :return: The tag that was removed, or none if the tag wasn't found
     """
     tag = await get_tag_by_id(tag_id, db)
 
     if tag:
-        db.delete(tag)
-        db.commit()
+        await db.delete(tag)
+        await db.commit()
+
+        await tag_cache.invalidate([tag.name])
 
     return tag
 
@@ -8,6 +8,8 @@ from . import image_comments
 from . import image_ratings
 from . import tags
 from . import openai_chat
+from . import metrics
+from . import storage
 
 
 router = APIRouter()
@@ -20,6 +22,8 @@ router.include_router(image_comments.router)
 router.include_router(image_ratings.router)
 router.include_router(tags.router)
 router.include_router(openai_chat.router)
+router.include_router(metrics.router)
+router.include_router(storage.router)
 
 __all__ = (
     'router',
@@ -4,7 +4,7 @@ from fastapi import APIRouter, HTTPException, Depends, status, Security, Backgro
 from fastapi.responses import HTMLResponse
 from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
 from fastapi_limiter.depends import RateLimiter
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from svitlogram.database.connect import get_db
 from svitlogram.database.models import User
@@ -13,6 +13,7 @@ from svitlogram.schemas.token import TokenResponse
 from svitlogram.repository import users as repository_users
 from svitlogram.services.auth import AuthService, get_current_active_user
 from svitlogram.services.email import send_email_confirmed, send_email_reset_password
+from svitlogram.services.login_throttle import login_throttle, client_ip
 from config import Template
 
 
@@ -24,7 +25,7 @@ security = HTTPBearer()
 async def signup(
         body: user_schemas.UserCreate,
         background_tasks: BackgroundTasks,
-        request: Request, db: Session = Depends(get_db)
+        request: Request, db: AsyncSession = Depends(get_db)
 ) -> Any:
     """
     The signup function creates a new user in the database.
@@ -35,7 +36,7 @@ async def signup(
     :param body: UserModel: Get the user's email and password from the request body
     :param background_tasks: BackgroundTasks: Add tasks to the background queue
     :param request: Request: Get the base url of the server
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A dictionary with the user and a detail message
     """
 
@@ -45,7 +46,9 @@ async def signup(
         raise HTTPException(status_code=status.HTTP_409_CONFLICT,
                             detail="An account with the same email address or username already exists")
 
-    body.password = AuthService.get_password_hash(body.password)
+    # The connection goes back to the pool while bcrypt runs, a signup storm must not exhaust it
+    await db.commit()
+    body.password = await AuthService.get_password_hash(body.password)
     new_user = await repository_users.create_user(body, db)
 
     background_tasks.add_task(send_email_confirmed, new_user.email, new_user.username, request.base_url)
@@ -55,54 +58,58 @@ async def signup(
 
 @router.post("/login", response_model=TokenResponse)
 async def login(
+        request: Request,
         body: OAuth2PasswordRequestForm = Depends(),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ) -> Any:
     """
     The login function is used to authenticate a user.
+    Emails and addresses with repeated failures are throttled before the password is checked.
 
+    :param request: Request: Get the address of the client
     :param body: OAuth2PasswordRequestForm: Get the username and password from the request body
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A dictionary with the access_token, refresh_token and token type
     """
+    ip = client_ip(request)
+    attempt = await login_throttle.check(body.username, ip)
+
     user = await repository_users.get_user_by_email(body.username, db)
 
     if user is None:
+        login_throttle.failed()
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email")
     if not user.email_verified:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Email not confirmed")
-    if not AuthService.verify_password(body.password, user.password):
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
 
-    # Generate JWT
-    access_token = await AuthService.create_access_token(data={"sub": user.email})
-    refresh_token = await AuthService.create_refresh_token(data={"sub": user.email})
-
-    await repository_users.update_token(user, refresh_token, db)
+    # The connection goes back to the pool while bcrypt runs, a login storm must not exhaust it
+    await db.commit()
+    if not await AuthService.verify_password(body.password, user.password):
+        login_throttle.failed()
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
+    await login_throttle.succeeded(body.username, ip, attempt)
 
-    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+    return await AuthService.issue_tokens(user)
 
 
 @router.get("/logout", status_code=status.HTTP_401_UNAUTHORIZED)
 async def logout(
         request: Request,
-        current_user: User = Depends(get_current_active_user),
-        db: Session = Depends(get_db)
+        current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
     The logout function is used to logout a user.
     It takes in the request object and the current_user, which is obtained from the AuthService.get_current_user function.
-    The access token of this user is then added to our blacklist so that it cannot be used again.
+    The access token of this user is then added to our blacklist so that it cannot be used again,
+    and the refresh tokens of the session are revoked. Sessions on other devices stay logged in.
 
     :param request: Request: Get the authorization header from the request
     :param current_user: User: Get the current user from the database
-    :param db: Session: Get the database session
     :return: A message saying that the logout was successful
     """
     access_token = request.headers['Authorization'].split(' ', maxsplit=1)[1]
     await AuthService.add_token_to_blacklist(access_token)
-
-    await repository_users.update_token(current_user, None, db)
+    await AuthService.revoke_refresh_tokens(access_token)
 
     return {"message": "Successful exit"}
 
@@ -110,38 +117,31 @@ async def logout(
 @router.get('/refresh_token', response_model=TokenResponse)
 async def refresh_token(
         credentials: HTTPAuthorizationCredentials = Security(security),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ) -> Any:
     """
     The refresh_token function is used to refresh the access token.
         The function takes in a refresh token and returns a new access_token and refresh_token pair.
-        If the user's current refresh token does not match what was passed into this function, then it will return an error.
+        Every refresh token can be used once, if it is used again the session is revoked and an error is returned.
 
     :param credentials: HTTPAuthorizationCredentials: Retrieve the token from the header
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A dictionary with the access_token, refresh_token and token type
     """
     token = credentials.credentials
     email = await AuthService.decode_refresh_token(token)
     user = await repository_users.get_user_by_email(email, db)
 
-    if user.refresh_token != token:
-        await repository_users.update_token(user, None, db)
+    if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
-    # Generate JWT
-    access_token = await AuthService.create_access_token(data={"sub": email})
-    refresh_token = await AuthService.create_refresh_token(data={"sub": email})
-
-    await repository_users.update_token(user, refresh_token, db)
-
-    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+    return await AuthService.rotate_tokens(token, user)
 
 
 @router.get('/confirmed_email/{token}', include_in_schema=False)
 async def confirmed_email(
         token: str,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ) -> Any:
     """
     The confirmed_email function is used to confirm a user's email address.
@@ -151,7 +151,7 @@ async def confirmed_email(
         our database with their new status of &quot;confirmed&quot;.
 
     :param token: str: Get the token from the url
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A message that the email is already confirmed
     """
     email = await AuthService.get_email_from_token(token)
@@ -172,7 +172,7 @@ async def confirmed_email(
 async def reset_password(
         body: user_schemas.EmailModel,
         background_tasks: BackgroundTasks, request: Request,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ) -> Any:
     """
     The reset_password function is used to send an email to the user with a link that will allow them
@@ -185,7 +185,7 @@ async def reset_password(
     :param body: EmailModel: Get the email from the request body
     :param background_tasks: BackgroundTasks: Add a task to the background tasks queue
     :param request: Request: Get the base url of the website
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A message and a timeout_link
     """
     user = await repository_users.get_user_by_email(body.email, db)
@@ -202,19 +202,19 @@ async def reset_password(
 async def reset_password_template(
         token: str,
         request: Request,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ) -> Any:
     """
     The reset_password_template function is used to render the new_password.html template, which allows a user to reset their password.
 
     :param token: str: Get the token from the url
     :param request: Request: Get the request object
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A template response object, which is a subclass of response
     """
     email = await AuthService.get_email_from_token(token)
 
-    if await AuthService.token_is_blacklist(email, token):
+    if await AuthService.token_is_blacklist(token):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="The link is no longer active")
 
     user = await repository_users.get_user_by_email(email, db)
@@ -231,7 +231,7 @@ async def reset_password_template(
 async def new_password(
         token: str,
         password: str = Form(...),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ) -> Any:
     """
     The new_password function is used to change the password of a user.
@@ -239,7 +239,7 @@ async def new_password(
 
     :param token: str: Get the email from the token
     :param password: str: Get the password from the request body
-    :param db: Session: Get the database session from the dependency injection container
+    :param db: AsyncSession: Get the database session from the dependency injection container
     :return: A json object with a status field
     """
     email = await AuthService.get_email_from_token(token)
@@ -250,9 +250,12 @@ async def new_password(
     if not user.email_verified:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Email not confirmed")
 
-    password = AuthService.get_password_hash(password)
+    await db.commit()
+    password = await AuthService.get_password_hash(password)
     await repository_users.update_password(user.id, password, db)
 
     await AuthService.add_token_to_blacklist(token)
+    await AuthService.revoke_user_refresh_tokens(user.email)
+    await AuthService.revoke_user_tokens(user.email)
 
     return {"status": 'ok'}
@@ -4,7 +4,7 @@ from typing import Any, Optional
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.responses import StreamingResponse
 from fastapi_limiter.depends import RateLimiter
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from svitlogram.database.connect import get_db
 from svitlogram.database.models import User, UserRole
@@ -17,7 +17,7 @@ from svitlogram.schemas.image_formats import (
     ImageFormatsResponse,
     ImageFormatRemoveResponse,
 )
-from svitlogram.services import cloudinary
+from svitlogram.services import storage
 from svitlogram.services.auth import get_current_active_user
 from svitlogram.services.qr_code import create_qr_for_url
 
@@ -32,7 +32,7 @@ router = APIRouter(prefix="/images/formats", tags=["Image formats"])
 async def formatting_image(
         body: ImageTransformation,
         current_user: User = Depends(get_current_active_user),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ) -> Any:
 
     image = await repository_images.get_image_by_id(body.image_id, db)
@@ -41,7 +41,7 @@ async def formatting_image(
     if image.user_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="You can't format someone else's image")
 
-    format_image = cloudinary.formatting_image_url(image.public_id, body.transformation)
+    format_image = storage.backend.transform(image.public_id, body.transformation)
 
     formatted_image = await repository_image_formats.create_image_format(
         current_user.id, body.image_id, format_image['format'], db
@@ -62,7 +62,7 @@ async def formatting_image(
 async def get_image_formats(
         image_id: int,
         current_user: User = Depends(get_current_active_user),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ) -> Any:
     """
     The get_image_formats function returns a list of formatted images for the given image_id.
@@ -90,7 +90,7 @@ async def get_image_formats(
                dependencies=[Depends(RateLimiter(times=10, seconds=60))])
 async def delete_image_format(
         image_format_id: int,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
@@ -122,7 +122,7 @@ async def get_image_format_qrcode(
         border: Optional[int] = 5,
         fit: Optional[bool] = True,
         current_user: User = Depends(get_current_active_user),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ) -> Any:
     """
     The get_image_format_qrcode function is used to generate a QR code for the specified image format.
@@ -148,7 +148,7 @@ async def get_image_format_qrcode(
     qr_image = await loop.run_in_executor(
         None,
         create_qr_for_url,
-        cloudinary.formatting_image_url(image.public_id, formatted_image.format)['url'],
+        storage.backend.url(image.public_id, formatted_image.format),
         version,
         box_size,
         border,
@@ -1,7 +1,7 @@
 from typing import Any
 
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from svitlogram.database.connect import get_db
 from svitlogram.database.models import User, UserRole
@@ -17,15 +17,15 @@ router = APIRouter(prefix="/images/ratings", tags=["Image ratings"])
 async def create_image_rating(
         body: ImageRatingCreate,
         current_user: User = Depends(get_current_active_user),
-        db: Session = Depends(get_db)
-) -> Session:
+        db: AsyncSession = Depends(get_db)
+) -> Any:
     """
     The create_image_rating function creates a new image rating.
 
     :param body: ImageRatingCreate: Get the rating and image_id from the request body
     :param current_user: User: Get the user that is currently logged in
-    :param db: Session: Get the database session
-    :return: An session object
+    :param db: AsyncSession: Get the database session
+    :return: An image rating object
     """
     if not 1 <= body.rating <= 5:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Maximum rating is 5, minimum rating 0")
@@ -46,14 +46,14 @@ async def create_image_rating(
 @router.put("/", response_model=ImageRatingResponse)
 async def update_image_rating(
         body: ImageRatingUpdate,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
     The update_image_rating function updates the rating of an image.
 
     :param body: ImageRatingUpdate: Get the rating from the request body
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the user who is currently logged in
     :return: An image rating object
     """
@@ -64,14 +64,18 @@ async def update_image_rating(
     if rating is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Rating not found")
 
-    return await repo_image_ratings.update_rating(rating, body.rating, db)
+    rating = await repo_image_ratings.update_rating(rating, body.rating, db)
+    if rating is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Rating not found")
+
+    return rating
 
 
 @router.delete("/ratings/{rating_id}")
 async def delete_image_rating(
         rating_id: int,
         current_user: User = Depends(get_current_active_user),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ):
     """
     The delete_image_rating function deletes an image rating.
@@ -95,7 +99,7 @@ async def delete_image_rating(
 @router.get("/{image_id}/ratings")
 async def get_all_image_ratings(
         image_id: int,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
@@ -103,7 +107,7 @@ async def get_all_image_ratings(
         The function takes in an image_id and returns the list of ratings associated with that id.
 
     :param image_id: int: Get the image id from the url
-    :param db: Session: Get the database session from the dependency injection container
+    :param db: AsyncSession: Get the database session from the dependency injection container
     :param current_user: User: Get the current user who is logged in
     :return: A list of all ratings for a given image
     """
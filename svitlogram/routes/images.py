@@ -1,66 +1,45 @@
-import asyncio
-import mimetypes
-from typing import Optional, Any, List
+from typing import Optional, Any
 
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, status, Query, Body
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, status, Query, Body, Request, Response
 from fastapi_limiter.depends import RateLimiter
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
-from svitlogram.database.connect import get_db
+from svitlogram.database.connect import get_db, get_session_factory
 from svitlogram.database.models import User, UserRole
 from svitlogram.repository import images as repository_images, tags as repository_tags
-from svitlogram.schemas.image import ImageCreateResponse, ImagePublic, ImageRemoveResponse
-from svitlogram.services import cloudinary
-from svitlogram.services.auth import get_current_active_user
+from svitlogram.schemas.image import (
+    ImageCreateResponse, ImagePublic, ImageRemoveResponse, ImagePage, UploadJobResponse
+)
+from svitlogram.services.auth import get_current_active_user, get_current_active_claims, TokenClaims
+from svitlogram.services.ingest import ingest
+from svitlogram.services.uploads import store_image, remove_unused_file, upload_jobs, UploadJobStatus
 from .docs import images as docs
 
 router = APIRouter(prefix="/images", tags=["Images"])
 
-allowed_content_types_upload = [
-    ".ai",
-    ".gif",
-    ".png",
-    ".webp",
-    ".avif",
-    ".jfif",
-    ".bmp",
-    ".bw",
-    ".dng",
-    ".ps",
-    ".ept",
-    ".eps",
-    ".eps3",
-    ".fbx",
-    ".flif",
-    ".glb",
-    ".gltf",
-    ".heif",
-    ".heic",
-    ".ico",
-    ".indd",
-    ".jpg",
-    ".jpe",
-    ".jpeg",
-    ".jp2",
-    ".wdp",
-    ".jxr",
-    ".hdp",
-    ".obj",
-    ".pdf",
-    ".ply",
-    ".png",
-    ".psd",
-    ".arw",
-    ".cr2",
-    ".svg",
-    ".tga",
-    ".tif",
-    ".tiff",
-    ".u3ma",
-    ".usdz",
-    ".webp",
-    ]
+
+def _check_tags(tags: Optional[list[str]]) -> list[str]:
+    """
+    The _check_tags function splits the tags of an upload and checks their number and length.
+
+    :param tags: Optional[list[str]]: The tags of the form
+    :return: The names of the tags
+    :raises HTTPException: 422 if there are more than five tags or a tag is too short or too long
+    """
+    tags = repository_tags.get_list_tags(tags)
+
+    if tags and len(tags) > 5:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="Maximum five tags can be added")
+
+    if tags:
+        for tag in tags:
+            if not 3 <= len(tag) <= 50:
+                raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                    detail=f'Invalid length tag: {tag}')
+
+    return tags
 
 
 @router.post(
@@ -72,11 +51,11 @@ async def upload_image(
         description: str = Form(min_length=10, max_length=1200),
         tags: Optional[list[str]] = Form(None),
         # tags = Form(None),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_active_user),
 ) -> Any:  
     """
-    The upload_image function is used to upload an image file to the cloudinary server.
+    The upload_image function is used to upload an image file to the storage backend.
     The function takes in a file, description and tags as parameters. The file parameter is of type UploadFile which
     is a FastAPI class that represents uploaded files. The description parameter is of type str and has minimum length
     of 10 characters and maximum length of 1200 characters while the tags parameter is optional with each tag having
@@ -85,7 +64,7 @@ async def upload_image(
     :param file: UploadFile: Receive the image file from the client
     :param description: str: Get the description of the image from the request body
     :param tags: Optional[list[str]]: Validate the tag list
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the current user that is logged in
     :param : Get the image id from the url
     :return: A dictionary with the image and detail keys
@@ -94,36 +73,76 @@ async def upload_image(
     #     tags = {tag.strip() for tag in tags.split(',')}
     # except:
     #     ...
-    
-    if mimetypes.guess_extension(file.content_type,) not in allowed_content_types_upload:
-        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-                            detail=f"Invalid file type. Only allowed {allowed_content_types_upload}.")
-    
-    tags = repository_tags.get_list_tags(tags)
 
-    if tags and len(tags) > 5:
-        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-                            detail="Maximum five tags can be added")
+    tags = _check_tags(tags)
 
-    if tags:
-        print(tags)
-        for tag in tags:
-            if not 3 <= len(tag) <= 50:
-                raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-                                    detail=f'Invalid length tag: {tag}')
+    ingested = await ingest(file)
+    image = await store_image(ingested, current_user.id, description.strip(), tags, db)
 
-    loop = asyncio.get_event_loop()
-    image = await loop.run_in_executor(None, cloudinary.upload_image, file.file)
+    return {"image": image, "message": "Image successfully uploaded"}
 
-    if image is None:
-        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid image file")
 
-    image = await repository_images.create_image(current_user.id, description.strip(), tags, image['public_id'], db)
+@router.post(
+    "/jobs", response_model=UploadJobResponse, status_code=status.HTTP_202_ACCEPTED,
+    dependencies=[Depends(RateLimiter(times=10, seconds=60))]
+)
+async def submit_upload_job(
+        request: Request,
+        response: Response,
+        file: UploadFile = File(),
+        description: str = Form(min_length=10, max_length=1200),
+        tags: Optional[list[str]] = Form(None),
+        session_factory: async_sessionmaker = Depends(get_session_factory),
+        current_user: User = Depends(get_current_active_user),
+) -> Any:
+    """
+    The submit_upload_job function accepts an image like upload_image, but answers as soon as the file is checked
+    and saved on the server. The file is uploaded to the storage backend and the image is created in the background.
+    The Location header points to the status of the job, which the client polls until it is done or failed.
 
-    return {"image": image, "message": "Image successfully uploaded"}
+    :param request: Request: Build the URL of the status of the job
+    :param response: Response: Set the Location header
+    :param file: UploadFile: Receive the image file from the client
+    :param description: str: Get the description of the image from the request body
+    :param tags: Optional[list[str]]: Validate the tag list
+    :param session_factory: async_sessionmaker: Creates the database session of the job
+    :param current_user: User: Get the current user that is logged in
+    :return: The id and the status of the job
+    """
+    tags = _check_tags(tags)
 
+    ingested = await ingest(file)
+    job_id = await upload_jobs.submit(ingested, current_user.id, description.strip(), tags, session_factory)
 
-@router.get("/", response_model=list[ImagePublic], description="Get all images",
+    response.headers["Location"] = str(request.url_for("get_upload_job", job_id=job_id))
+
+    return {"job_id": job_id, "status": UploadJobStatus.QUEUED}
+
+
+@router.get("/jobs/{job_id}", response_model=UploadJobResponse)
+async def get_upload_job(
+        job_id: str,
+        wait: float = Query(default=0, ge=0, le=30),
+        current_user: TokenClaims = Depends(get_current_active_claims)
+) -> Any:
+    """
+    The get_upload_job function returns the status of an upload job, with the id of the image once it is done
+    or the reason once it failed. Jobs are kept for a day after the last change.
+
+    :param job_id: str: Get the id of the job from the url
+    :param wait: float: Wait up to this many seconds for the job to finish instead of answering at once
+    :param current_user: TokenClaims: Check that the job belongs to the caller
+    :return: The status of the job
+    """
+    job = await upload_jobs.wait(job_id, wait) if wait else await upload_jobs.get(job_id)
+
+    if job is None or job["user_id"] != current_user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found upload job")
+
+    return job
+
+
+@router.get("/", response_model=ImagePage, description="Get all images",
             )#dependencies=[Depends(RateLimiter(times=30, seconds=60))]
 
 async def get_images(
@@ -131,44 +150,57 @@ async def get_images(
         limit: int = Query(default=10, ge=1, le=100),
         description: Optional[str] = Query(default=None, min_length=3, max_length=1200),
         tags: Optional[list[str]] = Query(default=None, max_length=50),
+        tag_match: repository_images.TagMatch = repository_images.TagMatch.EXACT,
         image_id: Optional[int] = Query(default=None, ge=1),
         user_id: Optional[int] = Query(default=None, ge=1),
         sort_by: Optional[repository_images.SortMode] = repository_images.SortMode.NOT_SORT,
-        db: Session = Depends(get_db),
+        cursor: Optional[str] = Query(default=None, max_length=512),
+        db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
     The get_images function is used to retrieve images from the database.
         The function takes in a skip, limit, description, tags and user_id as parameters.
-        The skip parameter is used to determine how many images should be skipped before returning results.
-        The limit parameter determines how many results should be returned after skipping the specified number of images.
+        Pages are chained with the next_cursor of the previous response, which keeps deep pages as cheap as the first one.
+        The skip parameter is only used when no cursor is provided.
+        The limit parameter determines how many results should be returned.
         If no value for limit is provided then 10 will be assumed by default (max 100).
 
-    :param skip: int: Skip a number of images when returning the list
+    :param skip: int: Skip a number of images when no cursor is given
     :param limit: int: Limit the number of images returned
     :param description: Optional[str]: Filter the images by description
-    :param tags: Optional[list[str]]: Filter the images by tags
+    :param tags: Optional[list[str]]: Filter the images by tags, an image must have all of them
+    :param tag_match: TagMatch: Match the tag names exactly (default) or as substrings
     :param image_id: Optional[int]: Get the image by id
     :param user_id: Optional[int]: Filter the images by user_id
-    :param db: Session: Get the database session
+    :param sort_by: Optional[SortMode]: Choose the order of the images
+    :param cursor: Optional[str]: Continue from the next_cursor of the previous page
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the current user from the database
-    :return: A list of images
+    :return: A page of images and the cursor of the next page
     """
-    return await repository_images.get_images(skip, limit, description, tags, image_id, user_id, sort_by, db)
+    try:
+        images, next_cursor = await repository_images.get_images(
+            skip, limit, description, tags, image_id, user_id, sort_by, db, cursor, tag_match
+        )
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    return {"images": images, "next_cursor": next_cursor}
 
 
 @router.get("/{image_id}", response_model=ImagePublic)
 async def get_image(
         image_id: int,
-        db: Session = Depends(get_db),
-        current_user: User = Depends(get_current_active_user)
+        db: AsyncSession = Depends(get_db),
+        current_user: TokenClaims = Depends(get_current_active_claims)
 ) -> Any:
     """
     The get_image function returns an image by its id.
 
     :param image_id: int: Get the image id from the url
     :param db: AsyncSession: Pass the database session to the function
-    :param current_user: User: Get the current user from the database
+    :param current_user: TokenClaims: Check that the caller is logged in, the user is not loaded
     :return: The image object
     """
     image = await repository_images.get_image_by_id(image_id, db)
@@ -183,7 +215,7 @@ async def update_image_data(
         image_id: int = Body(ge=1),
         description: str = Body(min_length=10, max_length=1200),
         tags: Optional[list[str]] = Body(None, min_length=3, max_length=50),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
@@ -217,14 +249,15 @@ async def update_image_data(
                dependencies=[Depends(RateLimiter(times=10, seconds=60))])
 async def delete_image(
         image_id: int,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
-    The delete_image function deletes an image from the database and cloudinary.
+    The delete_image function deletes an image from the database, and its file from the storage backend
+    when no other image with the same content uses it.
 
     :param image_id: int: Get the image id from the url
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the current user
     :return: A dictionary with the message key and value
     """
@@ -236,32 +269,41 @@ async def delete_image(
     if current_user.role != UserRole.admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
 
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, cloudinary.remove_image, image.public_id)
-    await repository_images.delete_image(image, db)
+    public_id, content_hash = image.public_id, image.content_hash
+    if await repository_images.delete_image(image, db):
+        await remove_unused_file(content_hash, public_id, db)
 
     return {"message": "Image successfully deleted"}
 
 
-@router.get("/search/", response_model=List[ImagePublic],
+@router.get("/search/", response_model=ImagePage,
             dependencies=[Depends(RateLimiter(times=10, seconds=60))])
 async def search_images(
-        data: str,
-        db: Session = Depends(get_db),
+        data: str = Query(min_length=1, max_length=200),
+        limit: int = Query(default=10, ge=1, le=100),
+        cursor: Optional[str] = Query(default=None, max_length=512),
+        db: AsyncSession = Depends(get_db),
         _: User = Depends(get_current_active_user)
 ) -> Any:
     """
     The search_images function is used to search for images in the database.
-        The function takes a string as an argument and searches for all images that contain this string in their name or description.
+        The function runs a full-text search over the descriptions and tags of the images, the most relevant go first.
+        Pages are chained with the next_cursor of the previous response.
         If no image is found, it returns a 404 error message.
 
     :param data: str: Search for images in the database
-    :param db: Session: Pass the database connection to the function
+    :param limit: int: Limit the number of images returned
+    :param cursor: Optional[str]: Continue from the next_cursor of the previous page
+    :param db: AsyncSession: Pass the database connection to the function
     :param _: User: Check if the user is logged in
-    :return: A list of images
+    :return: A page of images and the cursor of the next page
     """
-    images = await repository_images.search_images(data, db)
-    if not images:
+    try:
+        images, next_cursor = await repository_images.search_images(data, limit, db, cursor)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    if not images and cursor is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Images not found")
 
-    return images
+    return {"images": images, "next_cursor": next_cursor}
@@ -0,0 +1,20 @@
+from typing import Any
+
+from fastapi import APIRouter, Depends
+
+from svitlogram.database.models import UserRole
+from svitlogram.services import metrics
+from svitlogram.utils.filters import UserRoleFilter
+
+router = APIRouter(prefix='/metrics', tags=["Metrics"])
+
+
+@router.get("/", dependencies=[Depends(UserRoleFilter(role=UserRole.admin))])
+async def read_metrics() -> Any:
+    """
+    The read_metrics function returns the in-memory counters of the worker that handled the request,
+    such as the hit and miss counters of the tag cache.
+
+    :return: A dictionary of counters grouped by component
+    """
+    return metrics.collect()
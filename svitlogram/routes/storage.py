@@ -0,0 +1,30 @@
+import mimetypes
+from typing import Any
+
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import FileResponse
+
+from svitlogram.services import storage
+
+router = APIRouter(prefix="/storage", tags=["Storage"])
+
+
+@router.get("/{public_id}", response_class=FileResponse)
+async def get_file(public_id: str) -> Any:
+    """
+    The get_file function streams a file of the local storage backend in chunks, the transformation options
+    in the query of the URL are ignored. The name of a file is the hash of its content,
+    so clients may cache it for good. When files are kept in Cloudinary, there is nothing to serve here.
+
+    :param public_id: str: The id the file was stored under
+    :return: The content of the file
+    """
+    path = storage.backend.path(public_id) if isinstance(storage.backend, storage.LocalStorage) else None
+    if path is None or not path.is_file():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found file")
+
+    return FileResponse(
+        path,
+        media_type=mimetypes.guess_type(path.name)[0] or "application/octet-stream",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )
@@ -1,7 +1,7 @@
 from typing import Any
 
 from fastapi import APIRouter, HTTPException, Depends, status, Body
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from svitlogram.database.models import UserRole, User
 from svitlogram.database.connect import get_db
@@ -10,7 +10,7 @@ from svitlogram.schemas.tag import TagUpdate, TagResponse
 from svitlogram.repository import tags as repository_tags
 
 from svitlogram.utils.filters import UserRoleFilter
-from svitlogram.services.auth import get_current_active_user
+from svitlogram.services.auth import get_current_active_user, get_current_active_claims, TokenClaims
 
 router = APIRouter(prefix='/tags', tags=["Tags"])
 
@@ -18,18 +18,19 @@ router = APIRouter(prefix='/tags', tags=["Tags"])
 @router.post("/", response_model=list[TagResponse])
 async def get_or_create_tags(
         tags: list[str] = Body(min_length=3, max_length=50),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
     The get_or_create_tags function is used to get or create tags.
 
     :param tags: Get the tags from the database
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the current user who is logged in
     :return: A list of tag objects
     """
     tags = await repository_tags.get_or_create_tags(tags, db)
+    await db.commit()
     return tags
 
 
@@ -37,16 +38,16 @@ async def get_or_create_tags(
 async def read_tags(
         skip: int = 0,
         limit: int = 100,
-        db: Session = Depends(get_db),
-        current_user: User = Depends(get_current_active_user)
+        db: AsyncSession = Depends(get_db),
+        current_user: TokenClaims = Depends(get_current_active_claims)
 ) -> Any:
     """
     The read_tags function returns a list of tags.
 
     :param skip: int: Skip the first n tags
     :param limit: int: Limit the number of tags returned
-    :param db: Session: Pass the database connection to the function
-    :param current_user: User: Get the current user
+    :param db: AsyncSession: Pass the database connection to the function
+    :param current_user: TokenClaims: Check that the caller is logged in, the user is not loaded
     :return: A list of tag objects
     """
     return await repository_tags.get_tags(skip, limit, db)
@@ -55,16 +56,16 @@ async def read_tags(
 @router.get("/{tag_id}", response_model=TagResponse)
 async def get_tag(
         tag_id: int,
-        db: Session = Depends(get_db),
-        current_user: User = Depends(get_current_active_user)
+        db: AsyncSession = Depends(get_db),
+        current_user: TokenClaims = Depends(get_current_active_claims)
 ) -> Any:
     """
     The get_tag function is a GET request that returns the tag with the given ID.
     If no such tag exists, it raises an HTTP 404 error.
 
     :param tag_id: int: Get the tag id from the url
-    :param db: Session: Get the database session
-    :param current_user: User: Get the current user
+    :param db: AsyncSession: Get the database session
+    :param current_user: TokenClaims: Check that the caller is logged in, the user is not loaded
     :return: A tag object
     """
     tag = await repository_tags.get_tag_by_id(tag_id, db)
@@ -80,7 +81,7 @@ async def get_tag(
     dependencies=[Depends(UserRoleFilter(role=UserRole.moderator))])
 async def update_tag(
         body: TagUpdate,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
@@ -90,7 +91,7 @@ async def update_tag(
 
     :param body: TagBase: Define the body of the request
     :param tag_id: int: Identify the tag to be deleted
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the current user
     :return: A tag object
     """
@@ -108,14 +109,14 @@ async def update_tag(
 )
 async def remove_tag(
         tag_id: int,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
     The remove_tag function removes a tag from the database.
 
     :param tag_id: int: Specify the id of the tag to be removed
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the user that is currently logged in
     :return: The tag that was just deleted
     """
@@ -1,15 +1,17 @@
 import asyncio
 
 from datetime import datetime
-from typing import Any, Optional, List
+from typing import Any, Optional, Callable, Awaitable
 
 
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, status, Security
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, status, Security, Query
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from fastapi_limiter.depends import RateLimiter
-from sqlalchemy.orm import Session
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
-from svitlogram.database.connect import get_db
+from svitlogram.database.connect import get_db, get_session_factory
 from svitlogram.database.models import User, UserRole
 from svitlogram.repository import users as repository_users, images as repository_images
 from svitlogram.schemas.user import UserPublic, ProfileUpdate
@@ -17,8 +19,9 @@ from svitlogram.schemas.user import UserPublic, ProfileUpdate
 from svitlogram.schemas import user as user_schemas
 from svitlogram.schemas.image import ImagePublic
 from svitlogram.schemas.user import SearchResults
-from svitlogram.services import cloudinary
+from svitlogram.services import cloudinary, storage
 from svitlogram.services.auth import AuthService, get_current_active_user
+from svitlogram.services.ingest import ingest
 from svitlogram.utils.filters import UserRoleFilter
 from config import settings
 
@@ -50,14 +53,14 @@ async def get_me(
               dependencies=[Depends(RateLimiter(times=10, seconds=60))])
 async def update_avatar(
         file: UploadFile = File(),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
     The update_avatar function updates the avatar of a user.
 
     :param file: UploadFile: Get the file that is uploaded
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the current user
     :return: The updated user object
     """
@@ -65,15 +68,13 @@ async def update_avatar(
     if not link.endswith(settings.cloudinary_folder):
         public_id = None
 
-    loop = asyncio.get_event_loop()
-    image = await loop.run_in_executor(
-        None, cloudinary.upload_image, file.file, public_id
-    )
+    ingested = await ingest(file)
+    image = await storage.backend.upload(ingested.file, public_id, ingested.content_type, namespace='avatar')
 
     if image is None:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid image file")
 
-    avatar = cloudinary.formatting_image_url(image['public_id'], cloudinary.FORMAT_AVATAR, image['version'])
+    avatar = storage.backend.transform(image['public_id'], cloudinary.FORMAT_AVATAR, image['version'])
 
     return await repository_users.update_avatar(current_user.id, avatar['url'], db)
 
@@ -82,7 +83,7 @@ async def update_avatar(
               dependencies=[Depends(RateLimiter(times=2, seconds=60))])
 async def update_email(
         body: user_schemas.EmailModel,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
@@ -91,7 +92,7 @@ async def update_email(
         It also takes in a database session and current_user (the user who is making this request).
 
     :param body: EmailModel: Get the email from the request body
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the current user from the database
     :return: A user object
     """
@@ -100,6 +101,8 @@ async def update_email(
         return HTTPException(status_code=status.HTTP_409_CONFLICT,
                              detail="An account with this email address already exists")
 
+    await AuthService.revoke_user_tokens(current_user.email)
+
     return updated_user
 
 
@@ -107,21 +110,27 @@ async def update_email(
               dependencies=[Depends(RateLimiter(times=2, seconds=60))])
 async def update_password(
         body: user_schemas.UserPasswordUpdate,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
     The update_password function updates the password of a user.
 
     :param body: UserPasswordUpdate: Get the old and new password from the request body
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the user object from the database
     :return: A json response with the updated user
     """
-    if not AuthService.verify_password(body.old_password, current_user.password):
+    if not await AuthService.verify_password(body.old_password, current_user.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid old password")
-    password = AuthService.get_password_hash(body.new_password)
-    return await repository_users.update_password(current_user.id, password, db)
+    password = await AuthService.get_password_hash(body.new_password)
+    updated_user = await repository_users.update_password(current_user.id, password, db)
+
+    # Tokens issued with the old password, which may have leaked, stop working
+    await AuthService.revoke_user_refresh_tokens(current_user.email)
+    await AuthService.revoke_user_tokens(current_user.email)
+
+    return updated_user
 
 
 @router.post(
@@ -134,14 +143,14 @@ async def update_password(
 )
 async def change_user_role(
         body: user_schemas.ChangeRole,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         _: User = Depends(get_current_active_user)
 ) -> Any:
     """
     The change_user_role function is used to change the role of a user.
 
     :param body: user_schemas.ChangeRole: Validate the request body
-    :param db: Session: Pass the database session to the repository layer
+    :param db: AsyncSession: Pass the database session to the repository layer
     :param _: User: Get the current user
     :return: A dictionary with the user_id and role
     """
@@ -152,14 +161,17 @@ async def change_user_role(
     if user.role == body.role:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="This user already has this role installed")
 
-    return await repository_users.user_update_role(user, body.role, db)  # noqa
+    user = await repository_users.user_update_role(user, body.role, db)  # noqa
+    await AuthService.revoke_user_tokens(user.email)
+
+    return user
 
 
 @router.get("/{username}", response_model=user_schemas.UserProfile,
             dependencies=[Depends(RateLimiter(times=10, seconds=60))])
 async def get_user_profile(
         username: str,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
@@ -168,7 +180,7 @@ async def get_user_profile(
     optional parameter, current_user, which represents the currently logged-in user.
 
     :param username: str: Get the username from the url
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the current user
     :return: A userprofile object
     """
@@ -183,7 +195,7 @@ async def get_user_profile(
             dependencies=[Depends(RateLimiter(times=10, seconds=60))])
 async def get_user_by_id(
         user_id: int,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
@@ -192,7 +204,7 @@ async def get_user_by_id(
     optional parameter, current_user, which represents the currently logged-in user.
 
     :param user_id: str: Get the username from the url
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the current user
     :return: A userprofile object
     """
@@ -208,14 +220,14 @@ async def get_user_by_id(
 @router.patch("/", response_model=user_schemas.UserPublic)
 async def update_user_profile(
         body: user_schemas.ProfileUpdate,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
     The update_user_profile function updates the user's profile.
 
     :param body: ProfileUpdate: Pass the data from the request body to this function
-    :param db: Session: Pass the database session to the repository layer
+    :param db: AsyncSession: Pass the database session to the repository layer
     :param current_user: User: Get the current user from the database
     :return: A dictionary with the updated user information
     """
@@ -231,13 +243,13 @@ async def update_user_profile(
 @router.post("/ban/{user_id}", dependencies=[Depends(UserRoleFilter(UserRole.admin))])
 async def ban_user(
         user_id: int,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user: UserRole = Depends(get_current_active_user)
 ) -> Any:
     """
     The ban_user function is used to ban a user.
     :param user_id: int: Specify the user id of the user to be banned
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: UserRole: Get the current user's role
     :return: A dictionary with a message, which is not the right way to return data
     """
@@ -245,20 +257,23 @@ async def ban_user(
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    return await repository_users.user_update_is_active(user, False, db)
+    user = await repository_users.user_update_is_active(user, False, db)
+    await AuthService.revoke_user_tokens(user.email)
+
+    return user
 
 
 @router.post("/unban/{user_id}", dependencies=[Depends(UserRoleFilter(UserRole.admin))])
 async def unban_user(
         user_id: int,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user: UserRole = Depends(get_current_active_user)
 ) -> Any:
     """
     The unban_user function is used to unban a user.
 
     :param user_id: int: Get the user id from the request
-    :param db: Session: Get the database connection
+    :param db: AsyncSession: Get the database connection
     :param current_user: UserRole: Get the current user from the database
     :return: A dict
     """
@@ -266,59 +281,144 @@ async def unban_user(
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    return await repository_users.user_update_is_active(user, True, db)
+    user = await repository_users.user_update_is_active(user, True, db)
+    await AuthService.revoke_user_tokens(user.email)
+
+    return user
 
 
-@router.get("/search/", response_model=List[user_schemas.UserInfo],
+@router.get("/search/", response_model=user_schemas.UserPage,
             dependencies=[Depends(RateLimiter(times=10, seconds=60))])
 async def search_users(
-        data: str,
-        db: Session = Depends(get_db),
+        data: str = Query(min_length=1, max_length=100),
+        limit: int = Query(default=10, ge=1, le=100),
+        cursor: Optional[str] = Query(default=None, max_length=512),
+        db: AsyncSession = Depends(get_db),
         _: User = Depends(get_current_active_user)
 ) -> Any:
 
     """
     The search_users function is used to search for users in the database.
-        The function takes a string as an argument and searches for users with that string in their username or email.
+        The function takes a string as an argument and searches for users with that string in their name or username,
+        the closest matches go first. Pages are chained with the next_cursor of the previous response.
         If no user is found, it returns a 404 error message.
 
     :param data: str: Pass the search query to the function
-    :param db: Session: Get the database session
+    :param limit: int: Limit the number of users returned
+    :param cursor: Optional[str]: Continue from the next_cursor of the previous page
+    :param db: AsyncSession: Get the database session
     :param _: User: Ensure that the user is logged in
-    :return: A list of users
+    :return: A page of users and the cursor of the next page
     """
-    users = await repository_users.search_users(data, db)
-    if not users:
+    try:
+        users, next_cursor = await repository_users.search_users(data, limit, db, cursor)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    if not users and cursor is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    return users
+    return {"users": users, "next_cursor": next_cursor}
+
+
+async def _search_section(
+        search: Callable[..., Awaitable[tuple[list, Optional[str]]]],
+        data: str,
+        limit: int,
+        cursor: Optional[str],
+        session_factory: async_sessionmaker,
+        timeout: float,
+) -> Optional[tuple[list, Optional[str]]]:
+    """
+    The _search_section function runs one section of search_all in a session of its own,
+    so the sections can run concurrently, and gives up on it after the timeout.
+    Cancelling the task does not stop a running query, the statement_timeout of the transaction does.
+
+    :param search: The repository search function
+    :param data: str: The search query
+    :param limit: int: Limit the number of results
+    :param cursor: Optional[str]: The cursor of the section
+    :param session_factory: async_sessionmaker: Creates the session of the section
+    :param timeout: float: Seconds to wait for the results
+    :return: The results and the cursor of the next page, or None if the search timed out
+    :raises ValueError: If the cursor is malformed
+    """
+    async def run():
+        async with session_factory() as db:
+            await db.execute(text(f"SET LOCAL statement_timeout = {max(1, int(timeout * 1000))}"))
+            return await search(data, limit, db, cursor)
+
+    try:
+        return await asyncio.wait_for(run(), timeout)
+    except asyncio.TimeoutError:
+        return None
+    except DBAPIError as e:
+        # 57014 query_canceled: the statement_timeout fired before wait_for did
+        if getattr(e.orig, "sqlstate", None) == "57014":
+            return None
+        raise
 
 
 @router.get("/search_all/", response_model=SearchResults,
             dependencies=[Depends(RateLimiter(times=10, seconds=60))])
 async def search_data(
-        data: str,
-        db: Session = Depends(get_db),
+        data: str = Query(min_length=1, max_length=100),
+        limit: int = Query(default=10, ge=1, le=50),
+        users_cursor: Optional[str] = Query(default=None, max_length=512),
+        images_cursor: Optional[str] = Query(default=None, max_length=512),
+        session_factory: async_sessionmaker = Depends(get_session_factory),
         _: User = Depends(get_current_active_user)
 ) -> Any:
     """
     The search_data function is used to search for users and images.
         It takes a string as an argument, which will be searched in the database.
+        Both searches run concurrently, each returns at most limit results and the cursor of its next page.
+        To load more of one section pass its cursor, only the sections with a cursor are searched then.
+        A section that does not answer within the search timeout is listed in timed_out instead of failing the request.
         If there are no results, it returns a 404 error with the message &quot;Data not found&quot;.
 
 
     :param data: str: Get the data that will be searched for
-    :param db: Session: Get a database session from the dependency injection container
+    :param limit: int: Limit the number of results of each section
+    :param users_cursor: Optional[str]: Continue the users section from this cursor
+    :param images_cursor: Optional[str]: Continue the images section from this cursor
+    :param session_factory: async_sessionmaker: Creates a database session for every section
     :param _: User: Check if the user is logged in
     :return: A searchresults object, which contains the results of both searches
     """
-    users = await repository_users.search_users(data, db)
-    images = await repository_images.search_images(data, db)
+    sections = {
+        "users": (repository_users.search_users, users_cursor),
+        "images": (repository_images.search_images, images_cursor),
+    }
+    if users_cursor or images_cursor:
+        sections = {name: section for name, section in sections.items() if section[1]}
+
+    results = await asyncio.gather(
+        *(
+            _search_section(search, data, limit, cursor, session_factory, settings.search_timeout)
+            for search, cursor in sections.values()
+        ),
+        return_exceptions=True
+    )
 
-    if not users and not images:
+    response = {"users": [], "images": [], "timed_out": []}
+    for name, result in zip(sections, results):
+        if isinstance(result, ValueError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        if isinstance(result, BaseException):
+            raise result
+        if result is None:
+            response["timed_out"].append(name)
+            continue
+        response[name], response[f"{name}_cursor"] = result
+
+    if len(response["timed_out"]) == len(sections):
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="Search timed out")
+
+    if not response["users"] and not response["images"] and not response["timed_out"]:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Data not found")
 
-    return SearchResults(users=users, images=images)
+    return response
 
 
 @router.get("/users/with_filter", response_model=list[UserPublic])
@@ -332,7 +432,7 @@ async def get_users_with_filter(
     created_at_start: Optional[str] = "2023-01-01",
     created_at_end: Optional[str] = datetime.today().strftime("%Y-%m-%d"),
     has_images: Optional[bool] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> list[UserPublic]:
     """
     Get a list of users from the database, filtered by the specified criteria.
@@ -346,7 +446,7 @@ async def get_users_with_filter(
     :param created_at_start: str: Filter users by created_at start date (format: YYYY-MM-DD).
     :param created_at_end: str: Filter users by created_at end date (format: YYYY-MM-DD).
     :param has_images: bool: Filter users by the presence of images.
-    :param db: Session: The database session dependency.
+    :param db: AsyncSession: The database session dependency.
     :return: List[UserPublic]: List of users, filtered by the specified criteria.
     """
     if current_user.role == UserRole.user:
@@ -1,8 +1,11 @@
+from typing import Optional
+
 from pydantic import utils, root_validator
 
 from .core import CoreModel, IDModelMixin, DateTimeModelMixin
 from .tag import TagResponse
-from svitlogram.services.cloudinary import formatting_image_url
+from svitlogram.services import storage
+from svitlogram.services.uploads import UploadJobStatus
 
 
 class ImageBase(CoreModel):
@@ -23,7 +26,7 @@ class ImageBase(CoreModel):
 
     @staticmethod
     def format_url(public_id: str):
-        return formatting_image_url(public_id)['url']
+        return storage.backend.url(public_id)
 
 
 class ImagePublic(DateTimeModelMixin, ImageBase, IDModelMixin):
@@ -31,10 +34,22 @@ class ImagePublic(DateTimeModelMixin, ImageBase, IDModelMixin):
         orm_mode = True
 
 
+class ImagePage(CoreModel):
+    images: list[ImagePublic]
+    next_cursor: Optional[str] = None
+
+
 class ImageCreateResponse(CoreModel):
     image: ImagePublic
     message: str = "Image successfully uploaded"
 
 
 class ImageRemoveResponse(CoreModel):
-    message: str = "Image successfully deleted"
\ No newline at end of file
+    message: str = "Image successfully deleted"
+
+
+class UploadJobResponse(CoreModel):
+    job_id: str
+    status: UploadJobStatus
+    image_id: Optional[int] = None
+    detail: Optional[str] = None
@@ -2,7 +2,8 @@ from typing import Optional
 
 from pydantic import root_validator, utils
 
-from svitlogram.services.cloudinary import CroppingOrResizingTransformation, formatting_image_url
+from svitlogram.services import storage
+from svitlogram.services.cloudinary import CroppingOrResizingTransformation
 from .core import CoreModel, IDModelMixin, DateTimeModelMixin
 from .image import ImagePublic
 
@@ -33,7 +34,7 @@ class FormattedImageBase(CoreModel):
 
     @staticmethod
     def format_url(public_id: str, format_: dict):
-        return formatting_image_url(public_id, format_)['url']
+        return storage.backend.url(public_id, format_)
 
 
 class FormattedImagePublic(DateTimeModelMixin, FormattedImageBase, IDModelMixin):
@@ -93,6 +93,14 @@ class ProfileUpdate(CoreModel):
     last_name: Optional[constr(min_length=3, max_length=100)] = None
 
 
+class UserPage(CoreModel):
+    users: List[UserInfo]
+    next_cursor: Optional[str] = None
+
+
 class SearchResults(CoreModel):
     users: List[UserInfo]
     images: List[ImagePublic]
+    users_cursor: Optional[str] = None
+    images_cursor: Optional[str] = None
+    timed_out: List[str] = []
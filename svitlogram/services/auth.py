@@ -1,53 +1,71 @@
-import pickle
+import hashlib
 from calendar import timegm
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
+from uuid import uuid4
 
-import redis as redis_db
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from svitlogram.database.connect import get_db
+from svitlogram.database.connect import get_db, redis_client
 from svitlogram.repository import users as repository_users
-from svitlogram.database.models import User
+from svitlogram.database.models import User, UserRole
+from svitlogram.services.passwords import password_hasher
+from svitlogram.services.refresh_tokens import refresh_tokens
+from svitlogram.services.revocation import revocation_store
+from svitlogram.services.token_cache import token_cache
+from svitlogram.services.user_cache import user_cache, CachedUser
 from config import settings
 
 
+@dataclass(frozen=True, slots=True)
+class TokenClaims:
+    """
+    The caller as described by the claims of the access token, without loading the user.
+    """
+    id: int
+    role: UserRole
+    is_active: bool
+
+
 class AuthService:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    ACCESS_TOKEN_TTL = 15 * 60
+    REFRESH_TOKEN_TTL = 7 * 24 * 60 * 60
     SECRET_KEY = settings.secret_key_jwt
     ALGORITHM = settings.algorithm
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
-    redis = redis_db.Redis(host=settings.redis_host, port=settings.redis_port, db=0, password=settings.redis_password)
+    redis = redis_client
 
     @classmethod
-    def verify_password(cls, plain_password, hashed_password) -> bool:
+    async def verify_password(cls, plain_password, hashed_password) -> bool:
         """
         The verify_password function takes a plain-text password and hashed password as arguments.
-        It then uses the verify method of the pwd_context object to check if they match.
+        It checks them with bcrypt in the password hashing pool, so the event loop keeps serving other requests.
         The result is returned as a boolean value.
 
         :param cls: Represent the class itself
         :param plain_password: Compare the password that is entered by the user to see if it matches
         :param hashed_password: Check if the password is hashed
         :return: True if the plain_password matches the hashed_password
+        :raises HTTPException: 503 if the pool is overloaded
         """
-        return cls.pwd_context.verify(plain_password, hashed_password)
+        return await password_hasher.verify(plain_password, hashed_password)
 
     @classmethod
-    def get_password_hash(cls, password: str) -> str:
+    async def get_password_hash(cls, password: str) -> str:
         """
         The get_password_hash function takes a password as input and returns the hashed version of that password.
-        The hashing algorithm used is PBKDF2, which is considered secure for most applications.
+        The hashing algorithm used is bcrypt, run in the password hashing pool.
 
         :param cls: Represent the class itself
         :param password: str: Pass in the password that is being hashed
         :return: A hashed password
+        :raises HTTPException: 503 if the pool is overloaded
         """
-        return cls.pwd_context.hash(password)
+        return await password_hasher.hash(password)
 
     @classmethod
     def __decode_jwt(cls, token: str) -> dict:
@@ -61,12 +79,30 @@ class AuthService:
         """
         return jwt.decode(token, cls.SECRET_KEY, algorithms=[cls.ALGORITHM])
 
+    @classmethod
+    def _decode_access_token(cls, token: str) -> dict:
+        """
+        The _decode_access_token function decodes a token like __decode_jwt, remembering the payloads
+        of access tokens until they expire: clients send the same access token with every request.
+
+        :param cls: Represent the class itself
+        :param token: str: Pass the token to the function
+        :return: The payload of the token, not to be modified
+        """
+        payload = token_cache.get(token)
+        if payload is None:
+            payload = cls.__decode_jwt(token)
+            if payload.get('scope') == 'access_token' and 'exp' in payload:
+                token_cache.put(token, payload)
+
+        return payload
+
     @classmethod
     def __encode_jwt(cls, data: dict, iat: datetime, exp: datetime, scope: str) -> str:
         """
         The __encode_jwt function takes in a dictionary of data, an issued at time (iat),
         an expiration time (exp), and a scope. It then creates a copy of the data dictionary
-        and adds the iat, exp, and scope to it. Finally it returns the encoded JWT.
+        and adds the iat, exp, scope and a unique jti, unless the data has one, to it. Finally it returns the encoded JWT.
 
         :param cls: Represent the class itself
         :param data: dict: Pass in the data that will be encoded into the jwt
@@ -75,8 +111,9 @@ class AuthService:
         :param scope: str: Specify the scope of the token
         :return: A string containing the encoded jwt
         """
-        to_encode = data.copy()
-        to_encode.update({"iat": iat, "exp": exp, "scope": scope})
+        to_encode = {"jti": uuid4().hex, **data}
+        # iat keeps the microseconds: a token issued right after revoke_user_tokens, in the same second, is valid
+        to_encode.update({"iat": cls._timestamp(iat), "exp": exp, "scope": scope})
 
         return jwt.encode(to_encode, cls.SECRET_KEY, algorithm=cls.ALGORITHM)
 
@@ -93,9 +130,20 @@ class AuthService:
         :param expires_delta: Optional[float]: Set the expiration time of the token
         :return: A string that is the access token
         """
-        expire = datetime.utcnow() + timedelta(seconds=expires_delta or 15 * 60)
+        expire = datetime.utcnow() + timedelta(seconds=expires_delta or cls.ACCESS_TOKEN_TTL)
         return cls.__encode_jwt(data, datetime.utcnow(), expire, "access_token")
 
+    @staticmethod
+    def user_claims(user: User) -> dict:
+        """
+        The user_claims function returns the payload of the access token of a user.
+        Besides the email it holds the id, role and is_active flag read by get_current_claims.
+
+        :param user: User: The user the token is issued for
+        :return: A dictionary to pass to create_access_token
+        """
+        return {"sub": user.email, "id": user.id, "role": str(user.role), "is_active": user.is_active}
+
     @classmethod
     async def create_refresh_token(cls, data: dict, expires_delta: Optional[float] = None) -> str:
         """
@@ -106,11 +154,81 @@ class AuthService:
         :param expires_delta: Optional[float]: Set the time to live for the refresh token
         :return: A jwt token
         """
-        expire = datetime.utcnow() + (
-            timedelta(seconds=expires_delta) if expires_delta else timedelta(days=7)
-        )
+        expire = datetime.utcnow() + timedelta(seconds=expires_delta or cls.REFRESH_TOKEN_TTL)
         return cls.__encode_jwt(data, datetime.utcnow(), expire, "refresh_token")
 
+    @classmethod
+    async def issue_tokens(cls, user: User) -> dict:
+        """
+        The issue_tokens function logs a user in: it starts a new refresh token family,
+        so the sessions of the user on other devices are left alone.
+
+        :param cls: Represent the class itself
+        :param user: User: The user that logs in
+        :return: A dictionary with the access_token, refresh_token and token type
+        """
+        family, jti = uuid4().hex, uuid4().hex
+        await refresh_tokens.issue(family, user.email, jti, cls.REFRESH_TOKEN_TTL)
+
+        return await cls._token_pair(user, family, jti)
+
+    @classmethod
+    async def rotate_tokens(cls, refresh_token: str, user: User) -> dict:
+        """
+        The rotate_tokens function exchanges a refresh token for a new pair of tokens of the same family.
+        The refresh token can only be used once, using it again revokes the family.
+
+        :param cls: Represent the class itself
+        :param refresh_token: str: The refresh token presented by the client
+        :param user: User: The owner of the refresh token
+        :return: A dictionary with the access_token, refresh_token and token type
+        :raises HTTPException: 401 if the token is not the current one of a family
+        """
+        try:
+            payload = cls.__decode_jwt(refresh_token)
+            family, jti = payload["fam"], payload["jti"]
+        except (JWTError, KeyError):
+            # Refresh tokens issued before the families existed cannot be rotated, their users log in again
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+
+        new_jti = uuid4().hex
+        if not await refresh_tokens.rotate(family, user.email, jti, new_jti, cls.REFRESH_TOKEN_TTL):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+
+        return await cls._token_pair(user, family, new_jti)
+
+    @classmethod
+    async def revoke_refresh_tokens(cls, access_token: str) -> None:
+        """
+        The revoke_refresh_tokens function ends the refresh token family the access token was issued with.
+
+        :param cls: Represent the class itself
+        :param access_token: str: The access token of the session to end
+        :return: None
+        """
+        family = cls.__decode_jwt(access_token).get("fam")
+        if family is not None:
+            await refresh_tokens.revoke(family)
+
+    @classmethod
+    async def revoke_user_refresh_tokens(cls, email: str) -> None:
+        """
+        The revoke_user_refresh_tokens function ends every refresh token family of a user,
+        the user has to log in again on every device.
+
+        :param cls: Represent the class itself
+        :param email: str: The email the refresh tokens were issued for
+        :return: None
+        """
+        await refresh_tokens.revoke_user(email)
+
+    @classmethod
+    async def _token_pair(cls, user: User, family: str, jti: str) -> dict:
+        access_token = await cls.create_access_token(data={**cls.user_claims(user), "fam": family})
+        refresh_token = await cls.create_refresh_token(data={"sub": user.email, "fam": family, "jti": jti})
+
+        return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
     @classmethod
     async def create_email_token(cls, data: dict, expires_delta: Optional[float] = None) -> str:
         """
@@ -153,16 +271,21 @@ class AuthService:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials')
 
     @classmethod
-    async def get_current_user(cls, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+    async def get_current_user(
+            cls, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
+    ) -> CachedUser:
         """
         The get_current_user function is a dependency that will be used in the
             UserRouter class. It takes an access token as input and returns the user
             associated with that token. If no user is found, it raises an exception.
+            Users are cached for a few seconds in the worker and for 15 minutes in Redis,
+            the repository functions that change them invalidate both. A user read from the database is not cached
+            if it was changed meanwhile, see UserCache.
 
         :param cls: Represent the class itself
         :param token: str: Get the token from the request header
-        :param db: Session: Get the database session
-        :return: The user object that matches the email in the jwt
+        :param db: AsyncSession: Get the database session
+        :return: A read-only snapshot of the user that matches the email in the jwt
         """
         credentials_exception = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -172,32 +295,101 @@ class AuthService:
 
         try:
             # Decode JWT
-            payload = cls.__decode_jwt(token)
+            payload = cls._decode_access_token(token)
 
             if payload.get('scope') == 'access_token':
                 email = payload.get("sub")
-                if email is None or await cls.token_is_blacklist(email, token):
+                if email is None:
                     raise credentials_exception
             else:
                 raise credentials_exception
         except JWTError as e:
             raise credentials_exception
 
-        user = cls.redis.get(f"user:{email}")
-        if user is None:
+        if await revocation_store.is_revoked(cls._token_id(payload, token)):
+            raise credentials_exception
 
-            user = await repository_users.get_user_by_email(email, db)
-            if user is None:
+        # The user is looked up in this worker's cache, then in Redis, then in the database
+        user = user_cache.get(email)
+        if user is not None:
+            return user
+
+        generation = user_cache.generation
+        cached, version = await cls.redis.mget(user_cache.key(email), user_cache.version_key(email))
+        if cached is not None:
+            try:
+                user = CachedUser.loads(cached)
+            except ValueError:
+                # Written by an older version of the snapshot, replaced by the one read from the database
+                await cls.redis.delete(user_cache.key(email))
+
+        if user is None:
+            db_user = await repository_users.get_user_by_email(email, db)
+            if db_user is None:
                 raise credentials_exception
 
-            cls.redis.set(f"user:{email}", pickle.dumps(user))
-            cls.redis.expire(f"user:{email}", 900)
+            user = CachedUser.from_user(db_user)
+            # Not written if the user was changed since the version was read, the snapshot may predate the change
+            await cls.redis.eval(user_cache.set_if_version, 2, user_cache.key(email), user_cache.version_key(email),
+                                 user.dumps(), version or b'', 900)
 
-        else:
-            user = pickle.loads(user)
+        user_cache.put(user, generation)
 
         return user
 
+    @classmethod
+    async def get_current_claims(cls, token: str = Depends(oauth2_scheme)) -> TokenClaims:
+        """
+        The get_current_claims function is a dependency for endpoints that only need to know who the caller is.
+            It verifies the access token and checks it has not been revoked, which usually needs no Redis call,
+            and returns the id, role and is_active flag from the claims of the token.
+            Neither the database nor the user cache are read.
+            The claims are as of the moment the token was issued: banning a user, changing their role or email
+            revokes every access token issued before, the client gets a 401 and refreshes its tokens.
+
+        :param cls: Represent the class itself
+        :param token: str: Get the token from the request header
+        :return: The claims of the token
+        """
+        credentials_exception = HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+        try:
+            payload = cls._decode_access_token(token)
+            if payload.get('scope') != 'access_token':
+                raise credentials_exception
+
+            email = payload["sub"]
+            claims = TokenClaims(id=int(payload["id"]), role=UserRole(payload["role"]),
+                                 is_active=bool(payload["is_active"]))
+        except (JWTError, KeyError, TypeError, ValueError):
+            # Tokens issued before the claims were added are refreshed like expired ones
+            raise credentials_exception
+
+        if await revocation_store.is_revoked(cls._token_id(payload, token), email, payload.get("iat", 0)):
+            raise credentials_exception
+
+        return claims
+
+    @classmethod
+    async def revoke_user_tokens(cls, email: str) -> None:
+        """
+        The revoke_user_tokens function makes get_current_claims reject the access tokens of a user issued until now.
+        It is called when a claim of the user changes, the marker lives as long as the tokens it revokes.
+
+        :param cls: Represent the class itself
+        :param email: str: The email the tokens were issued for
+        :return: None
+        """
+        await revocation_store.revoke_user(email, cls._timestamp(datetime.utcnow()), cls.ACCESS_TOKEN_TTL)
+
+    @staticmethod
+    def _timestamp(moment: datetime) -> float:
+        return timegm(moment.utctimetuple()) + moment.microsecond / 1_000_000
+
     @classmethod
     async def get_email_from_token(cls, token: str) -> str:
         """
@@ -223,58 +415,62 @@ class AuthService:
                                 detail="Invalid token for email verification")
 
     @classmethod
-    async def token_is_blacklist(cls, email: str, jwt_token: str) -> bool:
+    async def token_is_blacklist(cls, jwt_token: str) -> bool:
         """
-        The token_is_blacklist function checks if the access token is in the blacklist.
-            Args:
-                email (str): The user's email address.
-                token (str): The user's access token.
+        The token_is_blacklist function checks if the token has been revoked by add_token_to_blacklist.
 
         :param cls: Represent the class itself
-        :param email: str: Get the token from redis, and the token: str parameter is used to check if it matches
-        :param jwt_token: str: Check if the token is blacklisted
+        :param jwt_token: str: The token to check
         :return: A boolean value
         """
-        rd_token = cls.redis.get(f"black-list:{email}")
-
-        if rd_token and jwt_token == rd_token.decode('utf-8'):
-            return True
+        return await revocation_store.is_revoked(cls._token_id(cls.__decode_jwt(jwt_token), jwt_token))
 
-        return False
+    @staticmethod
+    def _token_id(payload: dict, jwt_token: str) -> str:
+        # Tokens issued before they carried a jti are told apart by their digest
+        return payload.get("jti") or hashlib.sha256(jwt_token.encode()).hexdigest()
 
     @classmethod
     async def add_token_to_blacklist(cls, jwt_token: str) -> None:
         """
-        The logout function takes an access token and adds it to the black list.
-        The function first decodes the JWT, then gets the email from it.
-        It also calculates how many seconds are left until expiration of that token.
-        Then, we add a key-value pair to Redis where the key is "black-list:{email}" and
-        the value is "access_token". We set an expiration time on this key equal to
-        the number of seconds remaining until expiration.
+        The add_token_to_blacklist function revokes a single token, e.g. the access token on logout.
+        The token is recorded by its jti until it expires, other tokens of the user stay valid.
 
         :param cls: Represent the class itself
-        :param jwt_token: str: Get the email from the token
+        :param jwt_token: str: The token to revoke
         :return: None
         """
+        token_cache.discard(jwt_token)
         payload = cls.__decode_jwt(jwt_token)
-
-        email: str = payload.get('sub')
         expire_seconds = payload.get('exp') - timegm(datetime.utcnow().utctimetuple())
 
-        cls.redis.set(f"black-list:{email}", jwt_token.encode('utf-8'))
-        cls.redis.expire(f"black-list:{email}", expire_seconds)
-        
+        await revocation_store.revoke_token(cls._token_id(payload, jwt_token), expire_seconds)
+
 
-async def get_current_active_user(current_user: User = Depends(AuthService.get_current_user)) -> User:
+async def get_current_active_user(current_user: CachedUser = Depends(AuthService.get_current_user)) -> CachedUser:
     """
     The get_current_active_user function is a dependency that returns the current user,
     if it exists and is active. If not, an HTTPException with status code 400 (Bad Request)
     is raised.
 
-    :param current_user: User: Pass the user object to the function
+    :param current_user: CachedUser: Pass the user object to the function
     :return: The current_user if it is active
     """
     if not current_user.is_active:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user")
 
     return current_user
+
+
+async def get_current_active_claims(claims: TokenClaims = Depends(AuthService.get_current_claims)) -> TokenClaims:
+    """
+    The get_current_active_claims function is a lightweight alternative to get_current_active_user:
+    endpoints that only need the id or role of the caller opt in by depending on it instead.
+
+    :param claims: TokenClaims: The claims of the access token
+    :return: The claims if the user is active
+    """
+    if not claims.is_active:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user")
+
+    return claims
@@ -5,10 +5,11 @@ from strenum import StrEnum
 from typing import BinaryIO, Optional
 
 import cloudinary
-from cloudinary.uploader import upload
+import cloudinary.utils
 from pydantic import BaseModel
 
 from config import settings
+from svitlogram.services.uploader import uploader
 
 cloudinary.config(
     cloud_name=settings.cloudinary_name,
@@ -95,25 +96,24 @@ class CroppingOrResizingTransformation(BaseModel):
     gravity: Optional[GravityMode] = None
 
 
-def upload_image(file: BinaryIO, public_id: Optional[str] = None) -> Optional[dict]:
+async def upload_image(file: BinaryIO, public_id: Optional[str] = None) -> Optional[dict]:
     """
-    The upload_image function uploads an image to Cloudinary.
+    The upload_image function uploads an image to Cloudinary through the pooled connections of the uploader.
 
     :param file: BinaryIO: Pass the image file to be uploaded
     :param public_id: Optional[str]: Set a custom name for the image
-    :return: A tuple of three values:
+    :return: A dictionary with the url, public_id and version of the image, None if Cloudinary rejected it
     """
-    try:
-        image = cloudinary.uploader.upload_image(
-            file=file,
-            public_id=public_id or uuid.uuid4().hex,
-            folder=settings.cloudinary_folder,
-            owerwrite=True,
-        )
-    except cloudinary.exceptions.Error:
+    params = cloudinary.utils.build_upload_params(
+        public_id=public_id or uuid.uuid4().hex,
+        folder=settings.cloudinary_folder,
+        overwrite=True,
+    )
+    image = await uploader.post(_api_url("upload"), cloudinary.utils.sign_request(params, {}), file)
+    if "error" in image:
         return
 
-    return {'url': image.url, 'public_id': image.public_id, 'version': image.version}
+    return {'url': image['secure_url'], 'public_id': image['public_id'], 'version': image['version']}
 
 
 def formatting_image_url(public_id: str,
@@ -140,7 +140,7 @@ def formatting_image_url(public_id: str,
     return {'url': image.url, 'format': image.url_options}
 
 
-def remove_image(public_id: str) -> bool:
+async def remove_image(public_id: str) -> bool:
     """
     The remove_image function takes in a public_id string and returns True if the image was successfully removed from
     Cloudinary. If the image is not found, or there is an error removing it, False will be returned.
@@ -148,13 +148,18 @@ def remove_image(public_id: str) -> bool:
     :param public_id: str: Specify the public id of the image to be deleted
     :return: A boolean value indicating whether the image was successfully removed
     """
-    result = cloudinary.uploader.destroy(public_id=public_id)
-    if result['result'] == "ok":
+    params = {"timestamp": cloudinary.utils.now(), "public_id": public_id}
+    result = await uploader.post(_api_url("destroy"), cloudinary.utils.sign_request(params, {}))
+    if result.get('result') == "ok":
         return True
 
     return False
 
 
+def _api_url(action: str) -> str:
+    return cloudinary.utils.cloudinary_api_url(action, resource_type="image")
+
+
 FORMAT_AVATAR = CroppingOrResizingTransformation(
     crop=CropMode.FILL,
     width=250,
@@ -0,0 +1,83 @@
+import hashlib
+from dataclasses import dataclass
+from typing import BinaryIO, Optional
+
+from fastapi import HTTPException, UploadFile, status
+
+from config import settings
+
+# Offset, signature, media type and the name shown to clients of every format that is accepted.
+# Only the formats every browser shows are accepted, the files are served back to them as they were uploaded.
+SIGNATURES: list[tuple[int, bytes, str, str]] = [
+    (0, b"\xff\xd8\xff", "image/jpeg", "jpg"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png", "png"),
+    (0, b"GIF87a", "image/gif", "gif"),
+    (0, b"GIF89a", "image/gif", "gif"),
+    (8, b"WEBP", "image/webp", "webp"),
+]
+
+ALLOWED_FORMATS = list(dict.fromkeys(name for *_, name in SIGNATURES))
+
+SNIFF_SIZE = max(offset + len(signature) for offset, signature, *_ in SIGNATURES)
+
+
+@dataclass(frozen=True, slots=True)
+class IngestedFile:
+    """An uploaded file that was checked, rewound to its start to be sent to the storage"""
+    file: BinaryIO
+    content_type: str
+    size: int
+    sha256: str
+
+
+def sniff(head: bytes) -> Optional[str]:
+    """
+    The sniff function finds the format of a file by the signature at its start.
+    WebP files start with RIFF, followed by their size, so only the WEBP after it is compared.
+
+    :param head: bytes: The first bytes of the file, at least SNIFF_SIZE of them unless the file is shorter
+    :return: The media type of the file, None if it is not an image that is accepted
+    """
+    for offset, signature, content_type, _ in SIGNATURES:
+        if head[offset:offset + len(signature)] == signature and (content_type != "image/webp" or head[:4] == b"RIFF"):
+            return content_type
+
+
+async def ingest(upload: UploadFile, max_size: Optional[int] = None, chunk_size: int = 1024 * 1024) -> IngestedFile:
+    """
+    The ingest function reads an uploaded file once, in chunks: it checks the format by the first bytes
+    instead of the media type the client sent, stops as soon as the file is larger than max_size
+    and computes the SHA-256 of the content on the way.
+    Starlette keeps uploads larger than 1 MB in a temporary file, so the file is never held in memory whole.
+
+    :param upload: UploadFile: The file of the request
+    :param max_size: Optional[int]: The largest size accepted in bytes, upload_max_size by default
+    :param chunk_size: int: How many bytes are read at a time
+    :return: The file with its media type, size and hash
+    :raises HTTPException: 415 if the file is not an accepted image, 422 if it is empty, 413 if it is too large
+    """
+    max_size = max_size or settings.upload_max_size
+    digest = hashlib.sha256()
+    size = 0
+    content_type = None
+
+    await upload.seek(0)
+    while chunk := await upload.read(chunk_size):
+        if content_type is None:
+            content_type = sniff(chunk[:SNIFF_SIZE])
+            if content_type is None:
+                raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                                    detail=f"Invalid file type. Only allowed {', '.join(ALLOWED_FORMATS)}.")
+
+        size += len(chunk)
+        if size > max_size:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                detail=f"The file is larger than {max_size / 2 ** 20:g} MB")
+        digest.update(chunk)
+
+    if content_type is None:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid image file")
+
+    await upload.seek(0)
+
+    return IngestedFile(file=upload.file, content_type=content_type, size=size, sha256=digest.hexdigest())
@@ -0,0 +1,213 @@
+import logging
+import math
+import time
+from collections import OrderedDict
+from ipaddress import ip_address, ip_network
+from uuid import uuid4
+
+import redis.asyncio as redis
+from fastapi import HTTPException, Request, status
+from redis.exceptions import RedisError
+
+from svitlogram.database.connect import redis_pool
+from svitlogram.services.metrics import register_collector
+from config import settings
+
+
+TRUSTED_PROXIES = [ip_network(proxy, strict=False) for proxy in settings.trusted_proxies]
+
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        return any(ip_address(address) in network for network in TRUSTED_PROXIES)
+    except ValueError:
+        return False
+
+
+def client_ip(request: Request) -> str:
+    """
+    The client_ip function returns the address of the client.
+    X-Forwarded-For is only read if the peer is one of the trusted proxies, anybody else could put any address
+    there. It is read from the right, the last address a trusted proxy did not add is the client.
+
+    :param request: Request: The request
+    :return: The address of the client
+    """
+    address = request.client.host
+    if not _is_trusted_proxy(address):
+        return address
+
+    forwarded = request.headers.get("X-Forwarded-For", "")
+    for hop in reversed([hop.strip() for hop in forwarded.split(",") if hop.strip()]):
+        address = hop
+        if not _is_trusted_proxy(address):
+            break
+
+    return address
+
+
+class LoginThrottle:
+    """
+    Backs off logins after repeated failures, per email and per client IP, before any password is checked.
+
+    Failures are kept in Redis sorted sets over a sliding window. After free_attempts failures in the window
+    the next attempt has to wait base_delay seconds after the last failure, doubling with every further failure
+    up to max_delay. Lockouts are remembered in the worker too, so rejecting an attempt usually needs no Redis call.
+    An attempt let through is recorded as a failure by the same script that checks it, so concurrent attempts
+    cannot all pass before any of them failed, and is taken back when the password was right.
+    """
+
+    # Rejects or records the attempt ARGV[3] at ARGV[1] in the failures of the email KEYS[1] and the IP KEYS[2].
+    # ARGV[2] is the window, ARGV[4] and ARGV[5] the free attempts of the email and the IP,
+    # ARGV[6] and ARGV[7] the base and the max delay. Returns until when each of them is backing off.
+    check_and_record = """
+    local now = tonumber(ARGV[1])
+    local locked = false
+    local locked_until = {}
+    for i, key in ipairs(KEYS) do
+        redis.call('ZREMRANGEBYSCORE', key, 0, now - tonumber(ARGV[2]))
+        local over = redis.call('ZCARD', key) - tonumber(ARGV[3 + i])
+        local last = redis.call('ZRANGE', key, -1, -1, 'WITHSCORES')
+        local at = 0
+        if over >= 0 and last[2] then
+            at = tonumber(last[2]) + math.min(tonumber(ARGV[6]) * 2 ^ over, tonumber(ARGV[7]))
+        end
+        locked = locked or at > now
+        locked_until[i] = tostring(at)
+    end
+    if not locked then
+        for _, key in ipairs(KEYS) do
+            redis.call('ZADD', key, ARGV[1], ARGV[3])
+            redis.call('EXPIRE', key, ARGV[2])
+        end
+    end
+    return locked_until
+    """
+
+    def __init__(
+            self, window: int, email_free_attempts: int, ip_free_attempts: int, base_delay: float, max_delay: float,
+            maxsize: int = 10_000
+    ) -> None:
+        self.window = window
+        self.free_attempts = {"email": email_free_attempts, "ip": ip_free_attempts}
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.maxsize = maxsize
+        self.checks = 0
+        self.rejected = 0
+        self.failures = 0
+        self._locked: OrderedDict[str, float] = OrderedDict()
+
+    @staticmethod
+    def key(kind: str, value: str) -> str:
+        return f"login-failures:{kind}:{value}"
+
+    async def check(self, email: str, ip: str) -> str:
+        """
+        The check function rejects the attempt if the email or the IP is backing off,
+        otherwise it records the attempt as a failure until succeeded takes it back.
+        A failure to reach Redis is logged and lets the attempt through.
+
+        :param email: str: The email the client tries to log in as
+        :param ip: str: The address of the client
+        :return: The id of the attempt, to pass to succeeded
+        :raises HTTPException: 429 with Retry-After while backing off
+        """
+        self.checks += 1
+        now = time.time()
+        attempt = uuid4().hex
+        keys = [self.key("email", email), self.key("ip", ip)]
+
+        locked_until = max(self._locked.get(key, 0.0) for key in keys)
+        if locked_until <= now:
+            try:
+                async with self._redis() as client:
+                    results = await client.eval(
+                        self.check_and_record, len(keys), *keys, now, self.window, attempt,
+                        self.free_attempts["email"], self.free_attempts["ip"], self.base_delay, self.max_delay,
+                    )
+            except (RedisError, OSError) as e:
+                logging.error(e)
+                return attempt
+
+            for key, until in zip(keys, map(float, results)):
+                if until > now:
+                    self._lock(key, until)
+                    locked_until = max(locked_until, until)
+
+        if locked_until > now:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many failed login attempts, try again later",
+                headers={"Retry-After": str(math.ceil(locked_until - now))},
+            )
+
+        return attempt
+
+    def failed(self) -> None:
+        """
+        The failed function counts a failed attempt, check has already recorded it in Redis.
+
+        :return: None
+        """
+        self.failures += 1
+
+    async def succeeded(self, email: str, ip: str, attempt: str) -> None:
+        """
+        The succeeded function forgets the failures of the email and takes the attempt back from the ones of the IP,
+        the other failures of the IP stay: one good password does not vouch for everybody behind the address.
+
+        :param email: str: The email the client logged in as
+        :param ip: str: The address of the client
+        :param attempt: str: The id check returned
+        :return: None
+        """
+        key = self.key("email", email)
+        self._locked.pop(key, None)
+        try:
+            async with self._redis() as client, client.pipeline(transaction=False) as pipe:
+                await pipe.delete(key).zrem(self.key("ip", ip), attempt).execute()
+        except (RedisError, OSError) as e:
+            logging.error(e)
+
+    def _lock(self, key: str, until: float) -> None:
+        self._locked[key] = until
+        self._locked.move_to_end(key)
+        while len(self._locked) > self.maxsize:
+            self._locked.popitem(last=False)
+
+    async def clear(self) -> None:
+        """
+        The clear function forgets every failure, in the worker and in Redis.
+
+        :return: None
+        """
+        self._locked.clear()
+        async with self._redis() as client:
+            keys = [key async for key in client.scan_iter(match=self.key("*", "*"), count=1000)]
+            if keys:
+                await client.delete(*keys)
+
+    def stats(self) -> dict:
+        return {
+            "checks": self.checks,
+            "rejected": self.rejected,
+            "failures": self.failures,
+            "locked": sum(until > time.time() for until in self._locked.values()),
+        }
+
+    @staticmethod
+    def _redis() -> redis.Redis:
+        return redis.Redis(connection_pool=redis_pool)
+
+
+login_throttle = LoginThrottle(
+    window=settings.login_throttle_window,
+    email_free_attempts=settings.login_throttle_email_attempts,
+    ip_free_attempts=settings.login_throttle_ip_attempts,
+    base_delay=settings.login_throttle_base_delay,
+    max_delay=settings.login_throttle_max_delay,
+)
+
+register_collector("login_throttle", login_throttle.stats)
@@ -0,0 +1,25 @@
+import os
+from typing import Callable
+
+_collectors: dict[str, Callable[[], dict]] = {}
+
+
+def register_collector(name: str, collector: Callable[[], dict]) -> None:
+    """
+    The register_collector function adds a source of process-local counters to the metrics report.
+
+    :param name: str: The section of the report the counters are listed under
+    :param collector: Callable[[], dict]: Returns the current counters
+    :return: None
+    """
+    _collectors[name] = collector
+
+
+def collect() -> dict:
+    """
+    The collect function gathers the counters of every registered collector.
+    Counters live in memory, so with several workers every worker reports its own values.
+
+    :return: A dictionary with the worker pid and one section per collector
+    """
+    return {"pid": os.getpid(), **{name: collector() for name, collector in _collectors.items()}}
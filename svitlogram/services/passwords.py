@@ -0,0 +1,118 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from svitlogram.services.metrics import register_collector
+from config import settings
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a pool of worker processes, so that hashing does not block the event loop.
+
+    At most max_pending calls are running or waiting for a process at a time,
+    the calls above that are rejected with 503 instead of queueing without limit.
+    """
+
+    def __init__(self, workers: int, max_pending: int) -> None:
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.seconds = 0.0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    async def hash(self, password: str) -> str:
+        """
+        The hash function hashes a password in the pool.
+
+        :param password: str: The plain-text password
+        :return: The bcrypt hash
+        :raises HTTPException: 503 if too many calls are pending
+        """
+        return await self._run(_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """
+        The verify function checks a password against its hash in the pool.
+
+        :param plain_password: str: The plain-text password
+        :param hashed_password: str: The bcrypt hash
+        :return: True if the password matches the hash
+        :raises HTTPException: 503 if too many calls are pending
+        """
+        return await self._run(_verify, plain_password, hashed_password)
+
+    async def _run(self, function: Callable, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many password checks in progress, try again later",
+                headers={"Retry-After": "1"},
+            )
+
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool(), function, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+            self.seconds += time.perf_counter() - start
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Forked children would inherit the event loop and the open connections of the worker
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+        return self._executor
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "queued": max(0, self.pending - self.workers),
+            "peak_pending": self.peak_pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_ms": round(self.seconds / self.completed * 1000, 1) if self.completed else None,
+        }
+
+    async def start(self) -> None:
+        # Spawning the processes takes a while, better at startup than on the first login
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._pool(), os.getpid) for _ in range(self.workers)))
+
+    async def stop(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(workers=settings.password_hash_workers,
+                                 max_pending=settings.password_hash_max_pending)
+
+register_collector("password_hasher", password_hasher.stats)
@@ -0,0 +1,638 @@
+import asyncio
+import functools
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from inspect import signature
+from typing import Any, Awaitable, Callable, Iterable, Optional, Protocol
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import MissingGreenlet
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, ORMExecuteState, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList
+from sqlalchemy.util import await_only
+
+from svitlogram.services.metrics import register_collector
+from svitlogram.services.subscriber import ChannelSubscriber
+from config import settings
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    raise TypeError(f"{type(value).__name__} cannot be cached")
+
+
+def _object_hook(value: dict) -> Any:
+    if len(value) == 1 and "$datetime" in value:
+        return datetime.fromisoformat(value["$datetime"])
+    return value
+
+
+def _row_tag(table: str, ident: Any) -> str:
+    return f"{table}:{ident}"
+
+
+def _insert_tag(table: str) -> str:
+    # Inserted rows are not found by id in time, e.g. INSERT statements, so any insert drops the not found entries
+    return _row_tag(table, "new")
+
+
+def _columns(instance: Any) -> dict:
+    """
+    The _columns function returns the loaded column values of an ORM object, without loading the others.
+
+    :param instance: Any: The ORM object
+    :return: The values by attribute name
+    """
+    state = inspect(instance)
+    return {prop.key: state.dict[prop.key] for prop in state.mapper.column_attrs if prop.key in state.dict}
+
+
+def _instance_tags(instance: Any, parents: bool) -> list[str]:
+    """
+    The _instance_tags function returns the tags of the row of an ORM object.
+    Inserting or deleting a row also changes the counts and aggregates of the rows its foreign keys point to,
+    with parents the tags of those rows are returned too.
+
+    :param instance: Any: The ORM object
+    :param parents: bool: Add the tags of the rows the foreign keys point to
+    :return: The tags
+    """
+    state = inspect(instance)
+    mapper = state.mapper
+    table = mapper.local_table
+    tags = [_row_tag(table.name, ":".join(map(str, mapper.primary_key_from_instance(instance))))]
+
+    if parents:
+        for foreign_key in table.foreign_keys:
+            value = state.dict.get(mapper.get_property_by_column(foreign_key.parent).key)
+            if value is not None:
+                tags.append(_row_tag(foreign_key.column.table.name, value))
+
+    return tags
+
+
+def _statement_tags(statement: Any) -> list[str]:
+    """
+    The _statement_tags function returns the tags of the rows an UPDATE or DELETE statement changes.
+    Only a filter on the primary key is recognized, any other statement changes the whole table.
+
+    :param statement: Any: The UPDATE or DELETE statement
+    :return: The tags
+    """
+    table = statement.table
+    primary_key = list(table.primary_key)
+    criteria = statement.whereclause
+
+    clauses = [criteria]
+    if isinstance(criteria, BooleanClauseList) and criteria.operator is operators.and_:
+        clauses = criteria.clauses
+
+    for clause in clauses:
+        if (
+                len(primary_key) == 1
+                and isinstance(clause, BinaryExpression)
+                and clause.operator is operators.eq
+                and isinstance(clause.right, BindParameter)
+                and primary_key[0] in clause.left.proxy_set
+        ):
+            return [_row_tag(table.name, clause.right.effective_value)]
+
+    return [table.name]
+
+
+class Snapshot(Protocol):
+    """
+    How the result of a cached function is stored and restored.
+    """
+
+    def dumps(self, result: Any) -> tuple[Any, list[str]]:
+        """
+        :param result: Any: What the function returned, never None
+        :return: The JSON-serializable data and the tags of the rows it was read from
+        """
+
+    async def loads(self, data: Any, db: AsyncSession) -> Any:
+        """
+        :param data: Any: The data returned by dumps, shared with other requests and not to be modified
+        :param db: AsyncSession: The session of the caller
+        :return: What the function would have returned
+        """
+
+    def absent_tags(self) -> list[str]:
+        """
+        :return: The tags of a result that was not found
+        """
+
+
+class OrmSnapshot:
+    """
+    Stores an ORM object as its column values and the column values of its loaded collections.
+    The object is restored as a persistent object of the session of the caller without a query,
+    so it can be changed or deleted like a loaded one.
+    """
+
+    def __init__(self, model: type, *collections: str) -> None:
+        self.model = model
+        self.collections = collections
+
+    def dumps(self, instance: Any) -> tuple[dict, list[str]]:
+        data = _columns(instance)
+        tags = [inspect(self.model).local_table.name, *_instance_tags(instance, parents=False)]
+
+        for name in self.collections:
+            items = getattr(instance, name)
+            data[name] = [_columns(item) for item in items]
+            for item in items:
+                tags.extend(_instance_tags(item, parents=False))
+
+        return data, tags
+
+    async def loads(self, data: dict, db: AsyncSession) -> Any:
+        mapper = inspect(self.model)
+        key = mapper.identity_key_from_primary_key(
+            [data[mapper.get_property_by_column(column).key] for column in mapper.primary_key]
+        )
+        # Like a query, keep the object the session already has
+        loaded = db.identity_map.get(key)
+        if loaded is not None:
+            return loaded
+
+        instance = self._detached(self.model, {name: data[name] for name in data if name not in self.collections})
+        for name in self.collections:
+            related = mapper.relationships[name].mapper.class_
+            # As loaded: assigning the collection would change the backrefs of the items
+            set_committed_value(instance, name, [self._detached(related, item) for item in data[name]])
+
+        return await db.merge(instance, load=False)
+
+    def absent_tags(self) -> list[str]:
+        return [_insert_tag(inspect(self.model).local_table.name)]
+
+    @staticmethod
+    def _detached(model: type, values: dict) -> Any:
+        instance = model(**values)
+        make_transient_to_detached(instance)
+        return instance
+
+
+class MappingSnapshot:
+    """
+    Stores a row of a select of columns as a dict, e.g. a profile with aggregates.
+    The row depends on the row of table whose primary key is in the column key.
+    """
+
+    def __init__(self, table: str, key: str = "id") -> None:
+        self.table = table
+        self.key = key
+
+    def dumps(self, row: Any) -> tuple[dict, list[str]]:
+        data = dict(row)
+        return data, [self.table, _row_tag(self.table, data[self.key])]
+
+    async def loads(self, data: dict, db: AsyncSession) -> dict:
+        return dict(data)
+
+    def absent_tags(self) -> list[str]:
+        return [_insert_tag(self.table)]
+
+
+_FAILED = object()
+_MISSING = object()
+
+
+class ReadCache(ChannelSubscriber):
+    """
+    Read-through cache of repository functions: a process-local LRU in front of Redis in front of the database.
+
+    Entries are tagged with the rows they were read from. Committed changes of those rows,
+    seen in the flushes and UPDATE/DELETE statements of the session, drop the entries in Redis
+    and in every worker, the workers are told on a Redis channel.
+    Concurrent misses of a key in a worker share one load, the workers share it through a lock in Redis.
+    Results that were not found are cached briefly too, until a row is inserted into their table.
+
+    Until the listener is subscribed to the channel the cache is bypassed, it could miss invalidations.
+    Every invalidation also bumps a generation in Redis, a loaded entry is only stored in Redis if the generation
+    is still the one read before the load, so a read that raced a write in another worker does not store the old row.
+    """
+    channel = "read-cache:invalidate"
+    prefix = "read-cache"
+
+    def __init__(self, maxsize: int, ttl: int, local_ttl: float, negative_ttl: int, lock_timeout: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.negative_ttl = negative_ttl
+        self.lock_timeout = lock_timeout
+        self.invalidations = 0
+        self._entries: OrderedDict[str, tuple[float, Any, list[str]]] = OrderedDict()
+        self._keys_by_tag: dict[str, set[str]] = {}
+        self._loading: dict[str, asyncio.Future] = {}
+        self._generation = 0
+        self._counters: dict[str, dict[str, int]] = {}
+        self._ready = False
+
+    def key(self, namespace: str, arguments: list) -> str:
+        return f"{self.prefix}:{namespace}:{json.dumps(arguments, default=str, separators=(',', ':'))}"
+
+    def tag_key(self, tag: str) -> str:
+        return f"{self.prefix}-tag:{tag}"
+
+    def lock_key(self, key: str) -> str:
+        return f"{self.prefix}-lock:{key}"
+
+    @property
+    def generation_key(self) -> str:
+        return f"{self.prefix}-generation"
+
+    # Stores KEYS[2] and adds it to the tag sets KEYS[3:] if the generation in KEYS[1] is still ARGV[1], '' for none
+    put_if_generation = """
+    if (redis.call('GET', KEYS[1]) or '') ~= ARGV[1] then
+        return 0
+    end
+    redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+    for i = 3, #KEYS do
+        redis.call('SADD', KEYS[i], KEYS[2])
+        redis.call('EXPIRE', KEYS[i], ARGV[3])
+    end
+    return 1
+    """
+
+    def cached(
+            self, namespace: str, snapshot: Snapshot, ttl: Optional[int] = None, negative_ttl: Optional[int] = None
+    ) -> Callable:
+        """
+        The cached function decorates a repository function that reads by its arguments.
+        The arguments other than the session db make the key, they have to be JSON-serializable.
+        None, e.g. for an id that does not exist, is cached for negative_ttl seconds
+        or until a row is inserted into the table of the snapshot.
+
+        :param namespace: str: The name of the entries of the function
+        :param snapshot: Snapshot: How the results are stored and restored
+        :param ttl: Optional[int]: Seconds the entries live in Redis, the ttl of the cache by default
+        :param negative_ttl: Optional[int]: Seconds None is cached, the negative_ttl of the cache by default, 0 disables it
+        :return: The decorator
+        """
+        counters = self._counters.setdefault(
+            namespace, {"local_hits": 0, "redis_hits": 0, "negative_hits": 0, "misses": 0, "coalesced": 0}
+        )
+
+        def decorator(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+            parameters = signature(func)
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                arguments = parameters.bind(*args, **kwargs)
+                arguments.apply_defaults()
+                db = arguments.arguments["db"]
+                if not self._usable(db):
+                    return await func(*args, **kwargs)
+
+                key = self.key(namespace, [value for name, value in arguments.arguments.items() if name != "db"])
+
+                return await self._get(
+                    key, lambda: func(*args, **kwargs), db, snapshot, ttl or self.ttl,
+                    self.negative_ttl if negative_ttl is None else negative_ttl, counters
+                )
+
+            return wrapper
+
+        return decorator
+
+    def _usable(self, db: AsyncSession) -> bool:
+        # A transaction that changed rows must read them back from the database, and must not cache them
+        return self._ready and not (db.info.get(_CHANGES) or db.new or db.dirty or db.deleted)
+
+    async def _get(self, key: str, load: Callable[[], Awaitable[Any]], db: AsyncSession, snapshot: Snapshot,
+                   ttl: int, negative_ttl: int, counters: dict) -> Any:
+        data = self._get_local(key)
+        if data is not _MISSING:
+            counters["local_hits"] += 1
+            return await self._restore(data, db, snapshot, counters)
+
+        loading = self._loading.get(key)
+        if loading is not None:
+            counters["coalesced"] += 1
+            data = await asyncio.shield(loading)
+            if data is _FAILED:
+                return await load()
+            return None if data is None else await snapshot.loads(data, db)
+
+        self._loading[key] = asyncio.get_running_loop().create_future()
+        data = _FAILED
+        try:
+            result, data = await self._load(key, load, db, snapshot, ttl, negative_ttl, counters)
+            return result
+        finally:
+            self._loading.pop(key).set_result(data)
+
+    async def _load(self, key: str, load: Callable[[], Awaitable[Any]], db: AsyncSession, snapshot: Snapshot,
+                    ttl: int, negative_ttl: int, counters: dict) -> tuple[Any, Any]:
+        """
+        The _load function reads a key missing in this worker from Redis, or from the database
+        if no other worker is loading it.
+
+        :return: The result and its data, None and None if there is no result
+        """
+        generation = self._generation
+
+        entry, remote_generation = await self._get_remote(key)
+        locked = False
+        if entry is None:
+            locked = await self._lock(key)
+            if not locked:
+                entry = await self._wait(key)
+                counters["coalesced"] += entry is not None
+
+        try:
+            if entry is not None:
+                counters["redis_hits"] += 1
+                data, tags = entry
+                self._put_local(key, data, tags, generation, ttl if data is not None else negative_ttl)
+                return await self._restore(data, db, snapshot, counters), data
+
+            counters["misses"] += 1
+            result = await load()
+            if result is None:
+                if negative_ttl > 0:
+                    await self._put(key, None, snapshot.absent_tags(), generation, negative_ttl, remote_generation)
+                return None, None
+
+            data, tags = snapshot.dumps(result)
+            await self._put(key, data, tags, generation, ttl, remote_generation)
+
+            return result, data
+        finally:
+            if locked:
+                await self._unlock(key)
+
+    @staticmethod
+    async def _restore(data: Any, db: AsyncSession, snapshot: Snapshot, counters: dict) -> Any:
+        if data is None:
+            counters["negative_hits"] += 1
+            return None
+
+        return await snapshot.loads(data, db)
+
+    async def _put(self, key: str, data: Any, tags: list[str], generation: int, ttl: int,
+                   remote_generation: Optional[bytes]) -> None:
+        # Rows invalidated while the entry was being read may be older than it
+        if generation == self._generation:
+            self._put_local(key, data, tags, generation, ttl)
+            await self._put_remote(key, data, tags, ttl, remote_generation)
+
+    def _get_local(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        if entry[0] < time.monotonic():
+            self._drop(key)
+            return _MISSING
+
+        self._entries.move_to_end(key)
+
+        return entry[1]
+
+    def _put_local(self, key: str, data: Any, tags: list[str], generation: int, ttl: float) -> None:
+        if generation != self._generation or self.maxsize <= 0:
+            return
+
+        self._drop(key)
+        self._entries[key] = (time.monotonic() + min(self.local_ttl, ttl), data, tags)
+        for tag in tags:
+            self._keys_by_tag.setdefault(tag, set()).add(key)
+
+        while len(self._entries) > self.maxsize:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        for tag in entry[2]:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+    async def _get_remote(self, key: str) -> tuple[Optional[tuple[Any, list[str]]], Optional[bytes]]:
+        """
+        The _get_remote function reads the entry of the key and the generation of Redis in one round trip.
+
+        :return: The entry, None if it is not stored, and the generation to store a loaded entry with
+        """
+        try:
+            async with self._redis() as client:
+                entry, generation = await client.mget(key, self.generation_key)
+        except (RedisError, OSError) as e:
+            logging.error(e)
+            return None, None
+
+        return None if entry is None else json.loads(entry, object_hook=_object_hook), generation
+
+    async def _put_remote(self, key: str, data: Any, tags: list[str], ttl: int,
+                          generation: Optional[bytes]) -> None:
+        try:
+            async with self._redis() as client:
+                await client.eval(
+                    self.put_if_generation, 2 + len(tags), self.generation_key, key, *map(self.tag_key, tags),
+                    generation or b'', json.dumps([data, tags], default=_default, separators=(",", ":")), ttl,
+                )
+        except (RedisError, OSError) as e:
+            logging.error(e)
+
+    async def _lock(self, key: str) -> bool:
+        try:
+            async with self._redis() as client:
+                return bool(await client.set(self.lock_key(key), 1, nx=True, px=int(self.lock_timeout * 1000)))
+        except (RedisError, OSError) as e:
+            logging.error(e)
+            return True
+
+    async def _unlock(self, key: str) -> None:
+        try:
+            async with self._redis() as client:
+                await client.delete(self.lock_key(key))
+        except (RedisError, OSError) as e:
+            logging.error(e)
+
+    async def _wait(self, key: str) -> Optional[tuple[Any, list[str]]]:
+        """
+        The _wait function waits for the worker holding the lock of the key to store it in Redis.
+
+        :param key: str: The key
+        :return: The entry, or None if the lock was released or expired without it
+        """
+        deadline = time.monotonic() + self.lock_timeout
+        try:
+            async with self._redis() as client:
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(0.01)
+                    entry, locked = await client.pipeline(transaction=False).get(key).exists(
+                        self.lock_key(key)
+                    ).execute()
+                    if entry is not None:
+                        return json.loads(entry, object_hook=_object_hook)
+                    if not locked:
+                        return None
+        except (RedisError, OSError) as e:
+            logging.error(e)
+
+        return None
+
+    def discard(self, tags: Iterable[str]) -> None:
+        """
+        The discard function drops the entries of the tags from this worker's cache.
+
+        :param tags: Iterable[str]: Tags of changed rows or tables
+        :return: None
+        """
+        self._generation += 1
+        for tag in tags:
+            for key in list(self._keys_by_tag.get(tag, ())):
+                self._drop(key)
+
+    async def invalidate(self, tags: Iterable[str]) -> None:
+        """
+        The invalidate function drops the entries of the tags locally, deletes them from Redis
+        and announces the tags to the other workers.
+        A failure is logged and does not fail the request, the rows have already been changed.
+
+        :param tags: Iterable[str]: Tags of changed rows or tables
+        :return: None
+        """
+        tags = sorted(set(tags))
+        if not tags:
+            return
+        self.invalidations += 1
+        self.discard(tags)
+
+        try:
+            async with self._redis() as client:
+                async with client.pipeline(transaction=False) as pipe:
+                    # Bumped first: an entry stored from now on was loaded after the change, see put_if_generation
+                    pipe.incr(self.generation_key)
+                    for tag in tags:
+                        pipe.smembers(self.tag_key(tag))
+                    _, *members = await pipe.execute()
+                    keys = {key for tag_keys in members for key in tag_keys}
+
+                async with client.pipeline(transaction=False) as pipe:
+                    await pipe.delete(*keys, *map(self.tag_key, tags)).publish(self.channel, json.dumps(tags)).execute()
+        except (RedisError, OSError) as e:
+            logging.error(e)
+
+    def _committed(self, tags: Iterable[str]) -> None:
+        tags = list(tags)
+        try:
+            # Runs inside the commit of an AsyncSession, which returns once the other workers have been told
+            await_only(self.invalidate(tags))
+        except MissingGreenlet:
+            # Committed by a synchronous session, e.g. of a script: Redis cannot be reached from here,
+            # other workers serve the old rows until they expire
+            self.discard(tags)
+
+    async def clear(self) -> None:
+        """
+        The clear function drops every entry of this worker and of Redis.
+
+        :return: None
+        """
+        self._reset()
+
+        async with self._redis() as client:
+            keys = [key async for key in client.scan_iter(match=f"{self.prefix}*")]
+            if keys:
+                await client.delete(*keys)
+
+    def _reset(self) -> None:
+        self._generation += 1
+        self._entries.clear()
+        self._keys_by_tag.clear()
+
+    def stats(self) -> dict:
+        return {
+            "ready": self._ready,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "invalidations": self.invalidations,
+            # Queries of rows that do not exist answered from the cache
+            "negative_hits": sum(counters["negative_hits"] for counters in self._counters.values()),
+            "functions": {
+                namespace: {
+                    **counters,
+                    "hit_rate": round((counters["local_hits"] + counters["redis_hits"]) / lookups, 4)
+                    if (lookups := counters["local_hits"] + counters["redis_hits"] + counters["misses"]) else None,
+                }
+                for namespace, counters in self._counters.items()
+            },
+        }
+
+    async def _subscribed(self, client: redis.Redis) -> None:
+        self._reset()
+        self._ready = True
+
+    def _received(self, data: bytes) -> None:
+        self.discard(json.loads(data))
+
+    def _lost(self) -> None:
+        self._ready = False
+        self._reset()
+
+
+read_cache = ReadCache(
+    maxsize=settings.read_cache_size,
+    ttl=settings.read_cache_ttl,
+    local_ttl=settings.read_cache_local_ttl,
+    negative_ttl=settings.read_cache_negative_ttl,
+    lock_timeout=settings.read_cache_lock_timeout,
+)
+
+register_collector("read_cache", read_cache.stats)
+
+# Tags of the rows changed in the transaction, invalidated once it commits
+_CHANGES = "read_cache_changes"
+
+
+def _after_flush(session: Session, flush_context: Any) -> None:
+    changes = session.info.setdefault(_CHANGES, set())
+    for instance in session.new:
+        changes.update(_instance_tags(instance, parents=True))
+        changes.add(_insert_tag(inspect(instance).mapper.local_table.name))
+    for instance in session.dirty:
+        changes.update(_instance_tags(instance, parents=False))
+    for instance in session.deleted:
+        changes.update(_instance_tags(instance, parents=True))
+
+
+def _on_orm_execute(state: ORMExecuteState) -> None:
+    if state.is_update or state.is_delete:
+        state.session.info.setdefault(_CHANGES, set()).update(_statement_tags(state.statement))
+    elif state.is_insert:
+        state.session.info.setdefault(_CHANGES, set()).add(_insert_tag(state.statement.table.name))
+
+
+def _after_commit(session: Session) -> None:
+    changes = session.info.pop(_CHANGES, None)
+    if changes:
+        read_cache._committed(changes)
+
+
+def _after_rollback(session: Session) -> None:
+    session.info.pop(_CHANGES, None)
+
+
+event.listen(Session, "after_flush", _after_flush)
+event.listen(Session, "do_orm_execute", _on_orm_execute)
+event.listen(Session, "after_commit", _after_commit)
+event.listen(Session, "after_rollback", _after_rollback)
@@ -0,0 +1,127 @@
+import logging
+
+import redis.asyncio as redis
+from redis.exceptions import WatchError
+
+from svitlogram.database.connect import redis_pool
+from svitlogram.services.metrics import register_collector
+
+
+class RefreshTokenStore:
+    """
+    Refresh token families in Redis, one family per login, so a user can be logged in on several devices.
+
+    A family remembers the jti of the only refresh token of the login that may still be used.
+    Every refresh rotates it, presenting a token that was already rotated away means it leaked:
+    the whole family is revoked, the thief and the owner both have to log in again.
+    The families of a user are listed in a set, so that all of them are revoked when the password changes.
+    """
+
+    def __init__(self) -> None:
+        self.issued = 0
+        self.rotated = 0
+        self.reused = 0
+        self.revoked = 0
+
+    @staticmethod
+    def key(family: str) -> str:
+        return f"refresh-family:{family}"
+
+    @staticmethod
+    def user_key(email: str) -> str:
+        return f"refresh-families:{email}"
+
+    async def issue(self, family: str, email: str, jti: str, ttl: int) -> None:
+        """
+        The issue function starts a family with its first refresh token.
+
+        :param family: str: The id of the family
+        :param email: str: The owner of the family
+        :param jti: str: The id of the refresh token
+        :param ttl: int: Seconds until the refresh token expires
+        :return: None
+        """
+        self.issued += 1
+        async with self._redis() as client, client.pipeline(transaction=True) as pipe:
+            await pipe.hset(self.key(family), mapping={"email": email, "current": jti}).expire(
+                self.key(family), ttl
+            ).sadd(self.user_key(email), family).expire(self.user_key(email), ttl).execute()
+
+    async def rotate(self, family: str, email: str, jti: str, new_jti: str, ttl: int) -> bool:
+        """
+        The rotate function replaces the current refresh token of the family by a new one.
+        A token of the family that is not the current one revokes the family.
+
+        :param family: str: The id of the family
+        :param email: str: The owner of the refresh token
+        :param jti: str: The id of the refresh token presented
+        :param new_jti: str: The id of the refresh token that replaces it
+        :param ttl: int: Seconds until the new refresh token expires
+        :return: True if the token was current and has been replaced
+        """
+        key = self.key(family)
+        async with self._redis() as client, client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    owner, current = await pipe.hmget(key, "email", "current")
+                    if current is None or owner.decode() != email:
+                        await pipe.reset()
+                        return False
+
+                    if current.decode() != jti:
+                        pipe.multi()
+                        await pipe.delete(key).execute()
+                        self.reused += 1
+                        logging.warning(f"Refresh token reused, family {family} of {email} revoked")
+                        return False
+
+                    pipe.multi()
+                    await pipe.hset(key, "current", new_jti).expire(key, ttl).expire(
+                        self.user_key(email), ttl
+                    ).execute()
+                    self.rotated += 1
+                    return True
+                except WatchError:
+                    # Another refresh of the family got in between, check again against its outcome
+                    continue
+
+    async def revoke(self, family: str) -> None:
+        """
+        The revoke function ends the family, e.g. on logout.
+
+        :param family: str: The id of the family
+        :return: None
+        """
+        self.revoked += 1
+        async with self._redis() as client:
+            await client.delete(self.key(family))
+
+    async def revoke_user(self, email: str) -> None:
+        """
+        The revoke_user function ends every family of the user, e.g. when the password changes.
+
+        :param email: str: The owner of the families
+        :return: None
+        """
+        async with self._redis() as client:
+            families = [family.decode() for family in await client.smembers(self.user_key(email))]
+            if not families:
+                return
+
+            self.revoked += len(families)
+            async with client.pipeline(transaction=True) as pipe:
+                # Only the families read are removed from the set, one issued meanwhile stays listed
+                await pipe.delete(*map(self.key, families)).srem(self.user_key(email), *families).execute()
+
+    def stats(self) -> dict:
+        return {"issued": self.issued, "rotated": self.rotated, "reused": self.reused, "revoked": self.revoked}
+
+    @staticmethod
+    def _redis() -> redis.Redis:
+        return redis.Redis(connection_pool=redis_pool)
+
+
+refresh_tokens = RefreshTokenStore()
+
+register_collector("refresh_tokens", refresh_tokens.stats)
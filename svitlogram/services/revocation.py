@@ -0,0 +1,178 @@
+import hashlib
+import math
+from typing import Iterator, Optional
+
+import redis.asyncio as redis
+
+from svitlogram.services.metrics import register_collector
+from svitlogram.services.subscriber import ChannelSubscriber
+from config import settings
+
+
+class BloomFilter:
+    """
+    Fixed-size set of strings that can answer "certainly not added" without storing them.
+
+    Once capacity items were added, an item that was not added is reported
+    as present with a probability of about error_rate. Items cannot be removed.
+    """
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str) -> Iterator[int]:
+        # Double hashing: the k positions are derived from the two halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationStore(ChannelSubscriber):
+    """
+    Revoked tokens by jti and per-user revocation markers, kept in Redis until the tokens they revoke expire.
+
+    Every worker mirrors the keys in a Bloom filter: a token that is certainly not revoked,
+    which is nearly every token, is accepted without a network call, only the rest is looked up in Redis.
+    Revocations are announced on a Redis channel, the filter is rebuilt from the keys left
+    every rebuild_interval seconds so that expired revocations leave it. Until the filter has been
+    loaded, or after the subscription broke, every check goes to Redis.
+    """
+    channel = "tokens:revoked"
+
+    def __init__(self, capacity: int, error_rate: float, rebuild_interval: float) -> None:
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.tick = rebuild_interval
+        self.checks = 0
+        self.redis_checks = 0
+        self.revoked = 0
+        self._filter: Optional[BloomFilter] = None
+        self._next_filter: Optional[BloomFilter] = None
+
+    @staticmethod
+    def token_key(jti: str) -> str:
+        return f"revoked-token:{jti}"
+
+    @staticmethod
+    def user_key(email: str) -> str:
+        return f"revoked-before:{email}"
+
+    async def is_revoked(self, jti: str, email: Optional[str] = None, iat: float = 0) -> bool:
+        """
+        The is_revoked function checks whether a token was revoked, by itself or together with the other tokens
+        of its user. Redis is only asked when the Bloom filter cannot rule the revocation out.
+
+        :param jti: str: The id of the token
+        :param email: Optional[str]: The owner of the token, to also check the tokens revoked by revoke_user
+        :param iat: float: The time the token was issued at, with the fraction of the second
+        :return: True if the token must be rejected
+        """
+        self.checks += 1
+        keys = [self.token_key(jti)] + ([self.user_key(email)] if email else [])
+        if self._filter is not None and not any(key in self._filter for key in keys):
+            return False
+
+        self.redis_checks += 1
+        async with self._redis() as client:
+            token_revoked, *revoked_before = await client.mget(keys)
+
+        revoked = token_revoked is not None or any(
+            value is not None and iat < float(value) for value in revoked_before
+        )
+        self.revoked += revoked
+
+        return revoked
+
+    async def revoke_token(self, jti: str, ttl: int) -> None:
+        """
+        The revoke_token function revokes a single token.
+
+        :param jti: str: The id of the token
+        :param ttl: int: Seconds until the token expires
+        :return: None
+        """
+        await self._revoke(self.token_key(jti), 1, ttl)
+
+    async def revoke_user(self, email: str, revoked_before: float, ttl: int) -> None:
+        """
+        The revoke_user function revokes the tokens of a user issued before a moment.
+
+        :param email: str: The owner of the tokens
+        :param revoked_before: float: The moment as a Unix timestamp, with the fraction of the second
+        :param ttl: int: Seconds until the last of the revoked tokens expires
+        :return: None
+        """
+        await self._revoke(self.user_key(email), revoked_before, ttl)
+
+    async def _revoke(self, key: str, value: float, ttl: int) -> None:
+        self._add(key)
+        async with self._redis() as client, client.pipeline(transaction=False) as pipe:
+            await pipe.set(key, value, ex=max(ttl, 1)).publish(self.channel, key).execute()
+
+    def _add(self, key: str) -> None:
+        for bloom_filter in (self._filter, self._next_filter):
+            if bloom_filter is not None:
+                bloom_filter.add(key)
+
+    def clear(self) -> None:
+        """
+        The clear function drops the filter, checks go to Redis until the listener loads it again.
+
+        :return: None
+        """
+        self._filter = None
+        self._next_filter = None
+
+    def stats(self) -> dict:
+        return {
+            "ready": self._filter is not None,
+            "items": self._filter.count if self._filter is not None else None,
+            "capacity": self.capacity,
+            "checks": self.checks,
+            "redis_checks": self.redis_checks,
+            "revoked": self.revoked,
+            "fast_path_rate": round(1 - self.redis_checks / self.checks, 4) if self.checks else None,
+        }
+
+    async def _subscribed(self, client: redis.Redis) -> None:
+        # Subscribed before loading, so no revocation falls between the two
+        await self._rebuild(client)
+
+    def _received(self, data: bytes) -> None:
+        self._add(data.decode())
+
+    def _lost(self) -> None:
+        self.clear()
+
+    async def _tick(self, client: redis.Redis) -> None:
+        await self._rebuild(client)
+
+    async def _rebuild(self, client: redis.Redis) -> None:
+        # Revocations made while scanning go to both filters, see _add
+        self._next_filter = BloomFilter(self.capacity, self.error_rate)
+        async for key in client.scan_iter(match="revoked-*", count=1000):
+            self._next_filter.add(key.decode())
+
+        self._filter, self._next_filter = self._next_filter, None
+
+
+revocation_store = RevocationStore(
+    capacity=settings.revocation_filter_capacity,
+    error_rate=settings.revocation_filter_error_rate,
+    rebuild_interval=settings.revocation_rebuild_interval,
+)
+
+register_collector("token_revocations", revocation_store.stats)
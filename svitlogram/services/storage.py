@@ -0,0 +1,263 @@
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import BinaryIO, Optional
+from urllib.parse import urlencode
+
+from config import settings
+from svitlogram.services import cloudinary
+from svitlogram.services.cloudinary import CroppingOrResizingTransformation
+from svitlogram.services.metrics import register_collector
+from svitlogram.services.uploader import uploader
+
+
+class StorageBackend(ABC):
+    """
+    Where the files of images and avatars are kept and how their URLs are built.
+
+    Uploads and removals go through the uploader, building URLs does not block.
+    """
+    name: str
+    """Recorded with the files of images, so that the same content is only shared within a storage"""
+
+    @abstractmethod
+    async def upload(self, file: BinaryIO, public_id: Optional[str] = None,
+                     content_type: Optional[str] = None, namespace: Optional[str] = None) -> Optional[dict]:
+        """
+        The upload function stores the file.
+
+        :param file: BinaryIO: The file to store, read from its current position
+        :param public_id: Optional[str]: The id to store the file under, if the backend lets the caller choose it
+        :param content_type: Optional[str]: The media type the client sent the file with
+        :param namespace: Optional[str]: Keeps the file apart from the files of images with the same content,
+            which are counted in image_files and removed with the last image, e.g. avatar
+        :return: A dictionary with the url, public_id and version of the file, None if it could not be stored
+        """
+
+    @abstractmethod
+    async def remove(self, public_id: str) -> bool:
+        """
+        The remove function deletes the stored file.
+
+        :param public_id: str: The id the file was stored under
+        :return: True if the file was removed
+        """
+
+    async def exists(self, public_id: str) -> bool:
+        """
+        The exists function checks that the file is still stored.
+        Backends that store every upload under a new id never lose a file to the removal of another one,
+        they do not have to look.
+
+        :param public_id: str: The id the file was stored under
+        :return: True if the file is stored
+        """
+        return True
+
+    @abstractmethod
+    def transform(self, public_id: str,
+                  transformation: Optional[CroppingOrResizingTransformation | dict] = None,
+                  version: Optional[str] = None) -> dict:
+        """
+        The transform function builds the URL of the file with a transformation applied to it.
+
+        :param public_id: str: The id the file was stored under
+        :param transformation: Optional[CroppingOrResizingTransformation | dict]: The cropping or resizing to apply
+        :param version: Optional[str]: The version of the file
+        :return: A dictionary with the url and the format, the options to store to build the same URL later
+        """
+
+    def url(self, public_id: str,
+            transformation: Optional[CroppingOrResizingTransformation | dict] = None,
+            version: Optional[str] = None) -> str:
+        """
+        The url function returns the URL of the file, transformed if a transformation is given.
+
+        :param public_id: str: The id the file was stored under
+        :param transformation: Optional[CroppingOrResizingTransformation | dict]: The cropping or resizing to apply
+        :param version: Optional[str]: The version of the file
+        :return: The URL the client loads the file from
+        """
+        return self.transform(public_id, transformation, version)['url']
+
+
+class CloudinaryStorage(StorageBackend):
+    """Files kept in Cloudinary, which also applies the transformations"""
+    name = 'cloudinary'
+
+    async def upload(self, file: BinaryIO, public_id: Optional[str] = None,
+                     content_type: Optional[str] = None, namespace: Optional[str] = None) -> Optional[dict]:
+        return await cloudinary.upload_image(file, public_id)
+
+    async def remove(self, public_id: str) -> bool:
+        return await cloudinary.remove_image(public_id)
+
+    def transform(self, public_id: str,
+                  transformation: Optional[CroppingOrResizingTransformation | dict] = None,
+                  version: Optional[str] = None) -> dict:
+        return cloudinary.formatting_image_url(public_id, transformation, version)
+
+
+class LocalStorage(StorageBackend):
+    """
+    Files kept in a local directory and served by the storage route.
+
+    A file is named by the SHA-256 of its content, so uploading the same content twice stores it once
+    and the public_id asked for by the caller is ignored. The namespace is put before the hash,
+    an avatar never shares the file of an image. The URL of a file never changes its content,
+    the route lets clients cache it for good.
+    Transformations are kept in the URL and the format but not applied, the original file is served.
+    """
+    name = 'local'
+    public_id_pattern = re.compile(r"(?:[a-z]{1,16}-)?(?P<digest>[0-9a-f]{64})(?:\.[0-9a-z]{1,8})?")
+
+    def __init__(self, root: str | Path, base_url: str, chunk_size: int = 64 * 1024):
+        """
+        :param root: str | Path: The directory the files are written to, created on the first upload
+        :param base_url: str: The URL of the storage route
+        :param chunk_size: int: How many bytes are read and hashed at a time
+        """
+        self.root = Path(root)
+        self.base_url = base_url.rstrip('/')
+        self.chunk_size = chunk_size
+
+    def path(self, public_id: str) -> Optional[Path]:
+        """
+        The path function returns where the file is written, in a directory named by the first two hex digits of its
+        hash so that no directory grows too large.
+
+        :param public_id: str: The id of the file
+        :return: The path of the file, None if public_id is not one this backend gives out
+        """
+        match = self.public_id_pattern.fullmatch(public_id)
+        if match is None:
+            return None
+
+        return self.root / match['digest'][:2] / public_id
+
+    async def upload(self, file: BinaryIO, public_id: Optional[str] = None,
+                     content_type: Optional[str] = None, namespace: Optional[str] = None) -> Optional[dict]:
+        return await uploader.run(self._write, file, content_type, namespace)
+
+    async def remove(self, public_id: str) -> bool:
+        return await uploader.run(self._unlink, public_id)
+
+    async def exists(self, public_id: str) -> bool:
+        return await uploader.run(self._exists, public_id)
+
+    def _write(self, file: BinaryIO, content_type: Optional[str], namespace: Optional[str]) -> Optional[dict]:
+        self.root.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+
+        with tempfile.NamedTemporaryFile(dir=self.root, prefix='.upload-', delete=False) as temporary:
+            try:
+                while chunk := file.read(self.chunk_size):
+                    digest.update(chunk)
+                    temporary.write(chunk)
+                    size += len(chunk)
+            except BaseException:
+                os.unlink(temporary.name)
+                raise
+
+        if size == 0:
+            os.unlink(temporary.name)
+            return None
+
+        name = f"{namespace}-{digest.hexdigest()}" if namespace else digest.hexdigest()
+        extension = mimetypes.guess_extension(content_type) if content_type else None
+        public_id = name + (extension or '')
+        if not self.public_id_pattern.fullmatch(public_id):
+            public_id = name
+
+        path = self.path(public_id)
+        path.parent.mkdir(exist_ok=True)
+        os.replace(temporary.name, path)
+
+        return {'url': self.url(public_id), 'public_id': public_id, 'version': None}
+
+    def _unlink(self, public_id: str) -> bool:
+        path = self.path(public_id)
+        if path is None:
+            return False
+
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            return False
+
+        return True
+
+    def _exists(self, public_id: str) -> bool:
+        path = self.path(public_id)
+        return path is not None and path.is_file()
+
+    def transform(self, public_id: str,
+                  transformation: Optional[CroppingOrResizingTransformation | dict] = None,
+                  version: Optional[str] = None) -> dict:
+        if isinstance(transformation, CroppingOrResizingTransformation):
+            transformation = transformation.dict()
+
+        options = {key: str(value) for key, value in (transformation or {}).items() if value is not None}
+        url = f"{self.base_url}/{public_id}"
+
+        return {'url': f"{url}?{urlencode(options)}" if options else url, 'format': options}
+
+
+def create_storage(backend: str) -> StorageBackend:
+    """
+    The create_storage function returns the backend named in the settings.
+
+    :param backend: str: cloudinary or local
+    :return: The storage backend
+    """
+    if backend == 'local':
+        return LocalStorage(settings.storage_local_root, settings.storage_local_url)
+    if backend == 'cloudinary':
+        return CloudinaryStorage()
+
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+backend: StorageBackend = create_storage(settings.storage_backend)
+"""The backend the routes and schemas use, replace it to store files elsewhere"""
+
+
+class UploadStats:
+    """Counts the uploaded images and how many of them reused a file of an image with the same content"""
+
+    def __init__(self) -> None:
+        self.uploads = 0
+        self.deduplicated = 0
+        self.bytes_deduplicated = 0
+
+    def record(self, size: int, deduplicated: bool) -> None:
+        """
+        The record function counts an uploaded image.
+
+        :param size: int: The size of the file in bytes
+        :param deduplicated: bool: Whether the file was already stored and not uploaded again
+        :return: None
+        """
+        self.uploads += 1
+        if deduplicated:
+            self.deduplicated += 1
+            self.bytes_deduplicated += size
+
+    def stats(self) -> dict:
+        return {
+            "backend": backend.name,
+            "uploads": self.uploads,
+            "deduplicated": self.deduplicated,
+            "dedup_ratio": round(self.deduplicated / self.uploads, 3) if self.uploads else None,
+            "bytes_deduplicated": self.bytes_deduplicated,
+        }
+
+
+upload_stats = UploadStats()
+
+register_collector("storage", upload_stats.stats)
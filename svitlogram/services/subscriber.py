@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+from svitlogram.database.connect import redis_pool
+
+
+class ChannelSubscriber:
+    """
+    Keeps the worker subscribed to a Redis channel, from a task started in the startup hook.
+
+    Once subscribed, _subscribed runs and every message on the channel is passed to _received.
+    Messages published while the worker was not subscribed are lost: _lost runs when the subscription
+    breaks or is stopped, and the task subscribes again a second later.
+    If tick is set, _tick runs every tick seconds while subscribed.
+    """
+    channel: str
+    tick: Optional[float] = None
+    _listener: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        self._lost()
+
+    async def _subscribed(self, client: redis.Redis) -> None:
+        """Runs once the channel is subscribed, so nothing published from now on is missed"""
+
+    def _received(self, data: bytes) -> None:
+        """Handles the data of a message"""
+
+    def _lost(self) -> None:
+        """Runs when the subscription broke or was stopped"""
+
+    async def _tick(self, client: redis.Redis) -> None:
+        """Runs every tick seconds while subscribed"""
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async with self._redis() as client, client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    await self._subscribed(client)
+
+                    tick_at = time.monotonic() + self.tick if self.tick is not None else None
+                    while True:
+                        timeout = max(tick_at - time.monotonic(), 0) if tick_at is not None else None
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+                        if message is not None and message["type"] == "message":
+                            self._received(message["data"])
+
+                        if tick_at is not None and time.monotonic() >= tick_at:
+                            await self._tick(client)
+                            tick_at = time.monotonic() + self.tick
+            except (RedisError, OSError, ValueError) as e:
+                logging.error(e)
+                self._lost()
+                await asyncio.sleep(1)
+
+    @staticmethod
+    def _redis() -> redis.Redis:
+        return redis.Redis(connection_pool=redis_pool)
@@ -0,0 +1,143 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, NamedTuple, Optional
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+from svitlogram.services.metrics import register_collector
+from svitlogram.services.subscriber import ChannelSubscriber
+from config import settings
+
+
+class CachedTag(NamedTuple):
+    id: int
+    name: str
+    created_at: datetime
+    updated_at: Optional[datetime]
+
+
+class TagCache(ChannelSubscriber):
+    """
+    Process-local LRU of tags by name.
+
+    Every worker keeps its own copy for ttl seconds at most, renamed and removed tags are announced on a Redis
+    channel so the other workers drop them too. Until the listener is subscribed to the channel the cache is
+    bypassed, it could miss the announcements. Tags read before a discard are not stored, they may be older than it.
+    """
+    channel = "tags:invalidate"
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._tags: OrderedDict[str, tuple[float, CachedTag]] = OrderedDict()
+        self._ready = False
+
+    def get_many(self, names: Iterable[str]) -> tuple[list[CachedTag], list[str]]:
+        """
+        The get_many function looks the names up in the cache.
+
+        :param names: Iterable[str]: Tag names
+        :return: The cached tags and the names that are not cached
+        """
+        found, missing = [], []
+        now = time.monotonic()
+        for name in names:
+            entry = self._tags.get(name) if self._ready else None
+            if entry is None or entry[0] < now:
+                self._tags.pop(name, None)
+                missing.append(name)
+                continue
+            self._tags.move_to_end(name)
+            found.append(entry[1])
+
+        self.hits += len(found)
+        self.misses += len(missing)
+
+        return found, missing
+
+    def put_many(self, tags: Iterable[CachedTag], generation: Optional[int] = None) -> None:
+        """
+        The put_many function stores the tags, evicting the least recently used ones above maxsize.
+
+        :param tags: Iterable[CachedTag]: Tags read from or written to the database
+        :param generation: Optional[int]: The generation the tags were read in, they are not stored
+            if tags were discarded since
+        :return: None
+        """
+        if not self._ready or generation is not None and generation != self.generation:
+            return
+
+        expires_at = time.monotonic() + self.ttl
+        for tag in tags:
+            self._tags[tag.name] = (expires_at, tag)
+            self._tags.move_to_end(tag.name)
+
+        while len(self._tags) > self.maxsize:
+            self._tags.popitem(last=False)
+
+    def discard(self, names: Iterable[str]) -> None:
+        """
+        The discard function drops the names from this worker's cache.
+
+        :param names: Iterable[str]: Tag names
+        :return: None
+        """
+        self.generation += 1
+        for name in names:
+            self._tags.pop(name, None)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._tags.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "ready": self._ready,
+            "size": len(self._tags),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+    async def invalidate(self, names: Iterable[str]) -> None:
+        """
+        The invalidate function drops the names locally and announces them to the other workers.
+        A failed announcement is logged and does not fail the request, the tag has already been changed.
+
+        :param names: Iterable[str]: Names of renamed or removed tags
+        :return: None
+        """
+        names = list(names)
+        self.discard(names)
+
+        try:
+            async with self._redis() as client:
+                await client.publish(self.channel, json.dumps(names))
+        except (RedisError, OSError) as e:
+            logging.error(e)
+
+    async def _subscribed(self, client: redis.Redis) -> None:
+        self.clear()
+        self._ready = True
+
+    def _received(self, data: bytes) -> None:
+        self.discard(json.loads(data))
+
+    def _lost(self) -> None:
+        self._ready = False
+        self.clear()
+
+
+tag_cache = TagCache(maxsize=settings.tag_cache_size, ttl=settings.tag_cache_ttl)
+
+register_collector("tag_cache", tag_cache.stats)
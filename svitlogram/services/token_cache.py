@@ -0,0 +1,85 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from svitlogram.services.metrics import register_collector
+from config import settings
+
+
+class TokenCache:
+    """
+    Process-local LRU of decoded access tokens, so a token sent again skips the signature check and JSON parsing.
+
+    Entries are keyed by the SHA-256 of the token, the tokens themselves are not kept,
+    and expire with the token. Only verified payloads are stored. A cached payload says nothing
+    about revocation, which is checked on every request.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._payloads: OrderedDict[bytes, dict] = OrderedDict()
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        """
+        The get function returns the payload of a token decoded before.
+
+        :param token: str: The encoded token
+        :return: The payload, not to be modified, or None if it is not cached or the token has expired
+        """
+        key = self.digest(token)
+        payload = self._payloads.get(key)
+        if payload is None or payload["exp"] <= time.time():
+            self._payloads.pop(key, None)
+            self.misses += 1
+            return None
+
+        self._payloads.move_to_end(key)
+        self.hits += 1
+
+        return payload
+
+    def put(self, token: str, payload: dict) -> None:
+        """
+        The put function stores the payload of a verified token, evicting the least recently used ones above maxsize.
+
+        :param token: str: The encoded token
+        :param payload: dict: Its verified payload, with an exp claim
+        :return: None
+        """
+        if self.maxsize <= 0:
+            return
+
+        key = self.digest(token)
+        self._payloads[key] = payload
+        self._payloads.move_to_end(key)
+
+        while len(self._payloads) > self.maxsize:
+            self._payloads.popitem(last=False)
+
+    def discard(self, token: str) -> None:
+        self._payloads.pop(self.digest(token), None)
+
+    def clear(self) -> None:
+        self._payloads.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._payloads),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+token_cache = TokenCache(maxsize=settings.token_cache_size)
+
+register_collector("token_cache", token_cache.stats)
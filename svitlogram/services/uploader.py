@@ -0,0 +1,183 @@
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import BinaryIO, Callable, Optional
+
+import httpx
+from fastapi import HTTPException, status
+
+from svitlogram.services.metrics import register_collector
+from config import settings
+
+
+class Uploader:
+    """
+    Sends files to the storage without the default executor of the event loop, which QR codes and other
+    blocking calls need.
+
+    Requests to an HTTP API share a pool of keep-alive connections. Blocking work, such as writing a file to disk,
+    runs in threads of the uploader's own. At most concurrency uploads run at a time, the others wait for a slot,
+    and above max_pending running or waiting uploads the new ones are rejected with 503.
+    Requests that time out, fail to connect or get 429 or 5xx are retried after a random delay
+    of up to backoff * 2 ** attempt seconds.
+    """
+
+    def __init__(self, concurrency: int, max_pending: int, timeout: float, retries: int, backoff: float) -> None:
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        self.pending = 0
+        self.queued = 0
+        self.peak_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+        self.seconds = 0.0
+        self.wait_seconds = 0.0
+
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def post(self, url: str, data: dict, file: Optional[BinaryIO] = None) -> dict:
+        """
+        The post function sends a form, with the file if one is given, and returns the JSON of the response.
+
+        :param url: str: The endpoint of the API
+        :param data: dict: The fields of the form
+        :param file: Optional[BinaryIO]: The file to send, from its start on every attempt
+        :return: The decoded response, also when its status is an error that is not retried
+        :raises HTTPException: 503 if too many uploads are pending or the API is still unavailable after the retries
+        """
+        async with self._slot():
+            return await self._post(url, data, file)
+
+    async def run(self, function: Callable, *args):
+        """
+        The run function calls a blocking function in the threads of the uploader.
+
+        :param function: Callable: The function to call
+        :param args: The arguments of the function
+        :return: What the function returns
+        :raises HTTPException: 503 if too many uploads are pending
+        """
+        async with self._slot():
+            return await asyncio.get_running_loop().run_in_executor(self._pool(), function, *args)
+
+    @asynccontextmanager
+    async def _slot(self):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many uploads in progress, try again later",
+                headers={"Retry-After": "1"},
+            )
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+
+        self.pending += 1
+        self.queued += 1
+        self.peak_queued = max(self.peak_queued, self.queued)
+        start = time.perf_counter()
+        try:
+            try:
+                await self._slots.acquire()
+            finally:
+                self.queued -= 1
+
+            self.wait_seconds += time.perf_counter() - start
+            try:
+                yield
+            except BaseException:
+                self.failed += 1
+                raise
+            else:
+                self.completed += 1
+            finally:
+                self._slots.release()
+                self.seconds += time.perf_counter() - start
+        finally:
+            self.pending -= 1
+
+    async def _post(self, url: str, data: dict, file: Optional[BinaryIO]) -> dict:
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retried += 1
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+
+            # httpx rewinds the file before sending it
+            try:
+                response = await self._http().post(
+                    url, data=data, files={"file": ("file", file)} if file is not None else None
+                )
+            except httpx.TransportError:
+                continue
+
+            if response.status_code != status.HTTP_429_TOO_MANY_REQUESTS and response.status_code < 500:
+                return response.json()
+
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The storage is unavailable, try again later",
+            headers={"Retry-After": "5"},
+        )
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            )
+
+        return self._client
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="uploader")
+
+        return self._executor
+
+    def stats(self) -> dict:
+        finished = self.completed + self.failed
+        return {
+            "concurrency": self.concurrency,
+            "pending": self.pending,
+            "queued": self.queued,
+            "peak_queued": self.peak_queued,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.wait_seconds / finished * 1000, 1) if finished else None,
+            "avg_ms": round(self.seconds / finished * 1000, 1) if finished else None,
+        }
+
+    async def stop(self) -> None:
+        # The connections belong to the event loop that is closing
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._slots = None
+
+
+uploader = Uploader(
+    concurrency=settings.upload_concurrency,
+    max_pending=settings.upload_max_pending,
+    timeout=settings.upload_timeout,
+    retries=settings.upload_retries,
+    backoff=settings.upload_backoff,
+)
+
+register_collector("uploader", uploader.stats)
@@ -0,0 +1,326 @@
+import asyncio
+import logging
+import shutil
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Optional
+from uuid import uuid4
+
+import redis.asyncio as redis
+from fastapi import HTTPException, status
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from strenum import StrEnum
+
+from svitlogram.database.connect import redis_pool
+from svitlogram.database.models import Image
+from svitlogram.repository import images as repository_images
+from svitlogram.services import storage
+from svitlogram.services.ingest import IngestedFile
+from svitlogram.services.metrics import register_collector
+from svitlogram.services.uploader import uploader
+from config import settings
+
+
+async def store_image(ingested: IngestedFile, user_id: int, description: str, tags: list[str],
+                      db: AsyncSession) -> Image:
+    """
+    The store_image function uploads a checked file, unless a file with the same content is stored already,
+    and creates the image.
+
+    :param ingested: IngestedFile: The file with its media type, size and hash
+    :param user_id: int: The user who uploads the image
+    :param description: str: The description of the image
+    :param tags: list[str]: The names of the tags of the image
+    :param db: AsyncSession: Pass in the database session
+    :return: The new image
+    :raises HTTPException: 422 if the storage rejected the file, 503 if the storage is unavailable
+    """
+    public_id = await repository_images.acquire_file(ingested.sha256, storage.backend.name, db)
+    deduplicated = public_id is not None
+    uploaded = None
+
+    try:
+        if not deduplicated:
+            uploaded = await storage.backend.upload(ingested.file, content_type=ingested.content_type)
+
+            if uploaded is None:
+                raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid image file")
+
+            public_id = await repository_images.add_file(ingested.sha256, storage.backend.name,
+                                                         uploaded['public_id'], db)
+            if public_id != uploaded['public_id']:
+                # The same content was uploaded by another request at the same time
+                await storage.backend.remove(uploaded['public_id'])
+                uploaded = None
+            elif not await storage.backend.exists(public_id):
+                # The file was removed with the last image of the same content before the content was locked
+                ingested.file.seek(0)
+                await storage.backend.upload(ingested.file, content_type=ingested.content_type)
+
+        image = await repository_images.create_image(user_id, description, tags, public_id, db,
+                                                     content_hash=ingested.sha256)
+    except BaseException:
+        # Nothing was committed, the reference to the file goes with the transaction and the file uploaded for it
+        # is removed, unless a concurrent upload of the same content references it by now
+        await db.rollback()
+        if uploaded is not None:
+            await remove_unused_file(ingested.sha256, uploaded['public_id'], db)
+        raise
+
+    storage.upload_stats.record(ingested.size, deduplicated)
+
+    return image
+
+
+async def remove_unused_file(content_hash: Optional[str], public_id: str, db: AsyncSession) -> bool:
+    """
+    The remove_unused_file function removes a file from the storage if no image references it.
+    The content stays locked until the file is removed, an upload of the same content waits for it.
+
+    :param content_hash: Optional[str]: The SHA-256 of the content
+    :param public_id: str: The public id of the file
+    :param db: AsyncSession: Pass in the database session
+    :return: True if the file was removed
+    """
+    removed = False
+    try:
+        if await repository_images.is_file_unused(content_hash, public_id, db):
+            removed = await storage.backend.remove(public_id)
+    finally:
+        await db.commit()
+
+    return removed
+
+
+class UploadJobStatus(StrEnum):
+    QUEUED = 'queued'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+@dataclass(frozen=True, slots=True)
+class UploadJob:
+    id: str
+    user_id: int
+    description: str
+    tags: list[str]
+    content_type: str
+    size: int
+    sha256: str
+    path: Path
+    session_factory: async_sessionmaker
+    created: float
+
+
+class UploadJobs:
+    """
+    Stores uploaded images after the response was sent.
+
+    The route checks the file, copies it to the spool directory and answers 202 with the id of the job.
+    A pool of tasks of the same worker uploads the file and creates the image. The state of a job is kept
+    in Redis for ttl seconds, so whichever worker gets the status call can answer it. Clients that wait for
+    a job are answered by reading the state every poll_interval seconds. At most max_pending jobs are queued,
+    the uploads above that are rejected with 503.
+    """
+
+    def __init__(self, spool_dir: str | Path, workers: int, max_pending: int, ttl: int,
+                 poll_interval: float = 0.25) -> None:
+        self.spool_dir = Path(spool_dir)
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.running = 0
+        self.seconds = 0.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list[asyncio.Task] = []
+
+    @staticmethod
+    def key(job_id: str) -> str:
+        return f"upload-job:{job_id}"
+
+    async def submit(self, ingested: IngestedFile, user_id: int, description: str, tags: list[str],
+                     session_factory: async_sessionmaker) -> str:
+        """
+        The submit function spools the checked file and queues the job that stores it.
+
+        :param ingested: IngestedFile: The file with its media type, size and hash
+        :param user_id: int: The user who uploads the image
+        :param description: str: The description of the image
+        :param tags: list[str]: The names of the tags of the image
+        :param session_factory: async_sessionmaker: Opens the database session of the job
+        :return: The id of the job
+        :raises HTTPException: 503 if too many jobs are queued
+        """
+        if self._queue is None or self._queue.qsize() >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many uploads in progress, try again later",
+                headers={"Retry-After": "5"},
+            )
+
+        job_id = uuid4().hex
+        job = UploadJob(
+            id=job_id, user_id=user_id, description=description, tags=tags, content_type=ingested.content_type,
+            size=ingested.size, sha256=ingested.sha256, path=self.spool_dir / job_id,
+            session_factory=session_factory, created=time.perf_counter(),
+        )
+
+        await uploader.run(self._spool, ingested.file, job.path)
+        await self._save(job_id, status=UploadJobStatus.QUEUED, user_id=user_id)
+
+        self._queue.put_nowait(job)
+        self.submitted += 1
+
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        """
+        The get function returns the state of a job.
+
+        :param job_id: str: The id of the job
+        :return: The status, the user, the id of the image when it is done and the reason when it failed,
+            None if there is no such job or it expired
+        """
+        async with self._redis() as client:
+            state = await client.hgetall(self.key(job_id))
+
+        if not state:
+            return None
+
+        state = {field.decode(): value.decode() for field, value in state.items()}
+        return {
+            "job_id": job_id,
+            "status": UploadJobStatus(state["status"]),
+            "user_id": int(state["user_id"]),
+            "image_id": int(state["image_id"]) if "image_id" in state else None,
+            "detail": state.get("detail"),
+        }
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        """
+        The wait function returns the state of a job once it is done or failed, or after timeout seconds.
+        The state is read every poll_interval seconds, a waiting client holds no connection of the shared Redis pool
+        between the reads.
+
+        :param job_id: str: The id of the job
+        :param timeout: float: The longest time to wait in seconds
+        :return: The state of the job, None if there is no such job
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        job = await self.get(job_id)
+        while job is not None and job["status"] in (UploadJobStatus.QUEUED, UploadJobStatus.PROCESSING):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(self.poll_interval, remaining))
+            job = await self.get(job_id)
+
+        return job
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: UploadJob) -> None:
+        self.running += 1
+        try:
+            await self._save(job.id, status=UploadJobStatus.PROCESSING)
+
+            with open(job.path, "rb") as file:
+                ingested = IngestedFile(file=file, content_type=job.content_type, size=job.size, sha256=job.sha256)
+                async with job.session_factory() as db:
+                    image = await store_image(ingested, job.user_id, job.description, job.tags, db)
+        except HTTPException as e:
+            await self._fail(job, e.detail)
+        except asyncio.CancelledError:
+            await self._fail(job, "The server stopped before the image was stored, upload it again")
+            raise
+        except Exception as e:  # noqa
+            logging.exception(e)
+            await self._fail(job, "The image could not be stored")
+        else:
+            self.completed += 1
+            await self._save(job.id, status=UploadJobStatus.DONE, image_id=image.id)
+        finally:
+            self.running -= 1
+            self.seconds += time.perf_counter() - job.created
+            job.path.unlink(missing_ok=True)
+
+    async def _fail(self, job: UploadJob, detail: str) -> None:
+        self.failed += 1
+        await self._save(job.id, status=UploadJobStatus.FAILED, detail=detail)
+
+    async def _save(self, job_id: str, **state) -> None:
+        key = self.key(job_id)
+        try:
+            async with self._redis() as client, client.pipeline(transaction=True) as pipe:
+                pipe.hset(key, mapping=state).expire(key, self.ttl)
+                await pipe.execute()
+        except (RedisError, OSError) as e:
+            logging.error(e)
+
+    @staticmethod
+    def _spool(file: BinaryIO, path: Path) -> None:
+        with open(path, "wb") as spooled:
+            shutil.copyfileobj(file, spooled, 1024 * 1024)
+
+    def stats(self) -> dict:
+        finished = self.completed + self.failed
+        return {
+            "workers": len(self._tasks),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": self.running,
+            "max_pending": self.max_pending,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_ms": round(self.seconds / finished * 1000, 1) if finished else None,
+        }
+
+    @staticmethod
+    def _redis() -> redis.Redis:
+        return redis.Redis(connection_pool=redis_pool)
+
+    async def start(self) -> None:
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        # The tasks belong to the event loop that is closing, the jobs still queued are given up
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        while self._queue is not None and not self._queue.empty():
+            job = self._queue.get_nowait()
+            await self._fail(job, "The server stopped before the image was stored, upload it again")
+            job.path.unlink(missing_ok=True)
+        self._queue = None
+
+
+upload_jobs = UploadJobs(
+    spool_dir=settings.upload_spool_dir,
+    workers=settings.upload_job_workers,
+    max_pending=settings.upload_job_max_pending,
+    ttl=settings.upload_job_ttl,
+)
+
+register_collector("upload_jobs", upload_jobs.stats)
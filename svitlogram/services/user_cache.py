@@ -0,0 +1,227 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, astuple
+from datetime import datetime
+from typing import Iterable, Optional
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+from svitlogram.database.models import User, UserRole
+from svitlogram.services.metrics import register_collector
+from svitlogram.services.subscriber import ChannelSubscriber
+from config import settings
+
+
+@dataclass(frozen=True, slots=True)
+class CachedUser:
+    """
+    Read-only snapshot of the columns of a user that authenticated requests need.
+    """
+    id: int
+    username: str
+    email: str
+    password: str
+    first_name: str
+    last_name: str
+    avatar: Optional[str]
+    role: UserRole
+    email_verified: bool
+    is_active: bool
+    created_at: datetime
+    updated_at: Optional[datetime]
+
+    @classmethod
+    def from_user(cls, user: User) -> "CachedUser":
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            password=user.password,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            avatar=user.avatar,
+            role=UserRole(user.role),
+            email_verified=user.email_verified,
+            is_active=user.is_active,
+            created_at=user.created_at,
+            updated_at=user.updated_at,
+        )
+
+    def dumps(self) -> bytes:
+        """
+        The dumps function serializes the snapshot as a JSON array of the field values.
+
+        :return: The serialized snapshot
+        """
+        return json.dumps(astuple(self), default=datetime.isoformat, separators=(",", ":")).encode()
+
+    @classmethod
+    def loads(cls, data: bytes) -> "CachedUser":
+        """
+        The loads function restores a snapshot serialized by dumps.
+
+        :param data: bytes: The serialized snapshot
+        :return: The snapshot
+        :raises ValueError: If the data was not created by dumps
+        """
+        try:
+            (user_id, username, email, password, first_name, last_name, avatar, role, email_verified,
+             is_active, created_at, updated_at) = json.loads(data)
+
+            return cls(
+                user_id, username, email, password, first_name, last_name, avatar, UserRole(role), email_verified,
+                is_active, datetime.fromisoformat(created_at), updated_at and datetime.fromisoformat(updated_at)
+            )
+        except (TypeError, ValueError) as e:
+            raise ValueError("Invalid cached user") from e
+
+
+class UserCache(ChannelSubscriber):
+    """
+    Process-local LRU of authenticated users by email, in front of the snapshots kept in Redis.
+
+    Entries live for ttl seconds. Changed users are announced on a Redis channel,
+    every worker drops them at once instead of serving them until they expire.
+    Every change also bumps the version of the user in Redis. A snapshot read from the database is only
+    written back if the version is the one read before, so a request that raced the change does not
+    cache the user as it was before it.
+    """
+    channel = "users:invalidate"
+    version_ttl = 24 * 60 * 60
+
+    # Sets KEYS[1] to ARGV[1] for ARGV[3] seconds if the version in KEYS[2] is still ARGV[2], '' for none
+    set_if_version = """
+    if (redis.call('GET', KEYS[2]) or '') == ARGV[2] then
+        return redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+    end
+    return false
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._users: OrderedDict[str, tuple[float, CachedUser]] = OrderedDict()
+
+    @staticmethod
+    def key(email: str) -> str:
+        """
+        The key function returns the Redis key of the snapshot of a user.
+
+        :param email: str: The email of the user
+        :return: The Redis key
+        """
+        return f"current-user:{email}"
+
+    @staticmethod
+    def version_key(email: str) -> str:
+        """
+        The version_key function returns the Redis key of the version of a user, bumped on every change.
+
+        :param email: str: The email of the user
+        :return: The Redis key
+        """
+        return f"current-user-version:{email}"
+
+    def get(self, email: str) -> Optional[CachedUser]:
+        """
+        The get function looks the user up in this worker's cache.
+
+        :param email: str: The email of the user
+        :return: The snapshot of the user or None if it is not cached or has expired
+        """
+        entry = self._users.get(email)
+        if entry is None or entry[0] < time.monotonic():
+            self._users.pop(email, None)
+            self.misses += 1
+            return None
+
+        self._users.move_to_end(email)
+        self.hits += 1
+
+        return entry[1]
+
+    def put(self, user: CachedUser, generation: Optional[int] = None) -> None:
+        """
+        The put function stores the snapshot, evicting the least recently used ones above maxsize.
+
+        :param user: CachedUser: The snapshot of the user
+        :param generation: Optional[int]: The generation the snapshot was read in, it is not stored
+            if users were discarded since
+        :return: None
+        """
+        if generation is not None and generation != self.generation:
+            return
+
+        self._users[user.email] = (time.monotonic() + self.ttl, user)
+        self._users.move_to_end(user.email)
+
+        while len(self._users) > self.maxsize:
+            self._users.popitem(last=False)
+
+    def discard(self, emails: Iterable[str]) -> None:
+        """
+        The discard function drops the users from this worker's cache.
+
+        :param emails: Iterable[str]: Emails of the users
+        :return: None
+        """
+        self.generation += 1
+        for email in emails:
+            self._users.pop(email, None)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._users.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._users),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+    async def invalidate(self, emails: Iterable[str]) -> None:
+        """
+        The invalidate function drops the users locally, deletes their snapshots from Redis, bumps their versions
+        and announces them to the other workers, all in one round trip.
+        A failure is logged and does not fail the request, the user has already been changed.
+
+        :param emails: Iterable[str]: Emails of the changed users
+        :return: None
+        """
+        emails = [email for email in emails if email]
+        if not emails:
+            return
+        self.discard(emails)
+
+        try:
+            async with self._redis() as client, client.pipeline(transaction=False) as pipe:
+                for email in emails:
+                    pipe.incr(self.version_key(email)).expire(self.version_key(email), self.version_ttl)
+                await pipe.delete(*map(self.key, emails)).publish(self.channel, json.dumps(emails)).execute()
+        except (RedisError, OSError) as e:
+            logging.error(e)
+
+    async def _subscribed(self, client: redis.Redis) -> None:
+        self.clear()
+
+    def _received(self, data: bytes) -> None:
+        self.discard(json.loads(data))
+
+    def _lost(self) -> None:
+        self.clear()
+
+
+user_cache = UserCache(maxsize=settings.user_cache_size, ttl=settings.user_cache_ttl)
+
+register_collector("user_cache", user_cache.stats)
@@ -0,0 +1,40 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any
+
+
+def encode_cursor(*values: Any) -> str:
+    """
+    The encode_cursor function packs the sort key of the last returned row into an opaque string.
+    Datetime values are stored in ISO format, everything else must be JSON serializable.
+
+    :param values: Any: The values of the sort key, in the order they are compared
+    :return: A url-safe string that can be handed back to the client
+    """
+    raw = json.dumps(
+        values,
+        separators=(',', ':'),
+        default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value)
+    )
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> list[Any]:
+    """
+    The decode_cursor function unpacks a cursor created by encode_cursor.
+
+    :param cursor: str: The cursor received from the client
+    :return: The list of sort key values
+    :raises ValueError: If the cursor is malformed
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+
+    return values
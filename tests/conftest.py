@@ -1,12 +1,19 @@
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import DatabaseError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
 
 from main import app
 from svitlogram.database.models.base import Base
-from svitlogram.database.connect import get_db
+from svitlogram.database.connect import get_db, get_session_factory
+from svitlogram.services.tag_cache import tag_cache
+from svitlogram.services.user_cache import user_cache
+from svitlogram.services.login_throttle import login_throttle
+from svitlogram.services.read_cache import read_cache
 from config import settings
 
 DATABASE_URL = settings.DATABASE_URL_TEST
@@ -15,11 +22,17 @@ DATABASE_URL = settings.DATABASE_URL_TEST
 engine = create_engine(DATABASE_URL)
 TestingSessionLocal = sessionmaker(bind=engine)
 
+# Every test module runs its TestClient in an event loop of its own, asyncpg connections must not outlive it
+async_engine = create_async_engine(make_url(DATABASE_URL).set(drivername="postgresql+asyncpg"), poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
 
 @pytest.fixture(scope="module")
 def session():
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
+    tag_cache.clear()
+    user_cache.clear()
 
     db = TestingSessionLocal()
     try:
@@ -32,15 +45,20 @@ def session():
 
 @pytest.fixture(scope="module")
 def client(session):
-    def override_get_db():
-        try:
-            yield session
-        finally:
-            session.close()
+    async def override_get_db():
+        async with TestingAsyncSessionLocal() as db:
+            yield db
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_session_factory] = lambda: TestingAsyncSessionLocal
 
-    yield TestClient(app)
+    # Runs startup and shutdown, so the shared Redis pool is closed before the next module's event loop
+    with TestClient(app) as client:
+        # Failed logins of earlier runs must not throttle this one
+        client.portal.call(login_throttle.clear)
+        # Rows cached in Redis by earlier modules are gone with the schema
+        client.portal.call(read_cache.clear)
+        yield client
 
 
 @pytest.fixture(scope="module")
@@ -1,24 +1,26 @@
 import unittest
 
 from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql
 
+import svitlogram.repository.images
 import svitlogram.repository.tags
 from unittest.mock import MagicMock, patch, mock_open
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import Session
 from svitlogram.database.models import Image, Tag, ImageRating
 from svitlogram.repository.images import (
     get_image_by_id,
-    create_image, delete_image, update_description, get_images, SortMode,
+    create_image, delete_image, update_description, acquire_file, is_file_unused, get_images, SortMode, TagMatch, search_images,
 )
 from svitlogram.repository.tags import get_or_create_tags
+from svitlogram.utils.cursor import encode_cursor, decode_cursor
 
 
 class TestImages(unittest.IsolatedAsyncioTestCase):
 
     def setUp(self):
         # Set up the test database session
-        self.session = MagicMock(spec=Session)
+        self.session = MagicMock(spec=AsyncSession)
         self.id = 1
         self.tags = ['tag1', 'tag2']
         self.description = "some text for test"
@@ -40,6 +42,9 @@ class TestImages(unittest.IsolatedAsyncioTestCase):
             public_id=self.public_id,
             tags=[Tag(name='tag1'), Tag(name='tag2')]
         )
+        mock_scalars = MagicMock()
+        mock_scalars.all.return_value = []
+        self.session.scalars.return_value = mock_scalars
 
         result = await create_image(self.user_id, self.description, tags, self.public_id, self.session)
         if self.tags:
@@ -54,12 +59,56 @@ class TestImages(unittest.IsolatedAsyncioTestCase):
 
     async def test_delete_image(self):
         image = Image()
-        self.session.query(Image).filter_by().first.return_value = image
 
-        await delete_image(image, self.session)
+        self.assertTrue(await delete_image(image, self.session))
 
         self.session.delete.assert_called_once_with(image)
         self.session.commit.assert_called_once()
+        self.session.scalar.assert_not_called()
+
+    async def test_delete_image_with_shared_file(self):
+        image = Image(public_id=self.public_id, content_hash="a" * 64)
+        self.session.scalar.return_value = 1
+
+        self.assertFalse(await delete_image(image, self.session))
+
+        self.session.execute.assert_not_called()
+        self.session.delete.assert_called_once_with(image)
+        self.session.commit.assert_called_once()
+
+    async def test_delete_image_last_reference(self):
+        image = Image(public_id=self.public_id, content_hash="a" * 64)
+        self.session.scalar.return_value = 0
+
+        self.assertTrue(await delete_image(image, self.session))
+
+        self.assertIn("DELETE FROM image_files", str(self.session.execute.call_args.args[0]))
+        self.session.commit.assert_called_once()
+
+    async def test_acquire_file(self):
+        self.session.scalar.return_value = self.public_id
+
+        self.assertEqual(self.public_id, await acquire_file("a" * 64, "local", self.session))
+        self.session.commit.assert_not_called()
+
+    async def test_acquire_file_not_stored(self):
+        self.session.scalar.return_value = None
+
+        self.assertIsNone(await acquire_file("a" * 64, "local", self.session))
+        self.session.commit.assert_called_once()
+
+    async def test_is_file_unused(self):
+        self.session.scalar.return_value = None
+
+        self.assertTrue(await is_file_unused("a" * 64, self.public_id, self.session))
+        self.assertIn("pg_advisory_xact_lock", str(self.session.execute.call_args.args[0]))
+
+        self.session.scalar.return_value = 3
+        self.assertFalse(await is_file_unused("a" * 64, self.public_id, self.session))
+
+    async def test_is_file_unused_without_hash(self):
+        self.assertTrue(await is_file_unused(None, self.public_id, self.session))
+        self.session.execute.assert_not_called()
 
     async def test_update_description(self):
         image = Image(
@@ -69,6 +118,9 @@ class TestImages(unittest.IsolatedAsyncioTestCase):
             public_id=self.public_id,
             tags=[Tag(name='tag1'), Tag(name='tag2')])
         self.session.scalar.return_value = image
+        mock_scalars = MagicMock()
+        mock_scalars.all.return_value = []
+        self.session.scalars.return_value = mock_scalars
 
         new_description = "Some text for test_2"
         new_tags = ['tag_nest', 'tag_test']
@@ -84,3 +136,101 @@ class TestImages(unittest.IsolatedAsyncioTestCase):
 
     def test_get_images(self, subquery=None):
         pass
+
+    async def test_get_images_next_cursor(self):
+        images = [Image(id=image_id) for image_id in (1, 2, 3)]
+        mock_result = MagicMock()
+        mock_result.unique.return_value.all.return_value = [(image, image.id) for image in images]
+        self.session.execute.return_value = mock_result
+
+        result, next_cursor = await get_images(0, 2, None, None, None, None, SortMode.NOT_SORT, self.session)
+
+        self.assertEqual(images[:2], result)
+        self.assertEqual([SortMode.NOT_SORT.value, 2, 2], decode_cursor(next_cursor))
+
+    async def test_get_images_last_page(self):
+        images = [Image(id=image_id) for image_id in (4, 5)]
+        mock_result = MagicMock()
+        mock_result.unique.return_value.all.return_value = [(image, image.id) for image in images]
+        self.session.execute.return_value = mock_result
+        cursor = encode_cursor(SortMode.NOT_SORT.value, 3, 3)
+
+        result, next_cursor = await get_images(0, 2, None, None, None, None, SortMode.NOT_SORT, self.session, cursor)
+
+        self.assertEqual(images, result)
+        self.assertIsNone(next_cursor)
+
+    async def test_get_images_cursor_for_another_sort_mode(self):
+        cursor = encode_cursor(SortMode.DATE.value, "2023-06-13T19:06:07", 3)
+
+        with self.assertRaises(ValueError):
+            await get_images(0, 2, None, None, None, None, SortMode.NOT_SORT, self.session, cursor)
+
+        self.session.execute.assert_not_called()
+
+    async def test_get_images_exact_tags(self):
+        mock_result = MagicMock()
+        mock_result.unique.return_value.all.return_value = []
+        self.session.execute.return_value = mock_result
+
+        with patch.object(svitlogram.repository.images, "get_tag_ids", return_value=[3, 5]) as mock_get_tag_ids:
+            await get_images(0, 2, None, ["tag1", "tag2"], None, None, SortMode.NOT_SORT, self.session)
+
+        mock_get_tag_ids.assert_awaited_once()
+        query = str(self.session.execute.call_args.args[0])
+        self.assertIn("JOIN image_m2m_tag AS image_tag_1 ON image_tag_1.image_id = image_tag_0.image_id", query)
+        self.assertNotIn("image_tag_2", query)
+        self.assertNotIn("LIKE", query)
+
+    async def test_get_images_exact_tags_unknown_tag(self):
+        mock_result = MagicMock()
+        mock_result.unique.return_value.all.return_value = []
+        self.session.execute.return_value = mock_result
+
+        with patch.object(svitlogram.repository.images, "get_tag_ids", return_value=[3]):
+            result, next_cursor = await get_images(
+                0, 2, None, ["tag1", "unknown"], None, None, SortMode.NOT_SORT, self.session
+            )
+
+        self.assertEqual([], result)
+        self.assertIn("false", str(self.session.execute.call_args.args[0]))
+
+    async def test_get_images_fuzzy_tags(self):
+        mock_result = MagicMock()
+        mock_result.unique.return_value.all.return_value = []
+        self.session.execute.return_value = mock_result
+
+        with patch.object(svitlogram.repository.images, "get_tag_ids") as mock_get_tag_ids:
+            await get_images(
+                0, 2, None, ["tag1", "tag2"], None, None, SortMode.NOT_SORT, self.session, tag_match=TagMatch.FUZZY
+            )
+
+        mock_get_tag_ids.assert_not_called()
+        sql = str(self.session.execute.call_args.args[0].compile(dialect=postgresql.dialect()))
+        # Every tag is matched by an EXISTS over the tags of the image
+        self.assertEqual(2, sql.count("EXISTS (SELECT 1"))
+        self.assertEqual(2, sql.count("ILIKE"))
+        self.assertIn("image_m2m_tag", sql)
+
+    async def test_get_images_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            await get_images(0, 2, None, None, None, None, SortMode.DATE, self.session, "not-a-cursor")
+
+    async def test_search_images_next_cursor(self):
+        images = [Image(id=image_id) for image_id in (9, 7, 8)]
+        mock_result = MagicMock()
+        mock_result.unique.return_value.all.return_value = list(zip(images, (0.5, 0.25, 0.25)))
+        self.session.execute.return_value = mock_result
+
+        result, next_cursor = await search_images("cat", 2, self.session)
+
+        self.assertEqual(images[:2], result)
+        self.assertEqual(["search", 0.25, 7], decode_cursor(next_cursor))
+
+    async def test_search_images_cursor_from_listing(self):
+        cursor = encode_cursor(SortMode.DATE.value, "2023-06-13T19:06:07", 3)
+
+        with self.assertRaises(ValueError):
+            await search_images("cat", 2, self.session, cursor)
+
+        self.session.execute.assert_not_called()
@@ -1,7 +1,7 @@
 import unittest
 from unittest.mock import MagicMock
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
 from svitlogram.database.models import ImageComment
@@ -11,7 +11,7 @@ from svitlogram.repository.comments import create_comment, get_comments_by_image
 class TestComments(unittest.IsolatedAsyncioTestCase):
 
     def setUp(self):
-        self.session = MagicMock(spec=Session)
+        self.session = MagicMock(spec=AsyncSession)
         self.comment = MagicMock(spec=ImageComment)
         self.comment_test = ImageComment(
             id=1,
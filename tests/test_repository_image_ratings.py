@@ -1,7 +1,7 @@
 import unittest
 from unittest.mock import MagicMock, call
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from svitlogram.database.models import ImageRating
 from svitlogram.repository.image_ratings import (
@@ -11,13 +11,13 @@ from svitlogram.repository.image_ratings import (
     get_rating_by_image_id_and_user,
     remove_rating,
     update_rating,
-    get_image_rating,
+    recalculate_image_ratings,
 )
 
 
 class TestImageRatings(unittest.IsolatedAsyncioTestCase):
     def setUp(self):
-        self.session = MagicMock(spec=Session)
+        self.session = MagicMock(spec=AsyncSession)
         self.rating = MagicMock(spec=ImageRating)
         self.rating_test = ImageRating(
             id=1,
@@ -47,6 +47,8 @@ class TestImageRatings(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(result.image_id, rating.image_id)
         self.assertEqual(result.rating, rating.rating)
         self.assertTrue(hasattr(result, "id"))
+        self.session.execute.assert_called_once()
+        self.session.commit.assert_called_once()
 
     async def test_get_all_image_ratings(self):
         ratings = [self.rating_test, self.rating_test2]
@@ -94,28 +96,48 @@ class TestImageRatings(unittest.IsolatedAsyncioTestCase):
 
     async def test_remove_rating(self):
         rating = self.rating_test
+        self.session.scalar.return_value = 2
 
         await remove_rating(rating=rating, db=self.session)
 
         self.session.delete.assert_called_once_with(rating)
-        self.assertEqual(self.session.commit.call_count, 2)
+        self.assertEqual(-2, self.session.execute.call_args.args[0].compile().params["ratings_sum_1"])
+        self.session.commit.assert_called_once()
+
+    async def test_remove_rating_removed_meanwhile(self):
+        self.session.scalar.return_value = None
+
+        await remove_rating(rating=self.rating_test, db=self.session)
+
+        self.session.delete.assert_not_called()
+        self.session.execute.assert_not_called()
 
     async def test_update_rating(self):
         rating = self.rating_test
         new_rating = 4
-        self.session.query().filter().scalar.return_value = 4.5
+        # Another request changed the rating from 5 to 2 after it was loaded
+        self.session.scalar.return_value = 2
 
         result = await update_rating(rating=rating, new_rating=new_rating, db=self.session)
 
         self.assertEqual(result, rating)
         self.assertEqual(rating.rating, new_rating)
+        self.assertIn("FOR UPDATE", str(self.session.scalar.call_args.args[0]))
+        self.assertEqual(2, self.session.execute.call_args.args[0].compile().params["ratings_sum_1"])
+        self.session.commit.assert_called_once()
+
+    async def test_update_rating_removed_meanwhile(self):
+        self.session.scalar.return_value = None
+
+        self.assertIsNone(await update_rating(rating=self.rating_test, new_rating=4, db=self.session))
+        self.session.execute.assert_not_called()
+        self.session.commit.assert_not_called()
 
-    async def test_get_image_rating(self):
-        image = MagicMock()
-        average_rating = 4.5
-        self.session.query.return_value.filter.return_value.scalar.return_value = average_rating
+    async def test_recalculate_image_ratings(self):
+        self.session.execute.return_value = MagicMock(rowcount=3)
 
-        result = await get_image_rating(image=image, db=self.session)
+        result = await recalculate_image_ratings(db=self.session)
 
-        self.assertEqual(result, average_rating)
+        self.assertEqual(result, 3)
+        self.session.commit.assert_called_once()
 
@@ -1,21 +1,30 @@
 import unittest
-from unittest.mock import MagicMock
-from sqlalchemy.orm import Session
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+from sqlalchemy.ext.asyncio import AsyncSession
 from svitlogram.repository.tags import (
     get_tags,
     get_tags_by_list_values,
     get_tag_by_id,
     get_or_create_tags,
+    get_tag_ids,
     update_tag,
     remove_tag,
     get_list_tags
 )
 from svitlogram.database.models import Tag
 from svitlogram.schemas.tag import TagBase
+from svitlogram.services.tag_cache import tag_cache, CachedTag
 
 class TestTags(unittest.IsolatedAsyncioTestCase):
     def setUp(self):
-        self.session = MagicMock(spec=Session)
+        self.session = MagicMock(spec=AsyncSession)
+        tag_cache.clear()
+        tag_cache._ready = True
+        self.addCleanup(setattr, tag_cache, "_ready", False)
+        invalidate = patch.object(tag_cache, "invalidate")
+        self.invalidate = invalidate.start()
+        self.addCleanup(invalidate.stop)
 
     async def test_get_tags(self):
         expected = [Tag(name="some")]
@@ -51,12 +60,55 @@ class TestTags(unittest.IsolatedAsyncioTestCase):
         tag1 = Tag(name="some1")
         tag2 = Tag(name="some2")
 
+        created_scalars = MagicMock()
+        created_scalars.all.return_value = [tag2]
+        existing_scalars = MagicMock()
+        existing_scalars.all.return_value = [tag1]
+        self.session.scalars.side_effect = [created_scalars, existing_scalars]
+
+        tags = await get_or_create_tags(["some1", " some2 ", "some1"], self.session)
+        self.assertEqual([tag2.name, tag1.name], [tag.name for tag in tags])
+        self.assertEqual(self.session.scalars.call_count, 2)
+        self.session.commit.assert_not_called()
+        self.assertEqual(([], ["some2"]), tag_cache.get_many(["some2"]))
+
+    async def test_get_or_create_tags_all_new(self):
+        tag1 = Tag(name="some1")
+
+        created_scalars = MagicMock()
+        created_scalars.all.return_value = [tag1]
+        self.session.scalars.return_value = created_scalars
+
+        tags = await get_or_create_tags(["some1"], self.session)
+        self.assertEqual([tag1], tags)
+        self.session.scalars.assert_called_once()
+
+    async def test_get_or_create_tags_cached(self):
+        tag_cache.put_many([CachedTag(id=1, name="some1", created_at=datetime(2023, 6, 1), updated_at=None)])
+        self.session.merge.side_effect = lambda tag, load: tag
+
+        tags = await get_or_create_tags(["some1"], self.session)
+        self.assertEqual([(1, "some1")], [(tag.id, tag.name) for tag in tags])
+        self.session.scalars.assert_not_called()
+        self.session.merge.assert_called_once()
+
+    async def test_get_or_create_tags_empty(self):
+        tags = await get_or_create_tags([" ", ""], self.session)
+        self.assertEqual([], tags)
+        self.session.scalars.assert_not_called()
+
+    async def test_get_tag_ids(self):
+        tag_cache.put_many([CachedTag(id=1, name="cached", created_at=datetime.now(), updated_at=None)])
         mock_scalars = MagicMock()
-        mock_scalars.all.return_value = [tag1]
+        mock_scalars.all.return_value = [Tag(id=2, name="loaded", created_at=datetime.now())]
         self.session.scalars.return_value = mock_scalars
 
-        tags = await get_or_create_tags(["some1", "some2"], self.session)
-        self.assertEqual([tag1.name, tag2.name], [tag.name for tag in tags])
+        tag_ids = await get_tag_ids([" cached", "loaded", "missing", "loaded"], self.session)
+
+        self.assertEqual([1, 2], tag_ids)
+        self.session.scalars.assert_called_once()
+        self.assertEqual(([], ["missing"]), tag_cache.get_many(["missing"]))
+        self.assertEqual(2, tag_cache.get_many(["loaded"])[0][0].id)
 
     async def test_update_tag(self):
         tag = Tag(id=42, name="some")
@@ -65,12 +117,14 @@ class TestTags(unittest.IsolatedAsyncioTestCase):
 
         updated_tag = await update_tag(42, TagBase(name="newname"), self.session)
         self.assertEqual("newname", updated_tag.name)
+        self.invalidate.assert_called_once_with(["some", "newname"])
 
     async def test_remove_tag(self):
         tag = Tag(id=42, name="some")
         self.session.scalar.return_value = tag
         await remove_tag(42, self.session)
         self.session.delete.assert_called_once_with(tag)
+        self.invalidate.assert_called_once_with(["some"])
 
     async def test_get_list_tags(self):
         tags_for_test = ['tag1', 'tag2', "tag3"]
@@ -1,8 +1,8 @@
 import unittest
 from datetime import datetime
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, or_, func, RowMapping
 
 from svitlogram.database.models.users import User, UserRole
@@ -14,7 +14,6 @@ from svitlogram.repository.users import (
     get_user_by_id,
     create_user,
     confirmed_email,
-    update_token,
     update_avatar,
     update_password,
     update_email,
@@ -23,11 +22,13 @@ from svitlogram.repository.users import (
     user_update_is_active,
     get_user_profile_by_username, search_users, get_users_with_filter,
 )
+from svitlogram.services.user_cache import user_cache
+from svitlogram.utils.cursor import encode_cursor, decode_cursor
 
 
 class TestUsers(unittest.IsolatedAsyncioTestCase):
     def setUp(self):
-        self.session = MagicMock(spec=Session)
+        self.session = MagicMock(spec=AsyncSession)
         self.user = MagicMock(spec=User)
         self.user_test = User(
             id=1,
@@ -44,6 +45,9 @@ class TestUsers(unittest.IsolatedAsyncioTestCase):
             first_name="Patrick",
             last_name="Pink"
         )
+        invalidate = patch.object(user_cache, "invalidate")
+        self.invalidate = invalidate.start()
+        self.addCleanup(invalidate.stop)
 
     async def test_create_user(self):
         db_mock = self.session
@@ -67,7 +71,6 @@ class TestUsers(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(new_user.username, user_test.username)
         self.assertEqual(new_user.last_name, user_test.last_name)
         self.assertNotEqual(new_user.role, UserRole.admin)
-        self.assertEqual(new_user.refresh_token, None)
 
         self.session.add.assert_called_once_with(new_user)
         self.session.commit.assert_called_once()
@@ -84,12 +87,12 @@ class TestUsers(unittest.IsolatedAsyncioTestCase):
         user2 = User(email='user2@example.com')
         user3 = User(email='user3@example.com')
 
-        self.session.query().filter().first.return_value = user1
+        self.session.scalar.return_value = user1
         result = await get_user_by_email('user1@example.com', db_mock)
         self.assertEqual(result, user1)
 
         # Test case 2: User does not exist in the database
-        self.session.query().filter().first.return_value = None
+        self.session.scalar.return_value = None
         result = await get_user_by_email('user4@example.com', db_mock)
         self.assertIsNone(result)
 
@@ -101,16 +104,16 @@ class TestUsers(unittest.IsolatedAsyncioTestCase):
         user2 = User(email='user2@example.com', username='user2')
         user3 = User(email='user3@example.com', username='user3')
 
-        self.session.query().filter().first.return_value = user1
+        self.session.scalar.return_value = user1
         result = await get_user_by_email_or_username('user1@example.com', '', db_mock)
         self.assertEqual(result, user1)
 
-        self.session.query().filter().first.return_value = user1
+        self.session.scalar.return_value = user1
         result = await get_user_by_email_or_username('', 'user1', db_mock)
         self.assertEqual(result, user1)
 
         # Test case 3: User does not exist in the database
-        self.session.query().filter().first.return_value = None
+        self.session.scalar.return_value = None
         result = await get_user_by_email_or_username('user4@example.com', 'user4', db_mock)
         self.assertIsNone(result)
 
@@ -122,12 +125,12 @@ class TestUsers(unittest.IsolatedAsyncioTestCase):
         user2 = User(email='user2@example.com', username='user2')
         user3 = User(email='user3@example.com', username='user3')
 
-        self.session.query().filter().first.return_value = user1
+        self.session.scalar.return_value = user1
         result = await get_user_by_username('user1', db_mock)
         self.assertEqual(result, user1)
 
         # Test case 2: User does not exist in the database
-        self.session.query().filter().first.return_value = None
+        self.session.scalar.return_value = None
         result = await get_user_by_username('user4', db_mock)
         self.assertIsNone(result)
 
@@ -139,31 +142,21 @@ class TestUsers(unittest.IsolatedAsyncioTestCase):
         user2 = User(email='user2@example.com', username='user2')
         user3 = User(email='user3@example.com', username='user3')
 
-        self.session.query().filter().first.return_value = user1
+        self.session.scalar.return_value = user1
         result = await get_user_by_id(1, db_mock)
         self.assertEqual(result, user1)
 
         # Test case 2: User does not exist in the database
-        self.session.query().filter().first.return_value = None
+        self.session.scalar.return_value = None
         result = await get_user_by_id(4, db_mock)
         self.assertIsNone(result)
 
-    async def test_update_token(self):
-        user_test = self.user_test
-        token = 'new token'
-
-        self.session.commit = MagicMock()
-        await update_token(user_test, token, self.session)
-
-        self.assertEqual(user_test.refresh_token, token)
-        self.session.commit.assert_called_once()
-
     async def test_update_avatar(self):
         # Create some dummy user data
         user1 = User(email='user1@example.com', username='user1')
         avatar = 'https://example.com/avatar.jpg'
 
-        self.session.query().filter().first.return_value = user1
+        self.session.scalar.return_value = user1
         await update_avatar(user1.id, avatar, self.session)
 
         self.assertEqual(user1.avatar, avatar)
@@ -174,7 +167,7 @@ class TestUsers(unittest.IsolatedAsyncioTestCase):
         user1 = User(email='user1@example.com', username='user1', password='password')
         password = 'qwerty123'
 
-        self.session.query().filter().first.return_value = user1
+        self.session.scalar.return_value = user1
         await update_password(user1.id, password, self.session)
 
         self.assertEqual(user1.password, password)
@@ -188,14 +181,19 @@ class TestUsers(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(result, mock_user)
         self.session.commit.assert_called_once()
 
+    async def test_update_email_invalidates_old_email(self):
+        self.session.scalar.side_effect = ["old@example.com", User(id=1, email="email@example.com")]
+
+        await update_email(user_id=1, email="email@example.com", db=self.session)
+
+        self.invalidate.assert_awaited_once_with(["old@example.com", "email@example.com"])
+
     async def test_confirmed_email(self):
         email = 'user1@example.com'
 
         user_mock = MagicMock(spec=User)
         user_mock.email_verified = True
 
-        self.session.query().filter().one_or_none.return_value = user_mock
-        self.session.commit = MagicMock()
 
         await confirmed_email(user_mock, self.session)
 
@@ -209,8 +207,6 @@ class TestUsers(unittest.IsolatedAsyncioTestCase):
         role = UserRole.admin
         user_mock.role = role
 
-        self.session.query().filter().one_or_none.return_value = user_mock
-        self.session.commit = MagicMock()
 
         await user_update_role(user_mock, UserRole.admin, self.session)
 
@@ -223,13 +219,12 @@ class TestUsers(unittest.IsolatedAsyncioTestCase):
         user_mock = MagicMock(spec=User)
         user_mock.is_active = True
 
-        self.session.query().filter().one_or_none.return_value = user_mock
-        self.session.commit = MagicMock()
 
         await user_update_is_active(user_mock, True, self.session)
 
         self.assertTrue(user_mock.is_active)
         self.session.commit.assert_called_once()
+        self.invalidate.assert_awaited_once_with([user_mock.email])
 
     async def test_update_user_profile_found(self):
         mock_user = User()
@@ -250,11 +245,11 @@ class TestUsers(unittest.IsolatedAsyncioTestCase):
             created_at='2023-06-13 19:06:07.534'
         )
 
-        session_instance = self.session.return_value
-        session_instance.execute.return_value.mappings.return_value.first.return_value = mock_user
-        session_instance.scalar.return_value = 1
+        result_mock = MagicMock()
+        result_mock.mappings.return_value.first.return_value = mock_user
+        self.session.execute.return_value = result_mock
 
-        result = await get_user_profile_by_username('test_user', session_instance)
+        result = await get_user_profile_by_username('test_user', self.session)
 
         self.assertEqual(result.id, mock_user.id)
         self.assertEqual(result.username, mock_user.username)
@@ -268,14 +263,34 @@ class TestUsers(unittest.IsolatedAsyncioTestCase):
                  User(first_name="Jane", last_name="Smith", username="johesmith"),
                  User(first_name="Alex", last_name="Johnson", username="alexjohnson")]
 
-        self.session.query(User).filter().all.return_value = users
+        mock_result = MagicMock()
+        mock_result.all.return_value = [(user, 0.5) for user in users]
+        self.session.execute.return_value = mock_result
 
         # Search for users matching the given data
-        results = await search_users("joh", self.session)
+        results, next_cursor = await search_users("joh", 10, self.session)
 
         # Verify the results
         self.assertEqual(len(results), 3)
         self.assertIn(users[0], results)
         self.assertIn(users[1], results)
         self.assertIn(users[2], results)
+        self.assertIsNone(next_cursor)
+
+    async def test_search_users_next_cursor(self):
+        users = [User(id=user_id, username=f"john{user_id}") for user_id in (3, 2, 1)]
+        mock_result = MagicMock()
+        mock_result.all.return_value = list(zip(users, (0.75, 0.5, 0.5)))
+        self.session.execute.return_value = mock_result
+
+        results, next_cursor = await search_users("john", 2, self.session)
+
+        self.assertEqual(users[:2], results)
+        self.assertEqual(["users", 0.5, 2], decode_cursor(next_cursor))
+
+    async def test_search_users_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            await search_users("john", 2, self.session, encode_cursor("search", 0.5, 2))
+
+        self.session.execute.assert_not_called()
 
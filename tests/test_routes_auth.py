@@ -5,11 +5,13 @@ from collections import namedtuple
 
 import pytest
 from fastapi_limiter import FastAPILimiter
+from jose import jwt
 from sqlalchemy import update
 from sqlalchemy.exc import IntegrityError
 
 from svitlogram.database.models import User, UserRole
 from svitlogram.services.auth import AuthService
+from svitlogram.services.login_throttle import login_throttle
 
 
 @pytest.fixture()
@@ -114,49 +116,83 @@ def test_login(client, session, user):
     assert data["token_type"] == "bearer"
 
 
-def test_refresh_token_valid_credentials(client, user, token, monkeypatch):
-    USER = namedtuple('USER', ['email', 'refresh_token'])
+def test_login_throttled(client, user, monkeypatch):
+    monkeypatch.setattr(login_throttle, "free_attempts", {"email": 2, "ip": 100})
+    data = {"username": user.get('email'), "password": "wrong_password"}
+    try:
+        for _ in range(2):
+            response = client.post("/api/auth/login", data=data)
+            assert response.status_code == 401, response.text
 
-    mock_decode_refresh_token = AsyncMock(return_value=user.get('email'))
-    mock_get_user_by_email = AsyncMock(return_value=USER(email=user.get('email'), refresh_token='valid_token'))
-    mock_create_access_token = AsyncMock(return_value="new_access_token")
-    mock_create_refresh_token = AsyncMock(return_value="new_refresh_token")
-    mock_update_token = AsyncMock()
+        with patch("svitlogram.services.auth.AuthService.verify_password") as mock_verify_password:
+            response = client.post("/api/auth/login", data=data)
 
-    monkeypatch.setattr("svitlogram.services.auth.AuthService.decode_refresh_token", mock_decode_refresh_token)
-    monkeypatch.setattr("svitlogram.repository.users.get_user_by_email", mock_get_user_by_email)
-    monkeypatch.setattr("svitlogram.services.auth.AuthService.create_access_token", mock_create_access_token)
-    monkeypatch.setattr("svitlogram.services.auth.AuthService.create_refresh_token", mock_create_refresh_token)
-    monkeypatch.setattr("svitlogram.repository.users.update_token", mock_update_token)
-    response = client.get(
-        "/api/auth/refresh_token",
-        headers={"Authorization": "Bearer valid_token"}
+            assert response.status_code == 429, response.text
+            assert response.headers["Retry-After"] == "1"
+            mock_verify_password.assert_not_called()
+    finally:
+        client.portal.call(login_throttle.clear)
+
+
+def login(client, user) -> dict:
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
     )
+    assert response.status_code == 200, response.text
+    return response.json()
 
-    assert response.status_code == 200
+
+def refresh(client, refresh_token: str):
+    return client.get("/api/auth/refresh_token", headers={"Authorization": f"Bearer {refresh_token}"})
+
+
+def test_refresh_token_valid_credentials(client, user, token):
+    tokens = login(client, user)
+
+    response = refresh(client, tokens["refresh_token"])
+
+    assert response.status_code == 200, response.text
     data = response.json()
-    assert "access_token" in data
-    assert "refresh_token" in data
-    assert "token_type" in data
-    assert data["access_token"] == "new_access_token"
-    assert data["refresh_token"] == "new_refresh_token"
     assert data["token_type"] == "bearer"
-    assert mock_decode_refresh_token.called
-    assert mock_get_user_by_email.called
-    assert mock_create_access_token.called
-    assert mock_create_refresh_token.called
-    assert mock_update_token.called
+    assert data["refresh_token"] != tokens["refresh_token"]
+    claims = jwt.get_unverified_claims(data["access_token"])
+    assert (claims["sub"], claims["role"], claims["is_active"]) == (user.get('email'), "admin", True)
+    assert claims["fam"] == jwt.get_unverified_claims(tokens["access_token"])["fam"]
+
+    response = refresh(client, data["refresh_token"])
+    assert response.status_code == 200, response.text
+
+
+def test_refresh_token_reused(client, user, token):
+    tokens = login(client, user)
+    rotated = refresh(client, tokens["refresh_token"]).json()
+
+    response = refresh(client, tokens["refresh_token"])
+
+    assert response.status_code == 401, response.text
+    assert response.json()["detail"] == "Invalid refresh token"
+    # The family is revoked, the token it was rotated to does not work either
+    assert refresh(client, rotated["refresh_token"]).status_code == 401
+
+
+def test_logout_revokes_refresh_token(client, user, token):
+    phone, laptop = login(client, user), login(client, user)
+
+    response = client.get("/api/auth/logout", headers={"Authorization": f"Bearer {phone['access_token']}"})
+
+    assert response.status_code == 401, response.text
+    assert refresh(client, phone["refresh_token"]).status_code == 401
+    assert refresh(client, laptop["refresh_token"]).status_code == 200
 
 
 def test_refresh_token_invalid_credentials(client, user, token, monkeypatch):
-    USER = namedtuple('USER', ['email', 'refresh_token'])
+    USER = namedtuple('USER', ['email'])
     mock_decode_refresh_token = AsyncMock(return_value=user.get('email'))
-    mock_get_user_by_email = AsyncMock(return_value=USER(email=user.get('email'), refresh_token='valid_token'))
-    mock_update_token = AsyncMock()
+    mock_get_user_by_email = AsyncMock(return_value=USER(email=user.get('email')))
 
     monkeypatch.setattr("svitlogram.services.auth.AuthService.decode_refresh_token", mock_decode_refresh_token)
     monkeypatch.setattr("svitlogram.repository.users.get_user_by_email", mock_get_user_by_email)
-    monkeypatch.setattr("svitlogram.repository.users.update_token", mock_update_token)
 
     response = client.get(
         "/api/auth/refresh_token",
@@ -224,6 +260,7 @@ def test_logout(client, token, user):
 def test_new_password_success(client, user):
     password = "new_password"
     token = "test_token"
+    tokens = login(client, user)
 
     with patch("svitlogram.services.auth.AuthService.get_email_from_token") as mock_get_email:
         mock_get_email.return_value = user.get('email')
@@ -239,6 +276,8 @@ def test_new_password_success(client, user):
 
             mock_get_email.assert_called_once_with(token)
 
+    assert refresh(client, tokens["refresh_token"]).status_code == 401
+
 
 def test_new_password_wrong_email(client, user):
     password = "new_password"
@@ -0,0 +1,198 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from fastapi import Request, Response
+from fastapi_limiter.depends import RateLimiter
+from sqlalchemy import select
+
+from svitlogram.database.models import ImageFile, User, UserRole
+from svitlogram.services import storage
+from svitlogram.services.uploads import upload_jobs
+
+CONTENT = b"\xff\xd8\xff\xe0" + b"jpeg data" * 1000
+
+
+@pytest.fixture()
+def token(client, user, session, monkeypatch):
+    mock_send_email = MagicMock()
+    monkeypatch.setattr("svitlogram.services.email.send_email_confirmed", mock_send_email)
+    client.post("/api/auth/signup", json=user)
+
+    current_user: User = session.query(User).filter(User.email == user.get('email')).first()
+    current_user.email_verified = True
+    session.commit()
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    return response.json()["access_token"]
+
+
+@pytest.fixture(autouse=True)
+def no_rate_limit(monkeypatch):
+    # Uploads are limited to 10 a minute, the counters in Redis outlive the test run
+    async def allow(self, request: Request, response: Response) -> None:
+        pass
+
+    monkeypatch.setattr(RateLimiter, "__call__", allow)
+
+
+@pytest.fixture()
+def local_storage(tmp_path, monkeypatch):
+    backend = storage.LocalStorage(tmp_path, "/api/storage")
+    monkeypatch.setattr(storage, "backend", backend)
+    return backend
+
+
+def upload(client, token, content=CONTENT, content_type="image/jpeg"):
+    return client.post(
+        "/api/images/",
+        files={"file": ("photo.jpg", content, content_type)},
+        data={"description": "A photo of the sea", "tags": ["sea"]},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+
+def test_upload_served_by_storage_route(client, token, local_storage):
+    response = upload(client, token)
+
+    assert response.status_code == 201, response.text
+    image = response.json()["image"]
+    assert image["url"].startswith("/api/storage/")
+    assert [tag["name"] for tag in image["tags"]] == ["sea"]
+
+    response = client.get(image["url"])
+
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["content-type"] == "image/jpeg"
+    assert "immutable" in response.headers["cache-control"]
+
+
+def test_upload_invalid_type(client, token, local_storage):
+    response = upload(client, token, content=b"<svg onload=alert(1)>", content_type="image/jpeg")
+
+    assert response.status_code == 415
+    assert response.json()["detail"].startswith("Invalid file type")
+    assert list(local_storage.root.iterdir()) == []
+
+
+def test_upload_type_sniffed(client, token, local_storage):
+    response = upload(client, token, content_type="text/plain")
+
+    assert response.status_code == 201, response.text
+    assert response.json()["image"]["url"].endswith(".jpg")
+
+
+def test_upload_too_large(client, token, local_storage, monkeypatch):
+    monkeypatch.setattr("config.settings.upload_max_size", len(CONTENT) - 1)
+
+    response = upload(client, token)
+
+    assert response.status_code == 413
+    assert list(local_storage.root.iterdir()) == []
+
+
+def test_upload_empty_file(client, token, local_storage):
+    response = upload(client, token, content=b"")
+
+    assert response.status_code == 422
+    assert response.json()["detail"] == "Invalid image file"
+
+
+def test_storage_route_not_found(client, local_storage):
+    assert client.get("/api/storage/" + "0" * 64).status_code == 404
+    assert client.get("/api/storage/..%2Fconfig.py").status_code == 404
+
+
+def test_same_content_uploaded_once(client, token, user, session, local_storage, monkeypatch):
+    content = b"\x89PNG\r\n\x1a\n" + b"the same photo" * 100
+    upload_file = AsyncMock(wraps=local_storage.upload)
+    monkeypatch.setattr(local_storage, "upload", upload_file)
+
+    first = upload(client, token, content=content).json()["image"]
+    second = upload(client, token, content=content).json()["image"]
+
+    assert first["id"] != second["id"]
+    assert first["url"] == second["url"]
+    upload_file.assert_awaited_once()
+    image_file = session.scalar(select(ImageFile).filter(ImageFile.public_id == first["url"].rsplit("/", 1)[1]))
+    session.refresh(image_file)
+    assert (image_file.storage, image_file.ref_count) == ("local", 2)
+    image_file_id = image_file.id
+
+    current_user = session.query(User).filter(User.email == user.get('email')).first()
+    current_user.role = UserRole.admin
+    session.commit()
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.delete(f"/api/images/{first['id']}", headers=headers).status_code == 200
+    assert client.get(second["url"]).content == content
+
+    assert client.delete(f"/api/images/{second['id']}", headers=headers).status_code == 200
+    assert client.get(second["url"]).status_code == 404
+    assert session.scalar(select(ImageFile).filter(ImageFile.id == image_file_id)) is None
+
+
+@pytest.fixture()
+def spool(tmp_path, monkeypatch):
+    spool_dir = tmp_path / "spool"
+    spool_dir.mkdir()
+    monkeypatch.setattr(upload_jobs, "spool_dir", spool_dir)
+    return spool_dir
+
+
+def submit(client, token, content=CONTENT):
+    return client.post(
+        "/api/images/jobs",
+        files={"file": ("photo.jpg", content, "image/jpeg")},
+        data={"description": "A photo of the mountains", "tags": ["mountains"]},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+
+def test_upload_job_done(client, token, local_storage, spool):
+    content = b"\xff\xd8\xff\xe0" + b"uploaded in the background" * 100
+    response = submit(client, token, content=content)
+
+    assert response.status_code == 202, response.text
+    job = response.json()
+    assert job["status"] == "queued"
+    assert response.headers["location"].endswith(f"/api/images/jobs/{job['job_id']}")
+
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.get(response.headers["location"], params={"wait": 10}, headers=headers)
+
+    assert response.status_code == 200
+    job = response.json()
+    assert job["status"] == "done", job
+    image = client.get(f"/api/images/{job['image_id']}", headers=headers).json()
+    assert image["description"] == "A photo of the mountains"
+    assert client.get(image["url"]).content == content
+    assert list(spool.iterdir()) == []
+
+
+def test_upload_job_failed(client, token, local_storage, spool, monkeypatch):
+    monkeypatch.setattr(local_storage, "upload", AsyncMock(return_value=None))
+    job_id = submit(client, token, content=CONTENT + b"rejected by the storage").json()["job_id"]
+
+    response = client.get(f"/api/images/jobs/{job_id}", params={"wait": 10},
+                          headers={"Authorization": f"Bearer {token}"})
+
+    assert response.json() == {"job_id": job_id, "status": "failed", "image_id": None, "detail": "Invalid image file"}
+    assert list(spool.iterdir()) == []
+
+
+def test_upload_job_invalid_type(client, token, local_storage, spool):
+    response = submit(client, token, content=b"<svg onload=alert(1)>")
+
+    assert response.status_code == 415
+    assert response.json()["detail"].startswith("Invalid file type")
+    assert list(spool.iterdir()) == []
+
+
+def test_upload_job_not_found(client, token):
+    response = client.get("/api/images/jobs/" + "0" * 32, headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Not found upload job"
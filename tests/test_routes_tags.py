@@ -101,6 +101,15 @@ def test_update_tag(client, token, session):
     assert tag.name == "updated_tag"
 
 
+def test_get_tag_after_update(client, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get('/api/tags/1', headers=headers).json()["name"] == "updated_tag"
+
+    client.put('/api/tags', json={"tag_id": 1, "name": "renamed_tag"}, headers=headers)
+
+    assert client.get('/api/tags/1', headers=headers).json()["name"] == "renamed_tag"
+
+
 def test_delete_tag(client, token, session):
     tags = ["tag1"]
 
@@ -119,4 +128,18 @@ def test_delete_tag(client, token, session):
 
     assert data["id"] == 1
 
-    assert None == session.scalar(select(Tag).filter(Tag.id == 1))
\ No newline at end of file
+    assert None == session.scalar(select(Tag).filter(Tag.id == 1))
+
+def test_get_tag_created_after_not_found(client, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    created = client.post('/api/tags', json=["before_missing"], headers=headers).json()
+    missing_id = created[0]["id"] + 1
+
+    assert client.get(f'/api/tags/{missing_id}', headers=headers).status_code == 404
+
+    created = client.post('/api/tags', json=["after_missing"], headers=headers).json()
+    assert created[0]["id"] == missing_id
+
+    response = client.get(f'/api/tags/{missing_id}', headers=headers)
+    assert response.status_code == 200
+    assert response.json()["name"] == "after_missing"
@@ -0,0 +1,46 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from svitlogram.routes.users import _search_section
+
+
+class TestSearchSection(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.session = MagicMock(spec=AsyncSession)
+        self.session_factory = MagicMock()
+        self.session_factory.return_value.__aenter__.return_value = self.session
+
+    async def test_search_section(self):
+        async def search(data, limit, db, cursor):
+            self.assertEqual(("cat", 5, self.session, "cursor"), (data, limit, db, cursor))
+            return ["result"], "next"
+
+        result = await _search_section(search, "cat", 5, "cursor", self.session_factory, timeout=1)
+
+        self.assertEqual((["result"], "next"), result)
+        self.session_factory.return_value.__aexit__.assert_called_once()
+
+    async def test_search_section_timeout(self):
+        cancelled = asyncio.Event()
+
+        async def search(data, limit, db, cursor):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        result = await _search_section(search, "cat", 5, None, self.session_factory, timeout=0.01)
+
+        self.assertIsNone(result)
+        self.assertTrue(cancelled.is_set())
+
+    async def test_search_section_invalid_cursor(self):
+        async def search(data, limit, db, cursor):
+            raise ValueError("Invalid cursor")
+
+        with self.assertRaises(ValueError):
+            await _search_section(search, "cat", 5, "bad", self.session_factory, timeout=1)
@@ -0,0 +1,226 @@
+import hashlib
+import time
+import unittest
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi import HTTPException
+from jose import jwt
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from svitlogram.database.models import User, UserRole
+from svitlogram.services.auth import AuthService, TokenClaims, get_current_active_claims
+from svitlogram.services.token_cache import token_cache
+from svitlogram.services.user_cache import user_cache, CachedUser
+
+
+class TestGetCurrentUser(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.session = MagicMock(spec=AsyncSession)
+        self.email = "test_user@gmail.com"
+        self.user = User(
+            id=1, username="test_user", email=self.email, password="hash", first_name="first_name",
+            last_name="last_name", role=UserRole.user, email_verified=True, is_active=True,
+            created_at=datetime(2023, 6, 1),
+        )
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+
+        redis = patch.object(AuthService, "redis", new=MagicMock())
+        self.redis = redis.start()
+        self.addCleanup(redis.stop)
+        self.redis.eval = AsyncMock()
+        self.redis.delete = AsyncMock()
+        self.redis.mget = AsyncMock(return_value=[None, None])
+
+        revocations = patch("svitlogram.services.auth.revocation_store", new=MagicMock())
+        self.revocations = revocations.start()
+        self.addCleanup(revocations.stop)
+        self.revocations.is_revoked = AsyncMock(return_value=False)
+        self.revocations.revoke_token = AsyncMock()
+
+        get_user_by_email = patch("svitlogram.repository.users.get_user_by_email")
+        self.get_user_by_email = get_user_by_email.start()
+        self.addCleanup(get_user_by_email.stop)
+
+    async def test_user_in_redis(self):
+        token = await AuthService.create_access_token({"sub": self.email})
+        self.redis.mget.return_value = [CachedUser.from_user(self.user).dumps(), b"3"]
+
+        user = await AuthService.get_current_user(token, self.session)
+
+        self.assertEqual(CachedUser.from_user(self.user), user)
+        self.redis.mget.assert_awaited_once_with("current-user:test_user@gmail.com",
+                                                 "current-user-version:test_user@gmail.com")
+        self.get_user_by_email.assert_not_called()
+        self.redis.eval.assert_not_called()
+        self.assertEqual(user, user_cache.get(self.email))
+
+    async def test_user_in_worker_cache(self):
+        token = await AuthService.create_access_token({"sub": self.email})
+        user_cache.put(CachedUser.from_user(self.user))
+
+        user = await AuthService.get_current_user(token, self.session)
+
+        self.assertEqual(self.email, user.email)
+        self.revocations.is_revoked.assert_awaited_once_with(jwt.get_unverified_claims(token)["jti"])
+        self.redis.mget.assert_not_called()
+        self.get_user_by_email.assert_not_called()
+
+    async def test_user_not_cached(self):
+        token = await AuthService.create_access_token({"sub": self.email})
+        self.get_user_by_email.return_value = self.user
+
+        user = await AuthService.get_current_user(token, self.session)
+
+        self.assertEqual(CachedUser.from_user(self.user), user)
+        self.redis.eval.assert_awaited_once_with(
+            user_cache.set_if_version, 2, "current-user:test_user@gmail.com",
+            "current-user-version:test_user@gmail.com", user.dumps(), b"", 900,
+        )
+
+    async def test_invalid_user_in_redis(self):
+        token = await AuthService.create_access_token({"sub": self.email})
+        self.redis.mget.return_value = [b'["old","format"]', None]
+        self.get_user_by_email.return_value = self.user
+
+        user = await AuthService.get_current_user(token, self.session)
+
+        self.assertEqual(CachedUser.from_user(self.user), user)
+        self.redis.delete.assert_awaited_once_with("current-user:test_user@gmail.com")
+        self.redis.eval.assert_awaited_once()
+
+    async def test_user_changed_while_read(self):
+        token = await AuthService.create_access_token({"sub": self.email})
+        self.redis.mget.return_value = [None, b"3"]
+
+        async def get_user_by_email(email, db):
+            # The user is banned and invalidated while the request reads it
+            user_cache.discard([email])
+            return self.user
+
+        self.get_user_by_email.side_effect = get_user_by_email
+
+        user = await AuthService.get_current_user(token, self.session)
+
+        self.assertEqual("current-user-version:test_user@gmail.com", self.redis.eval.await_args.args[3])
+        self.assertEqual(b"3", self.redis.eval.await_args.args[5])
+        self.assertEqual(self.email, user.email)
+        self.assertIsNone(user_cache.get(self.email))
+
+    async def test_revoked_token(self):
+        token = await AuthService.create_access_token({"sub": self.email})
+        user_cache.put(CachedUser.from_user(self.user))
+        self.revocations.is_revoked.return_value = True
+
+        with self.assertRaises(HTTPException) as e:
+            await AuthService.get_current_user(token, self.session)
+
+        self.assertEqual(401, e.exception.status_code)
+        self.get_user_by_email.assert_not_called()
+
+    async def test_tokens_have_unique_jti(self):
+        first = await AuthService.create_access_token({"sub": self.email})
+        second = await AuthService.create_access_token({"sub": self.email})
+
+        self.assertNotEqual(jwt.get_unverified_claims(first)["jti"], jwt.get_unverified_claims(second)["jti"])
+
+    async def test_decoded_token_cached(self):
+        token = await AuthService.create_access_token({"sub": self.email})
+        user_cache.put(CachedUser.from_user(self.user))
+
+        await AuthService.get_current_user(token, self.session)
+        with patch("svitlogram.services.auth.jwt.decode") as decode:
+            user = await AuthService.get_current_user(token, self.session)
+
+        self.assertEqual(self.email, user.email)
+        decode.assert_not_called()
+
+    async def test_add_token_to_blacklist_evicts_decoded_token(self):
+        token = await AuthService.create_access_token({"sub": self.email})
+        user_cache.put(CachedUser.from_user(self.user))
+        await AuthService.get_current_user(token, self.session)
+
+        await AuthService.add_token_to_blacklist(token)
+
+        self.assertIsNone(token_cache.get(token))
+
+    async def test_add_token_to_blacklist(self):
+        token = await AuthService.create_access_token({"sub": self.email})
+
+        await AuthService.add_token_to_blacklist(token)
+
+        jti, ttl = self.revocations.revoke_token.call_args.args
+        self.assertEqual(jwt.get_unverified_claims(token)["jti"], jti)
+        self.assertTrue(0 < ttl <= 15 * 60)
+
+    async def test_token_without_jti(self):
+        token = jwt.encode({"sub": self.email, "scope": "email_token"}, AuthService.SECRET_KEY, AuthService.ALGORITHM)
+
+        await AuthService.token_is_blacklist(token)
+
+        self.revocations.is_revoked.assert_awaited_once_with(hashlib.sha256(token.encode()).hexdigest())
+
+
+class TestGetCurrentClaims(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.email = "test_user@gmail.com"
+        self.user = User(id=7, email=self.email, role=UserRole.moderator, is_active=True)
+
+        revocations = patch("svitlogram.services.auth.revocation_store", new=MagicMock())
+        self.revocations = revocations.start()
+        self.addCleanup(revocations.stop)
+        self.revocations.is_revoked = AsyncMock(return_value=False)
+        self.revocations.revoke_user = AsyncMock()
+
+    async def test_claims(self):
+        token = await AuthService.create_access_token(AuthService.user_claims(self.user))
+
+        claims = await AuthService.get_current_claims(token)
+
+        self.assertEqual(TokenClaims(id=7, role=UserRole.moderator, is_active=True), claims)
+        payload = jwt.get_unverified_claims(token)
+        self.revocations.is_revoked.assert_awaited_once_with(payload["jti"], self.email, payload["iat"])
+
+    async def test_token_without_claims(self):
+        token = await AuthService.create_access_token({"sub": self.email})
+
+        with self.assertRaises(HTTPException) as e:
+            await AuthService.get_current_claims(token)
+
+        self.assertEqual(401, e.exception.status_code)
+        self.revocations.is_revoked.assert_not_called()
+
+    async def test_refresh_token(self):
+        token = await AuthService.create_refresh_token(AuthService.user_claims(self.user))
+
+        with self.assertRaises(HTTPException) as e:
+            await AuthService.get_current_claims(token)
+
+        self.assertEqual(401, e.exception.status_code)
+
+    async def test_revoked_token(self):
+        token = await AuthService.create_access_token(AuthService.user_claims(self.user))
+        self.revocations.is_revoked.return_value = True
+
+        with self.assertRaises(HTTPException) as e:
+            await AuthService.get_current_claims(token)
+
+        self.assertEqual(401, e.exception.status_code)
+
+    async def test_revoke_user_tokens(self):
+        await AuthService.revoke_user_tokens(self.email)
+
+        email, revoked_before, ttl = self.revocations.revoke_user.call_args.args
+        self.assertEqual(self.email, email)
+        self.assertAlmostEqual(time.time(), revoked_before, delta=5)
+        self.assertEqual(AuthService.ACCESS_TOKEN_TTL, ttl)
+
+    async def test_inactive_user(self):
+        with self.assertRaises(HTTPException) as e:
+            await get_current_active_claims(TokenClaims(id=7, role=UserRole.user, is_active=False))
+
+        self.assertEqual(400, e.exception.status_code)
+
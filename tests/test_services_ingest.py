@@ -0,0 +1,65 @@
+import io
+import unittest
+
+from fastapi import HTTPException, UploadFile
+
+from svitlogram.services.ingest import ingest, sniff
+
+JPEG = b"\xff\xd8\xff\xe0\x00\x10JFIF" + b"\x00" * 100
+
+
+class TestSniff(unittest.TestCase):
+    def test_signatures(self):
+        for head, content_type in (
+                (JPEG, "image/jpeg"),
+                (b"\x89PNG\r\n\x1a\n\x00\x00", "image/png"),
+                (b"GIF89a\x01\x00", "image/gif"),
+                (b"RIFF\x24\x00\x00\x00WEBPVP8 ", "image/webp"),
+        ):
+            self.assertEqual(content_type, sniff(head), head)
+
+    def test_not_images(self):
+        for head in (b"", b"<svg xmlns=...>", b"<?xml version='1.0'?>", b"PK\x03\x04", b"RIFF\x24\x00\x00\x00WAVEfmt ",
+                     b"\xff\xd8", b"%PDF-1.7\n", b"%!PS-Adobe-3.0", b"8BPS\x00\x01", b"FLIF", b"II*\x00\x08\x00\x00\x00",
+                     b"\x00\x00\x00\x1cftypavif\x00\x00"):
+            self.assertIsNone(sniff(head), head)
+
+
+class TestIngest(unittest.IsolatedAsyncioTestCase):
+    async def test_type_size_and_hash(self):
+        upload = UploadFile(io.BytesIO(JPEG * 30), filename="photo.png")
+        await upload.read(5)
+
+        ingested = await ingest(upload, max_size=len(JPEG) * 30, chunk_size=1000)
+
+        self.assertEqual(("image/jpeg", len(JPEG) * 30), (ingested.content_type, ingested.size))
+        self.assertEqual("5e490533902a43579c46881d4225ea5cc65d1140ae435bf393ea1c2ecd2dd697", ingested.sha256)
+        self.assertEqual(JPEG * 30, ingested.file.read())
+
+    async def test_too_large_stops_reading(self):
+        file = io.BytesIO(JPEG * 30)
+
+        with self.assertRaises(HTTPException) as error:
+            await ingest(UploadFile(file), max_size=2500, chunk_size=1000)
+
+        self.assertEqual(413, error.exception.status_code)
+        self.assertEqual(3000, file.tell())
+
+    async def test_not_image_stops_reading(self):
+        file = io.BytesIO(b"MZ" + b"\x00" * 5000)
+
+        with self.assertRaises(HTTPException) as error:
+            await ingest(UploadFile(file), chunk_size=1000)
+
+        self.assertEqual(415, error.exception.status_code)
+        self.assertEqual(1000, file.tell())
+
+    async def test_empty(self):
+        with self.assertRaises(HTTPException) as error:
+            await ingest(UploadFile(io.BytesIO(b"")))
+
+        self.assertEqual(422, error.exception.status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
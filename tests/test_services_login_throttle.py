@@ -0,0 +1,103 @@
+import time
+import unittest
+from ipaddress import ip_network
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi import HTTPException
+
+from svitlogram.services import login_throttle
+from svitlogram.services.login_throttle import LoginThrottle, client_ip
+
+
+class TestLoginThrottle(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.throttle = LoginThrottle(window=900, email_free_attempts=3, ip_free_attempts=10, base_delay=1,
+                                      max_delay=60)
+
+        self.client = MagicMock()
+        self.client.__aenter__.return_value = self.client
+        self.client.eval = AsyncMock(return_value=[b"0", b"0"])
+        self.pipe = MagicMock()
+        for command in ("delete", "zrem"):
+            getattr(self.pipe, command).return_value = self.pipe
+        self.pipe.execute = AsyncMock()
+        self.client.pipeline.return_value.__aenter__.return_value = self.pipe
+
+        redis = patch.object(LoginThrottle, "_redis", return_value=self.client)
+        redis.start()
+        self.addCleanup(redis.stop)
+
+    async def test_check_records_attempt(self):
+        attempt = await self.throttle.check("cat@example.com", "10.0.0.1")
+
+        self.client.eval.assert_awaited_once()
+        args = self.client.eval.await_args.args
+        self.assertEqual(LoginThrottle.check_and_record, args[0])
+        self.assertEqual((2, "login-failures:email:cat@example.com", "login-failures:ip:10.0.0.1"), args[1:4])
+        self.assertEqual((900, attempt, 3, 10, 1, 60), args[5:])
+
+    async def test_email_backing_off(self):
+        self.client.eval.return_value = [str(time.time() + 0.5).encode(), b"0"]
+
+        with self.assertRaises(HTTPException) as e:
+            await self.throttle.check("cat@example.com", "10.0.0.1")
+
+        self.assertEqual(429, e.exception.status_code)
+        self.assertEqual("1", e.exception.headers["Retry-After"])
+
+    async def test_backoff_elapsed(self):
+        self.client.eval.return_value = [str(time.time() - 1).encode(), b"0"]
+
+        await self.throttle.check("cat@example.com", "10.0.0.1")
+
+    async def test_ip_backing_off(self):
+        self.client.eval.return_value = [b"0", str(time.time() + 30).encode()]
+
+        with self.assertRaises(HTTPException):
+            await self.throttle.check("dog@example.com", "10.0.0.1")
+
+    async def test_lockout_remembered_in_worker(self):
+        self.client.eval.return_value = [str(time.time() + 30).encode(), b"0"]
+        with self.assertRaises(HTTPException):
+            await self.throttle.check("cat@example.com", "10.0.0.1")
+
+        with self.assertRaises(HTTPException):
+            await self.throttle.check("cat@example.com", "10.0.0.2")
+
+        self.client.eval.assert_awaited_once()
+        self.throttle.failed()
+        self.assertEqual({"checks": 2, "rejected": 2, "failures": 1, "locked": 1}, self.throttle.stats())
+
+    async def test_succeeded_takes_attempt_back(self):
+        self.client.eval.return_value = [str(time.time() + 30).encode(), b"0"]
+        with self.assertRaises(HTTPException):
+            await self.throttle.check("cat@example.com", "10.0.0.1")
+
+        await self.throttle.succeeded("cat@example.com", "10.0.0.1", "attempt")
+
+        self.pipe.delete.assert_called_once_with("login-failures:email:cat@example.com")
+        self.pipe.zrem.assert_called_once_with("login-failures:ip:10.0.0.1", "attempt")
+        self.assertEqual(0, self.throttle.stats()["locked"])
+
+
+class TestClientIp(unittest.TestCase):
+    def setUp(self):
+        proxies = patch.object(login_throttle, "TRUSTED_PROXIES", [ip_network("10.0.0.0/8")])
+        proxies.start()
+        self.addCleanup(proxies.stop)
+
+    @staticmethod
+    def request(peer: str, forwarded: str = None) -> MagicMock:
+        request = MagicMock()
+        request.client.host = peer
+        request.headers = {"X-Forwarded-For": forwarded} if forwarded is not None else {}
+        return request
+
+    def test_forwarded_ignored_from_untrusted_peer(self):
+        self.assertEqual("203.0.113.7", client_ip(self.request("203.0.113.7", "198.51.100.1")))
+
+    def test_forwarded_from_trusted_proxy(self):
+        self.assertEqual("198.51.100.1", client_ip(self.request("10.0.0.2", "1.2.3.4, 198.51.100.1, 10.0.0.3")))
+
+    def test_trusted_proxy_without_forwarded(self):
+        self.assertEqual("10.0.0.2", client_ip(self.request("10.0.0.2")))
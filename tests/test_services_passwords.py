@@ -0,0 +1,41 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from fastapi import HTTPException
+
+from svitlogram.services.passwords import PasswordHasher
+
+
+class TestPasswordHasher(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.hasher = PasswordHasher(workers=1, max_pending=2)
+        self.addAsyncCleanup(self.hasher.stop)
+
+    async def test_hash_and_verify(self):
+        hashed = await self.hasher.hash("secret")
+
+        self.assertTrue(await self.hasher.verify("secret", hashed))
+        self.assertFalse(await self.hasher.verify("wrong", hashed))
+        self.assertEqual(3, self.hasher.stats()["completed"])
+        self.assertEqual(0, self.hasher.stats()["pending"])
+
+    async def test_overloaded(self):
+        release = asyncio.Event()
+
+        async def run_in_executor(executor, function, *args):
+            await release.wait()
+
+        with patch.object(asyncio.get_running_loop(), "run_in_executor", side_effect=run_in_executor):
+            pending = [asyncio.create_task(self.hasher.hash("secret")) for _ in range(2)]
+            await asyncio.sleep(0)
+
+            with self.assertRaises(HTTPException) as e:
+                await self.hasher.hash("secret")
+
+            release.set()
+            await asyncio.gather(*pending)
+
+        self.assertEqual(503, e.exception.status_code)
+        self.assertEqual({"pending": 0, "queued": 0, "peak_pending": 2, "rejected": 1},
+                         {key: self.hasher.stats()[key] for key in ("pending", "queued", "peak_pending", "rejected")})
@@ -0,0 +1,237 @@
+import asyncio
+import unittest
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from sqlalchemy import update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from svitlogram.database.models import Image, ImageComment, Tag
+from svitlogram.services.read_cache import ReadCache, OrmSnapshot, _statement_tags
+
+
+class RowSnapshot:
+    def dumps(self, row: dict) -> tuple[dict, list[str]]:
+        return row, [f"rows:{row['id']}"]
+
+    async def loads(self, data: dict, db: AsyncSession) -> dict:
+        return dict(data)
+
+    def absent_tags(self) -> list[str]:
+        return ["rows:new"]
+
+
+class TestReadCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cache = ReadCache(maxsize=2, ttl=60, local_ttl=60, negative_ttl=10, lock_timeout=1)
+        self.cache._ready = True
+
+        self.db = MagicMock(spec=AsyncSession)
+        self.db.info = {}
+        self.db.new = self.db.dirty = self.db.deleted = ()
+
+        for name, value in (("_get_remote", (None, None)), ("_put_remote", None), ("_lock", True), ("_unlock", None)):
+            remote = patch.object(self.cache, name, AsyncMock(return_value=value))
+            setattr(self, name.strip("_"), remote.start())
+            self.addCleanup(remote.stop)
+
+        self.loads = 0
+
+        @self.cache.cached("row", RowSnapshot())
+        async def get_row(row_id: int, db: AsyncSession):
+            self.loads += 1
+            await asyncio.sleep(0.01)
+            return {"id": row_id} if row_id > 0 else None
+
+        self.get_row = get_row
+
+    async def test_concurrent_misses_load_once(self):
+        rows = await asyncio.gather(*(self.get_row(1, self.db) for _ in range(500)))
+
+        self.assertEqual(1, self.loads)
+        self.assertEqual([{"id": 1}] * 500, rows)
+        self.put_remote.assert_awaited_once_with('read-cache:row:[1]', {"id": 1}, ["rows:1"], 60, None)
+        self.assertEqual(499, self.cache.stats()["functions"]["row"]["coalesced"])
+
+    async def test_local_hit(self):
+        await self.get_row(1, self.db)
+        row = await self.get_row(1, self.db)
+
+        self.assertEqual({"id": 1}, row)
+        self.assertEqual(1, self.loads)
+        self.get_remote.assert_awaited_once()
+
+    async def test_redis_hit(self):
+        self.get_remote.return_value = (({"id": 1}, ["rows:1"]), b"1")
+
+        self.assertEqual({"id": 1}, await self.get_row(1, db=self.db))
+        self.assertEqual({"id": 1}, await self.get_row(1, db=self.db))
+        self.assertEqual(0, self.loads)
+        self.get_remote.assert_awaited_once()
+
+    async def test_none_cached(self):
+        self.assertIsNone(await self.get_row(0, self.db))
+        self.assertIsNone(await self.get_row(0, self.db))
+
+        self.assertEqual(1, self.loads)
+        self.put_remote.assert_awaited_once_with('read-cache:row:[0]', None, ["rows:new"], 10, None)
+        self.assertEqual(1, self.cache.stats()["negative_hits"])
+
+    async def test_none_from_redis(self):
+        self.get_remote.return_value = ((None, ["rows:new"]), b"1")
+
+        self.assertIsNone(await self.get_row(0, self.db))
+        self.assertIsNone(await self.get_row(0, self.db))
+
+        self.assertEqual(0, self.loads)
+        self.assertEqual(2, self.cache.stats()["functions"]["row"]["negative_hits"])
+
+    async def test_none_expires_first(self):
+        @self.cache.cached("now", RowSnapshot())
+        async def get_row_now(row_id: int, db: AsyncSession):
+            self.loads += 1
+            return {"id": row_id} if row_id > 0 else None
+
+        with patch("svitlogram.services.read_cache.time.monotonic", return_value=100):
+            await get_row_now(0, self.db)
+            await get_row_now(1, self.db)
+        with patch("svitlogram.services.read_cache.time.monotonic", return_value=111):
+            await get_row_now(0, self.db)
+            await get_row_now(1, self.db)
+
+        self.assertEqual(3, self.loads)
+
+    async def test_insert_drops_none(self):
+        await self.get_row(0, self.db)
+        await self.get_row(1, self.db)
+
+        self.cache.discard(["rows:new"])
+        await self.get_row(0, self.db)
+        await self.get_row(1, self.db)
+
+        self.assertEqual(3, self.loads)
+
+    async def test_none_not_cached_without_negative_ttl(self):
+        @self.cache.cached("uncached", RowSnapshot(), negative_ttl=0)
+        async def get_missing(row_id: int, db: AsyncSession):
+            self.loads += 1
+
+        self.assertIsNone(await get_missing(1, self.db))
+        self.assertIsNone(await get_missing(1, self.db))
+
+        self.assertEqual(2, self.loads)
+        self.put_remote.assert_not_awaited()
+        self.assertEqual(2, self.unlock.await_count)
+
+    async def test_discard_by_tag(self):
+        await self.get_row(1, self.db)
+        await self.get_row(2, self.db)
+
+        self.cache.discard(["rows:1", "rows:3"])
+        await self.get_row(1, self.db)
+        await self.get_row(2, self.db)
+
+        self.assertEqual(3, self.loads)
+
+    async def test_lru_eviction(self):
+        for row_id in (1, 2, 1, 3):
+            await self.get_row(row_id, self.db)
+
+        self.assertEqual(["read-cache:row:[1]", "read-cache:row:[3]"], list(self.cache._entries))
+        self.assertEqual({"rows:1", "rows:3"}, set(self.cache._keys_by_tag))
+
+    async def test_invalidated_while_loading_not_stored(self):
+        loading = asyncio.create_task(self.get_row(1, self.db))
+        await asyncio.sleep(0)
+        self.cache.discard(["rows:1"])
+
+        self.assertEqual({"id": 1}, await loading)
+        self.put_remote.assert_not_awaited()
+        self.assertEqual(0, self.cache.stats()["size"])
+
+    async def test_failed_load_retried_by_waiters(self):
+        @self.cache.cached("failing", RowSnapshot())
+        async def get_failing(row_id: int, db: AsyncSession):
+            self.loads += 1
+            await asyncio.sleep(0.01)
+            if self.loads == 1:
+                raise ConnectionError("database went away")
+            return {"id": row_id}
+
+        first, second = await asyncio.gather(get_failing(1, self.db), get_failing(1, self.db), return_exceptions=True)
+
+        self.assertIsInstance(first, ConnectionError)
+        self.assertEqual({"id": 1}, second)
+        self.assertEqual(2, self.loads)
+
+    async def test_other_worker_loading(self):
+        self.lock.return_value = False
+        wait = patch.object(self.cache, "_wait", AsyncMock(return_value=({"id": 1}, ["rows:1"])))
+        wait.start()
+        self.addCleanup(wait.stop)
+
+        self.assertEqual({"id": 1}, await self.get_row(1, self.db))
+        self.assertEqual(0, self.loads)
+        self.unlock.assert_not_awaited()
+
+    async def test_bypassed_until_subscribed(self):
+        self.cache._ready = False
+
+        await self.get_row(1, self.db)
+        await self.get_row(1, self.db)
+
+        self.assertEqual(2, self.loads)
+        self.get_remote.assert_not_awaited()
+
+    async def test_bypassed_after_changes_in_transaction(self):
+        self.db.info["read_cache_changes"] = {"rows:2"}
+
+        await self.get_row(1, self.db)
+        await self.get_row(1, self.db)
+
+        self.assertEqual(2, self.loads)
+        self.put_remote.assert_not_awaited()
+
+
+class TestOrmSnapshot(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.snapshot = OrmSnapshot(Image, "tags")
+        self.db = MagicMock(spec=AsyncSession)
+        self.db.identity_map = {}
+        self.db.merge = AsyncMock(side_effect=lambda instance, load: instance)
+
+    def image(self, tags: list[Tag]) -> Image:
+        return Image(id=5, public_id="p", description="A photo of the sea", user_id=1, tags=tags,
+                     created_at=datetime(2023, 6, 1), avg_rating=0, ratings_count=0, ratings_sum=0)
+
+    async def test_image_with_tags(self):
+        data, tags = self.snapshot.dumps(self.image([Tag(id=3, name="sea"), Tag(id=4, name="sun")]))
+
+        self.assertEqual(["images", "images:5", "tags:3", "tags:4"], tags)
+        image = await self.snapshot.loads(data, self.db)
+        self.assertEqual((5, "A photo of the sea"), (image.id, image.description))
+        self.assertEqual([(3, "sea"), (4, "sun")], [(tag.id, tag.name) for tag in image.tags])
+
+    async def test_image_without_tags(self):
+        data, tags = self.snapshot.dumps(self.image([]))
+
+        self.assertEqual(["images", "images:5"], tags)
+        self.assertEqual([], (await self.snapshot.loads(data, self.db)).tags)
+
+
+class TestStatementTags(unittest.TestCase):
+    def test_primary_key(self):
+        self.assertEqual(["images:5"], _statement_tags(update(Image).where(Image.id == 5).values(ratings_count=1)))
+
+    def test_primary_key_and_other_filters(self):
+        statement = update(ImageComment).values(data="d").filter(ImageComment.id == 3, ImageComment.user_id == 2)
+
+        self.assertEqual(["image_comments:3"], _statement_tags(statement))
+
+    def test_other_filter_changes_the_table(self):
+        self.assertEqual(["image_comments"], _statement_tags(delete(ImageComment).where(ImageComment.image_id == 3)))
+        self.assertEqual(["images"], _statement_tags(update(Image).values(ratings_count=0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
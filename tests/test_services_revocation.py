@@ -0,0 +1,101 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from svitlogram.services.revocation import BloomFilter, RevocationStore
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_contains_added_items(self):
+        bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+        items = [f"revoked-token:{n}" for n in range(1000)]
+
+        for item in items:
+            bloom_filter.add(item)
+
+        self.assertTrue(all(item in bloom_filter for item in items))
+        self.assertEqual(1000, bloom_filter.count)
+
+    def test_error_rate(self):
+        bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+        for n in range(1000):
+            bloom_filter.add(f"revoked-token:{n}")
+
+        false_positives = sum(f"revoked-token:other-{n}" in bloom_filter for n in range(10_000))
+
+        self.assertLess(false_positives, 200)
+
+
+class TestRevocationStore(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.store = RevocationStore(capacity=1000, error_rate=0.01, rebuild_interval=60)
+
+        self.client = MagicMock()
+        self.client.__aenter__.return_value = self.client
+        self.client.mget = AsyncMock(return_value=[None])
+        self.pipe = MagicMock()
+        self.pipe.set.return_value = self.pipe
+        self.pipe.publish.return_value = self.pipe
+        self.pipe.execute = AsyncMock()
+        self.client.pipeline.return_value.__aenter__.return_value = self.pipe
+
+        redis = patch.object(RevocationStore, "_redis", return_value=self.client)
+        redis.start()
+        self.addCleanup(redis.stop)
+
+    async def load(self, *keys: str) -> None:
+        async def scan_iter(**kwargs):
+            for key in keys:
+                yield key.encode()
+
+        self.client.scan_iter = scan_iter
+        await self.store._rebuild(self.client)
+
+    async def test_not_loaded_asks_redis(self):
+        self.assertFalse(await self.store.is_revoked("jti"))
+
+        self.client.mget.assert_awaited_once_with(["revoked-token:jti"])
+
+    async def test_not_revoked_skips_redis(self):
+        await self.load("revoked-token:other")
+
+        self.assertFalse(await self.store.is_revoked("jti", "cat@example.com", 100))
+
+        self.client.mget.assert_not_called()
+        self.assertEqual(1, self.store.stats()["fast_path_rate"])
+
+    async def test_revoked_token(self):
+        await self.load("revoked-token:jti")
+        self.client.mget.return_value = [b"1"]
+
+        self.assertTrue(await self.store.is_revoked("jti"))
+
+    async def test_revoked_user(self):
+        await self.load("revoked-before:cat@example.com")
+        self.client.mget.return_value = [None, b"100.5"]
+
+        self.assertTrue(await self.store.is_revoked("jti", "cat@example.com", 100))
+        self.assertTrue(await self.store.is_revoked("jti", "cat@example.com", 100.25))
+        self.assertFalse(await self.store.is_revoked("jti", "cat@example.com", 100.5))
+        self.assertFalse(await self.store.is_revoked("jti", "cat@example.com", 101))
+        self.client.mget.assert_awaited_with(["revoked-token:jti", "revoked-before:cat@example.com"])
+
+    async def test_revoke_token(self):
+        await self.load()
+
+        await self.store.revoke_token("jti", 300)
+
+        self.pipe.set.assert_called_once_with("revoked-token:jti", 1, ex=300)
+        self.pipe.publish.assert_called_once_with("tokens:revoked", "revoked-token:jti")
+        self.client.mget.return_value = [b"1"]
+        self.assertTrue(await self.store.is_revoked("jti"))
+
+    async def test_revoke_during_rebuild(self):
+        async def scan_iter(**kwargs):
+            await self.store.revoke_user("cat@example.com", 100, 300)
+            yield b"revoked-token:jti"
+
+        self.client.scan_iter = scan_iter
+        await self.store._rebuild(self.client)
+        self.client.mget.return_value = [None, b"100"]
+
+        self.assertTrue(await self.store.is_revoked("other", "cat@example.com", 50))
@@ -0,0 +1,102 @@
+import io
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from svitlogram.services.cloudinary import FORMAT_AVATAR
+from svitlogram.services.storage import CloudinaryStorage, LocalStorage, create_storage
+from svitlogram.services.uploader import uploader
+
+CONTENT = b"\x89PNG\r\n\x1a\n" + b"pixels" * 1000
+DIGEST = "03d0cf913069ddc4c97e58ed6a01d2facb4ebed3647b989d46f7f20384a841d1"
+
+
+class TestLocalStorage(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = LocalStorage(directory.name, "/api/storage/", chunk_size=1000)
+        self.addAsyncCleanup(uploader.stop)
+
+    async def test_upload_content_addressed(self):
+        result = await self.storage.upload(io.BytesIO(CONTENT), "ignored", "image/png")
+
+        self.assertEqual({"url": f"/api/storage/{DIGEST}.png", "public_id": f"{DIGEST}.png", "version": None}, result)
+        self.assertEqual(CONTENT, self.storage.path(f"{DIGEST}.png").read_bytes())
+        self.assertEqual(DIGEST[:2], self.storage.path(f"{DIGEST}.png").parent.name)
+
+    async def test_same_content_stored_once(self):
+        first = await self.storage.upload(io.BytesIO(CONTENT), content_type="image/png")
+        second = await self.storage.upload(io.BytesIO(CONTENT), content_type="image/png")
+
+        self.assertEqual(first, second)
+        self.assertEqual([self.storage.path(first["public_id"])], [path for path in self.storage.root.rglob("*") if path.is_file()])
+
+    async def test_namespace_kept_apart(self):
+        image = await self.storage.upload(io.BytesIO(CONTENT), content_type="image/png")
+        avatar = await self.storage.upload(io.BytesIO(CONTENT), content_type="image/png", namespace="avatar")
+
+        self.assertEqual(f"avatar-{DIGEST}.png", avatar["public_id"])
+        self.assertEqual(DIGEST[:2], self.storage.path(avatar["public_id"]).parent.name)
+        self.assertTrue(await self.storage.remove(image["public_id"]))
+        self.assertTrue(await self.storage.exists(avatar["public_id"]))
+        self.assertFalse(await self.storage.exists(image["public_id"]))
+
+    async def test_empty_file_rejected(self):
+        self.assertIsNone(await self.storage.upload(io.BytesIO(b""), content_type="image/png"))
+        self.assertEqual([], list(self.storage.root.iterdir()))
+
+    async def test_unknown_content_type(self):
+        self.assertEqual(DIGEST, (await self.storage.upload(io.BytesIO(CONTENT)))["public_id"])
+        result = await self.storage.upload(io.BytesIO(CONTENT), content_type="image/nonsense")
+        self.assertEqual(DIGEST, result["public_id"])
+
+    async def test_remove(self):
+        public_id = (await self.storage.upload(io.BytesIO(CONTENT), content_type="image/png"))["public_id"]
+
+        self.assertTrue(await self.storage.remove(public_id))
+        self.assertFalse(self.storage.path(public_id).exists())
+        self.assertFalse(await self.storage.remove(public_id))
+
+    async def test_path_outside_the_root_refused(self):
+        for public_id in ("../config.py", "media/" + DIGEST, DIGEST + "/..", DIGEST.upper(), "../-" + DIGEST):
+            self.assertIsNone(self.storage.path(public_id))
+            self.assertFalse(await self.storage.remove(public_id))
+
+    async def test_transform_kept_in_url(self):
+        result = self.storage.transform(DIGEST, FORMAT_AVATAR)
+
+        self.assertEqual({"crop": "fill", "width": "250", "height": "250"}, result["format"])
+        self.assertEqual(f"/api/storage/{DIGEST}?width=250&height=250&crop=fill", result["url"])
+        self.assertEqual(result["url"], self.storage.url(DIGEST, result["format"]))
+        self.assertEqual(f"/api/storage/{DIGEST}", self.storage.url(DIGEST))
+
+
+class TestCloudinaryStorage(unittest.IsolatedAsyncioTestCase):
+    async def test_delegates_to_cloudinary(self):
+        storage = CloudinaryStorage()
+
+        with patch("svitlogram.services.cloudinary.upload_image", AsyncMock(return_value={"public_id": "media/1"})) as upload:
+            self.assertEqual({"public_id": "media/1"}, await storage.upload(io.BytesIO(CONTENT), "1", "image/png"))
+        upload.assert_awaited_once()
+        self.assertEqual("1", upload.call_args.args[1])
+
+        with patch("svitlogram.services.cloudinary.remove_image", AsyncMock(return_value=True)) as remove:
+            self.assertTrue(await storage.remove("media/1"))
+        remove.assert_awaited_once_with("media/1")
+
+        url = storage.url("media/1", {"width": 100, "crop": "scale"})
+        self.assertIn("c_scale,w_100", url)
+        self.assertTrue(url.endswith("/media/1"))
+
+
+class TestCreateStorage(unittest.TestCase):
+    def test_backends(self):
+        self.assertIsInstance(create_storage("local"), LocalStorage)
+        self.assertIsInstance(create_storage("cloudinary"), CloudinaryStorage)
+        with self.assertRaises(ValueError):
+            create_storage("s3")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+from svitlogram.services.tag_cache import TagCache, CachedTag
+
+
+def cached_tag(tag_id: int, name: str) -> CachedTag:
+    return CachedTag(id=tag_id, name=name, created_at=datetime(2023, 6, 1), updated_at=None)
+
+
+class TestTagCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = TagCache(maxsize=2, ttl=60)
+        self.cache._ready = True
+
+    def test_get_many_counts_hits_and_misses(self):
+        self.cache.put_many([cached_tag(1, "cat")])
+
+        found, missing = self.cache.get_many(["cat", "dog"])
+
+        self.assertEqual([cached_tag(1, "cat")], found)
+        self.assertEqual(["dog"], missing)
+        self.assertEqual((1, 1), (self.cache.hits, self.cache.misses))
+        self.assertEqual(0.5, self.cache.stats()["hit_rate"])
+
+    def test_put_many_evicts_least_recently_used(self):
+        self.cache.put_many([cached_tag(1, "cat"), cached_tag(2, "dog")])
+        self.cache.get_many(["cat"])
+
+        self.cache.put_many([cached_tag(3, "fox")])
+
+        found, missing = self.cache.get_many(["cat", "dog", "fox"])
+        self.assertEqual(["cat", "fox"], [tag.name for tag in found])
+        self.assertEqual(["dog"], missing)
+
+    def test_discard(self):
+        self.cache.put_many([cached_tag(1, "cat"), cached_tag(2, "dog")])
+
+        self.cache.discard(["cat", "unknown"])
+
+        self.assertEqual(1, self.cache.stats()["size"])
+        self.assertEqual(["cat"], self.cache.get_many(["cat"])[1])
+
+    def test_put_many_skips_tags_read_before_a_discard(self):
+        generation = self.cache.generation
+        self.cache.discard(["cat"])
+
+        self.cache.put_many([cached_tag(1, "cat")], generation)
+
+        self.assertEqual(["cat"], self.cache.get_many(["cat"])[1])
+
+    def test_entries_expire(self):
+        with patch("svitlogram.services.tag_cache.time.monotonic", return_value=100.0):
+            self.cache.put_many([cached_tag(1, "cat")])
+
+        with patch("svitlogram.services.tag_cache.time.monotonic", return_value=161.0):
+            found, missing = self.cache.get_many(["cat"])
+
+        self.assertEqual(([], ["cat"]), (found, missing))
+        self.assertEqual(0, self.cache.stats()["size"])
+
+    def test_bypassed_until_subscribed(self):
+        self.cache._lost()
+
+        self.cache.put_many([cached_tag(1, "cat")])
+
+        self.assertEqual(0, self.cache.stats()["size"])
+        self.assertEqual(["cat"], self.cache.get_many(["cat"])[1])
@@ -0,0 +1,52 @@
+import time
+import unittest
+
+from svitlogram.services.token_cache import TokenCache
+
+
+class TestTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = TokenCache(maxsize=2)
+        self.payload = {"sub": "cat@example.com", "exp": time.time() + 60}
+
+    def test_get_counts_hits_and_misses(self):
+        self.cache.put("token", self.payload)
+
+        self.assertIs(self.payload, self.cache.get("token"))
+        self.assertIsNone(self.cache.get("other"))
+        self.assertEqual(0.5, self.cache.stats()["hit_rate"])
+
+    def test_keyed_by_digest(self):
+        self.cache.put("token", self.payload)
+
+        self.assertEqual([TokenCache.digest("token")], list(self.cache._payloads))
+
+    def test_get_expired(self):
+        self.cache.put("token", {"sub": "cat@example.com", "exp": time.time() - 1})
+
+        self.assertIsNone(self.cache.get("token"))
+        self.assertEqual(0, self.cache.stats()["size"])
+
+    def test_put_evicts_least_recently_used(self):
+        self.cache.put("first", self.payload)
+        self.cache.put("second", self.payload)
+        self.cache.get("first")
+
+        self.cache.put("third", self.payload)
+
+        self.assertIsNotNone(self.cache.get("first"))
+        self.assertIsNone(self.cache.get("second"))
+
+    def test_disabled(self):
+        cache = TokenCache(maxsize=0)
+
+        cache.put("token", self.payload)
+
+        self.assertIsNone(cache.get("token"))
+
+    def test_discard(self):
+        self.cache.put("token", self.payload)
+
+        self.cache.discard("token")
+
+        self.assertIsNone(self.cache.get("token"))
@@ -0,0 +1,146 @@
+import asyncio
+import io
+import unittest
+from unittest.mock import patch
+
+import httpx
+from fastapi import HTTPException
+
+from svitlogram.services import cloudinary
+from svitlogram.services.uploader import Uploader
+
+URL = "https://api.example.com/upload"
+
+
+class TestUploader(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.uploader = Uploader(concurrency=2, max_pending=4, timeout=1, retries=2, backoff=0)
+        self.addAsyncCleanup(self.uploader.stop)
+
+        self.requests = []
+        self.responses = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            self.requests.append(request.read())
+            response = self.responses.pop(0) if self.responses else httpx.Response(200, json={"result": "ok"})
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        self.uploader._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    async def test_post_form_with_file(self):
+        result = await self.uploader.post(URL, {"public_id": "media/1"}, io.BytesIO(b"image content"))
+
+        self.assertEqual({"result": "ok"}, result)
+        self.assertIn(b'name="public_id"\r\n\r\nmedia/1', self.requests[0])
+        self.assertIn(b"image content", self.requests[0])
+        self.assertEqual(1, self.uploader.stats()["completed"])
+
+    async def test_retried_with_the_whole_file(self):
+        self.responses = [httpx.ConnectTimeout("timed out"), httpx.Response(503), httpx.Response(200, json={})]
+
+        self.assertEqual({}, await self.uploader.post(URL, {}, io.BytesIO(b"image content")))
+
+        self.assertEqual(3, len(self.requests))
+        self.assertTrue(all(b"image content" in body for body in self.requests))
+        self.assertEqual(2, self.uploader.stats()["retried"])
+
+    async def test_client_error_not_retried(self):
+        self.responses = [httpx.Response(400, json={"error": {"message": "Invalid image file"}})]
+
+        self.assertEqual({"error": {"message": "Invalid image file"}}, await self.uploader.post(URL, {}))
+        self.assertEqual(0, self.uploader.stats()["retried"])
+
+    async def test_unavailable_after_retries(self):
+        self.responses = [httpx.Response(429), httpx.Response(500), httpx.Response(502)]
+
+        with self.assertRaises(HTTPException) as error:
+            await self.uploader.post(URL, {})
+
+        self.assertEqual(503, error.exception.status_code)
+        self.assertEqual(3, len(self.requests))
+        self.assertEqual(1, self.uploader.stats()["failed"])
+
+    async def test_concurrency_bounded(self):
+        running, peak = 0, 0
+
+        def work():
+            return None
+
+        async def slow(*_):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        with patch.object(self.uploader, "_post", slow):
+            await asyncio.gather(*(self.uploader.post(URL, {}) for _ in range(3)), self.uploader.run(work))
+
+        self.assertEqual(2, peak)
+        stats = self.uploader.stats()
+        self.assertEqual((4, 0, 0), (stats["completed"], stats["pending"], stats["queued"]))
+        self.assertEqual(2, stats["peak_queued"])
+
+    async def test_rejected_above_max_pending(self):
+        async def slow(*_):
+            await asyncio.sleep(0.01)
+
+        with patch.object(self.uploader, "_post", slow):
+            results = await asyncio.gather(*(self.uploader.post(URL, {}) for _ in range(6)), return_exceptions=True)
+
+        self.assertEqual([None] * 4, results[:4])
+        self.assertTrue(all(isinstance(result, HTTPException) and result.status_code == 503 for result in results[4:]))
+        self.assertEqual(2, self.uploader.stats()["rejected"])
+
+    async def test_cancelled_while_queued(self):
+        async def slow(*_):
+            await asyncio.sleep(1)
+
+        with patch.object(self.uploader, "_post", slow):
+            tasks = [asyncio.create_task(self.uploader.post(URL, {})) for _ in range(3)]
+            await asyncio.sleep(0)
+            self.assertEqual(1, self.uploader.stats()["queued"])
+
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.assertEqual((0, 0), (self.uploader.stats()["pending"], self.uploader.stats()["queued"]))
+
+
+class TestCloudinaryUpload(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        for name, value in (("api_key", "1234"), ("api_secret", "secret")):
+            credential = patch.object(cloudinary.cloudinary.config(), name, value)
+            credential.start()
+            self.addCleanup(credential.stop)
+
+    async def test_signed_upload(self):
+        uploaded = {"secure_url": "https://res.cloudinary.com/x/media/1", "public_id": "media/1", "version": 7}
+
+        with patch("svitlogram.services.cloudinary.uploader.post", return_value=uploaded) as post:
+            image = await cloudinary.upload_image(io.BytesIO(b"image"), "1")
+
+        self.assertEqual({"url": uploaded["secure_url"], "public_id": "media/1", "version": 7}, image)
+        url, data, _ = post.await_args.args
+        self.assertTrue(url.endswith("/image/upload"))
+        self.assertEqual(("1", "media", "1"), (data["public_id"], data["folder"], data["overwrite"]))
+        self.assertIn("signature", data)
+        self.assertIn("timestamp", data)
+
+    async def test_rejected_upload(self):
+        with patch("svitlogram.services.cloudinary.uploader.post", return_value={"error": {"message": "Invalid"}}):
+            self.assertIsNone(await cloudinary.upload_image(io.BytesIO(b"image")))
+
+    async def test_remove(self):
+        with patch("svitlogram.services.cloudinary.uploader.post", return_value={"result": "not found"}) as post:
+            self.assertFalse(await cloudinary.remove_image("media/1"))
+
+        self.assertTrue(post.await_args.args[0].endswith("/image/destroy"))
+        self.assertEqual("media/1", post.await_args.args[1]["public_id"])
+
+
+if __name__ == '__main__':
+    unittest.main()
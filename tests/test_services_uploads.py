@@ -0,0 +1,233 @@
+import asyncio
+import io
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, call, patch
+
+from fastapi import HTTPException
+
+from svitlogram.services.ingest import IngestedFile
+from svitlogram.services.uploader import uploader
+from svitlogram.services.uploads import UploadJobs, UploadJobStatus, store_image, remove_unused_file
+
+CONTENT = b"\xff\xd8\xff\xe0" + b"jpeg data" * 100
+
+
+class TestStoreImage(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.db = AsyncMock()
+        self.ingested = IngestedFile(file=io.BytesIO(CONTENT), content_type="image/jpeg", size=len(CONTENT),
+                                     sha256="0" * 64)
+
+        self.backend = MagicMock()
+        self.backend.upload = AsyncMock(return_value={"url": "/api/storage/new", "public_id": "new", "version": None})
+        self.backend.remove = AsyncMock(return_value=True)
+        self.backend.exists = AsyncMock(return_value=True)
+        backend = patch("svitlogram.services.storage.backend", self.backend)
+        backend.start()
+        self.addCleanup(backend.stop)
+
+        self.repository = MagicMock()
+        self.repository.acquire_file = AsyncMock(return_value=None)
+        self.repository.add_file = AsyncMock(return_value="new")
+        self.repository.create_image = AsyncMock(return_value=MagicMock(id=7))
+        self.repository.is_file_unused = AsyncMock(return_value=True)
+        repository = patch("svitlogram.services.uploads.repository_images", self.repository)
+        repository.start()
+        self.addCleanup(repository.stop)
+
+    async def test_uploaded(self):
+        self.assertEqual((await store_image(self.ingested, 1, "", [], self.db)).id, 7)
+        self.repository.create_image.assert_awaited_once_with(1, "", [], "new", self.db, content_hash="0" * 64)
+        self.backend.remove.assert_not_awaited()
+
+    async def test_uploaded_again_when_removed_meanwhile(self):
+        self.backend.exists.return_value = False
+        contents = []
+
+        async def upload(file, **kwargs):
+            contents.append(file.read())
+            return {"url": "/api/storage/new", "public_id": "new", "version": None}
+
+        self.backend.upload.side_effect = upload
+        await store_image(self.ingested, 1, "", [], self.db)
+
+        self.assertEqual(contents, [CONTENT, CONTENT])
+
+    async def test_uploaded_file_removed_when_image_not_created(self):
+        self.repository.create_image.side_effect = ConnectionResetError
+
+        with self.assertRaises(ConnectionResetError):
+            await store_image(self.ingested, 1, "", ["sea"], self.db)
+
+        self.backend.remove.assert_awaited_once_with("new")
+        self.db.rollback.assert_awaited_once()
+        self.repository.is_file_unused.assert_awaited_once_with("0" * 64, "new", self.db)
+
+    async def test_uploaded_file_kept_when_referenced_meanwhile(self):
+        self.repository.create_image.side_effect = ConnectionResetError
+        self.repository.is_file_unused.return_value = False
+
+        with self.assertRaises(ConnectionResetError):
+            await store_image(self.ingested, 1, "", [], self.db)
+
+        self.backend.remove.assert_not_awaited()
+        self.db.commit.assert_awaited_once()
+
+    async def test_remove_unused_file(self):
+        self.assertTrue(await remove_unused_file("0" * 64, "new", self.db))
+        self.backend.remove.assert_awaited_once_with("new")
+        self.db.commit.assert_awaited_once()
+
+    async def test_shared_file_kept_when_image_not_created(self):
+        self.repository.acquire_file.return_value = "stored"
+        self.repository.create_image.side_effect = ConnectionResetError
+
+        with self.assertRaises(ConnectionResetError):
+            await store_image(self.ingested, 1, "", ["sea"], self.db)
+
+        self.backend.upload.assert_not_awaited()
+        self.backend.remove.assert_not_awaited()
+        self.db.rollback.assert_awaited_once()
+
+
+class TestUploadJobs(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.spool_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.spool_dir)
+        self.jobs = UploadJobs(self.spool_dir, workers=0, max_pending=2, ttl=60)
+        await self.jobs.start()
+        self.addAsyncCleanup(uploader.stop)
+
+        self.save = AsyncMock()
+        save = patch.object(self.jobs, "_save", self.save)
+        save.start()
+        self.addCleanup(save.stop)
+
+        self.store_image = AsyncMock(return_value=MagicMock(id=7))
+        store_image = patch("svitlogram.services.uploads.store_image", self.store_image)
+        store_image.start()
+        self.addCleanup(store_image.stop)
+
+        self.session_factory = MagicMock()
+        self.db = MagicMock()
+        self.session_factory.return_value.__aenter__.return_value = self.db
+
+    async def submit(self) -> str:
+        ingested = IngestedFile(file=io.BytesIO(CONTENT), content_type="image/jpeg", size=len(CONTENT), sha256="0" * 64)
+        return await self.jobs.submit(ingested, 1, "A photo of the sea", ["sea"], self.session_factory)
+
+    async def test_submit_spools_file(self):
+        job_id = await self.submit()
+
+        self.assertEqual((self.spool_dir / job_id).read_bytes(), CONTENT)
+        self.save.assert_awaited_once_with(job_id, status=UploadJobStatus.QUEUED, user_id=1)
+        self.assertEqual(self.jobs.stats()["queued"], 1)
+
+    async def test_submit_rejected_when_full(self):
+        await self.submit()
+        await self.submit()
+
+        with self.assertRaises(HTTPException) as e:
+            await self.submit()
+
+        self.assertEqual(e.exception.status_code, 503)
+        self.assertEqual(self.jobs.stats()["rejected"], 1)
+        self.assertEqual(len(list(self.spool_dir.iterdir())), 2)
+
+    async def test_run_done(self):
+        job_id = await self.submit()
+        job = self.jobs._queue.get_nowait()
+
+        async def store_image(ingested, *args):
+            self.assertEqual(ingested.file.read(), CONTENT)
+            return MagicMock(id=7)
+
+        self.store_image.side_effect = store_image
+        await self.jobs._run(job)
+
+        self.store_image.assert_awaited_once()
+        self.assertEqual(self.store_image.await_args.args[1:], (1, "A photo of the sea", ["sea"], self.db))
+        self.assertEqual(self.save.await_args_list[1:], [
+            call(job_id, status=UploadJobStatus.PROCESSING),
+            call(job_id, status=UploadJobStatus.DONE, image_id=7),
+        ])
+        self.assertFalse(job.path.exists())
+        self.assertEqual(self.jobs.stats()["completed"], 1)
+
+    async def test_run_failed(self):
+        job_id = await self.submit()
+        job = self.jobs._queue.get_nowait()
+        self.store_image.side_effect = HTTPException(status_code=422, detail="Invalid image file")
+
+        await self.jobs._run(job)
+
+        self.save.assert_awaited_with(job_id, status=UploadJobStatus.FAILED, detail="Invalid image file")
+        self.assertFalse(job.path.exists())
+        self.assertEqual(self.jobs.stats()["failed"], 1)
+
+    async def test_run_error_not_shown(self):
+        job_id = await self.submit()
+        job = self.jobs._queue.get_nowait()
+        self.store_image.side_effect = ConnectionResetError("connection to the database was lost")
+
+        with self.assertLogs(level="ERROR"):
+            await self.jobs._run(job)
+
+        self.save.assert_awaited_with(job_id, status=UploadJobStatus.FAILED, detail="The image could not be stored")
+
+    async def test_workers_run_jobs(self):
+        await self.jobs.stop()
+        self.jobs.workers = 2
+        await self.jobs.start()
+
+        job_ids = [await self.submit(), await self.submit()]
+        await asyncio.wait_for(self.jobs._queue.join(), 5)
+
+        for job_id in job_ids:
+            self.save.assert_any_await(job_id, status=UploadJobStatus.DONE, image_id=7)
+        self.assertEqual(self.jobs.stats()["workers"], 2)
+        await self.jobs.stop()
+
+    async def test_stop_fails_queued_jobs(self):
+        job_id = await self.submit()
+
+        await self.jobs.stop()
+
+        self.save.assert_awaited_with(job_id, status=UploadJobStatus.FAILED,
+                                      detail="The server stopped before the image was stored, upload it again")
+        self.assertEqual(list(self.spool_dir.iterdir()), [])
+
+    async def test_get(self):
+        client = MagicMock()
+        client.__aenter__.return_value = client
+        client.hgetall = AsyncMock(side_effect=[
+            {b"status": b"done", b"user_id": b"1", b"image_id": b"7"},
+            {},
+        ])
+
+        with patch.object(UploadJobs, "_redis", return_value=client):
+            self.assertEqual(await self.jobs.get("job"), {
+                "job_id": "job", "status": UploadJobStatus.DONE, "user_id": 1, "image_id": 7, "detail": None
+            })
+            self.assertIsNone(await self.jobs.get("expired"))
+
+        client.hgetall.assert_awaited_with("upload-job:expired")
+
+    async def test_wait_polls_until_done(self):
+        self.jobs.poll_interval = 0.01
+        states = [{"status": UploadJobStatus.QUEUED}, {"status": UploadJobStatus.PROCESSING},
+                  {"status": UploadJobStatus.DONE}]
+
+        with patch.object(UploadJobs, "get", AsyncMock(side_effect=states)) as get:
+            self.assertEqual(await self.jobs.wait("job", 5), {"status": UploadJobStatus.DONE})
+
+        self.assertEqual(get.await_count, 3)
+
+    async def test_wait_timeout(self):
+        self.jobs.poll_interval = 0.01
+
+        with patch.object(UploadJobs, "get", AsyncMock(return_value={"status": UploadJobStatus.QUEUED})):
+            self.assertEqual(await self.jobs.wait("job", 0.05), {"status": UploadJobStatus.QUEUED})
@@ -0,0 +1,94 @@
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+from svitlogram.database.models import User, UserRole
+from svitlogram.services.user_cache import UserCache, CachedUser
+
+
+def cached_user(user_id: int, email: str) -> CachedUser:
+    return CachedUser(
+        id=user_id, username=f"user{user_id}", email=email, password="hash", first_name="first_name",
+        last_name="last_name", avatar=None, role=UserRole.user, email_verified=True, is_active=True,
+        created_at=datetime(2023, 6, 1, 12, 30), updated_at=None,
+    )
+
+
+class TestCachedUser(unittest.TestCase):
+    def test_dumps_loads(self):
+        user = cached_user(1, "cat@example.com")
+
+        self.assertEqual(user, CachedUser.loads(user.dumps()))
+
+    def test_loads_updated_at(self):
+        data = cached_user(1, "cat@example.com").dumps().replace(b",null]", b',"2023-06-02T08:00:00"]')
+
+        user = CachedUser.loads(data)
+
+        self.assertEqual(datetime(2023, 6, 2, 8), user.updated_at)
+        self.assertIs(UserRole.user, user.role)
+
+    def test_loads_invalid_data(self):
+        for data in (b"\x80\x04\x95", b"[1, 2]", b"null"):
+            with self.assertRaises(ValueError):
+                CachedUser.loads(data)
+
+    def test_from_user(self):
+        user = User(
+            id=1, username="user1", email="cat@example.com", password="hash", first_name="first_name",
+            last_name="last_name", role="user", email_verified=True, is_active=True,
+            created_at=datetime(2023, 6, 1, 12, 30),
+        )
+
+        self.assertEqual(cached_user(1, "cat@example.com"), CachedUser.from_user(user))
+
+    def test_frozen(self):
+        with self.assertRaises(AttributeError):
+            cached_user(1, "cat@example.com").is_active = False
+
+
+class TestUserCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = UserCache(maxsize=2, ttl=10)
+
+    def test_get_counts_hits_and_misses(self):
+        self.cache.put(cached_user(1, "cat@example.com"))
+
+        self.assertEqual(1, self.cache.get("cat@example.com").id)
+        self.assertIsNone(self.cache.get("dog@example.com"))
+        self.assertEqual(0.5, self.cache.stats()["hit_rate"])
+
+    def test_get_expired(self):
+        with patch("svitlogram.services.user_cache.time.monotonic", return_value=100):
+            self.cache.put(cached_user(1, "cat@example.com"))
+        with patch("svitlogram.services.user_cache.time.monotonic", return_value=111):
+            self.assertIsNone(self.cache.get("cat@example.com"))
+
+        self.assertEqual(0, self.cache.stats()["size"])
+
+    def test_put_evicts_least_recently_used(self):
+        self.cache.put(cached_user(1, "cat@example.com"))
+        self.cache.put(cached_user(2, "dog@example.com"))
+        self.cache.get("cat@example.com")
+
+        self.cache.put(cached_user(3, "fox@example.com"))
+
+        self.assertIsNotNone(self.cache.get("cat@example.com"))
+        self.assertIsNone(self.cache.get("dog@example.com"))
+
+    def test_discard(self):
+        self.cache.put(cached_user(1, "cat@example.com"))
+
+        self.cache.discard(["cat@example.com", "unknown@example.com"])
+
+        self.assertIsNone(self.cache.get("cat@example.com"))
+
+    def test_put_skipped_after_discard(self):
+        generation = self.cache.generation
+        self.cache.discard(["cat@example.com"])
+
+        self.cache.put(cached_user(1, "cat@example.com"), generation)
+        self.assertIsNone(self.cache.get("cat@example.com"))
+
+        self.cache.put(cached_user(1, "cat@example.com"), self.cache.generation)
+        self.assertIsNotNone(self.cache.get("cat@example.com"))